@@ -0,0 +1,288 @@
+"""
+Compares the run times of the primer search engines on a synthetic corpus. The
+blastn engine records its searches, which the replay engine then answers
+without BLAST, so matching results only show that recordings round-trip. The
+crawl output of replayed searches is checked against expected output by
+tests/test_engines.py, whose corpus --record writes.
+
+Usage: python benchmarks/engine_conformance.py [--assemblies N] [--targets N] [--seed N] [--keep DIR]
+       python benchmarks/engine_conformance.py --record DIR
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+# Search modes every engine is checked with, as crawl keyword arguments
+MODES = {
+    "default": {},
+    "adaptive": {"adaptive": True},
+    "seed": {"seed": True},
+    "blast_jobs=4": {"blast_jobs": 4},
+}
+# Crawls recorded by --record for tests/test_engines.py, as
+# (assemblies, database, slide limit, crawl keyword arguments)
+FIXTURE_MODES = {
+    "default": (("assembly_0.fasta",), "targets.fasta", 5, {}),
+    "adaptive": (("assembly_0.fasta",), "targets.fasta", 5, {"adaptive": True}),
+    "seed": (("assembly_0.fasta",), "targets.fasta", 5, {"seed": True}),
+    # Slides longer than the short targets, so seed regions are cut to the reference
+    "clamped": (("assembly_1.fasta",), "short_targets.fasta", 50, {}),
+    "seed_clamped": (("assembly_1.fasta",), "short_targets.fasta", 50, {"seed": True}),
+    # Primers matching more subjects than BLAST reports, searched one assembly at a time and as a batch
+    "repeats": (("assembly_2.fasta", "assembly_1.fasta"), "short_targets.fasta", 5, {}),
+    "seed_repeats": (("assembly_2.fasta", "assembly_1.fasta"), "short_targets.fasta", 5, {"seed": True}),
+    # More primer matches and candidate pairs than the caps allow
+    "capped": (("assembly_3.fasta",), "short_targets.fasta", 5, {"max_primer_hits": 50, "max_primer_pairs": 20}),
+}
+# Modes whose assemblies are also crawled as a single batch
+FIXTURE_BATCH_MODES = ("repeats", "seed_repeats")
+FIXTURE_TARGETS = 6
+FIXTURE_SEED = 12
+
+def random_sequence(rng, length):
+    """
+    Returns a random DNA sequence.
+    """
+    return "".join(rng.choice("ACGT") for _ in range(length))
+
+def mutate(rng, sequence, rate):
+    """
+    Returns a copy of a sequence with substitutions at the given rate.
+    """
+    return "".join(rng.choice("ACGT".replace(base, "")) if rng.random() < rate else base for base in sequence)
+
+def reverse_complement(sequence):
+    """
+    Returns the reverse complement of a DNA sequence.
+    """
+    return sequence[::-1].translate(str.maketrans("ACGT", "TGCA"))
+
+def write_corpus(directory, assemblies, targets, seed):
+    """
+    Writes a database of targets and assemblies that carry some of them: exact
+    and mutated copies, on either strand, with primer sites changed so that
+    primers have to slide, and truncated copies that fail the length limit.
+
+    Returns:
+        database -- Location of the database
+        fastas -- Locations of the assemblies
+    """
+    rng = random.Random(seed)
+    genes = [random_sequence(rng, rng.randint(300, 1500)) for _ in range(targets)]
+    database = f"{directory}/targets.fasta"
+    with open(database, "w") as handle:
+        for i, gene in enumerate(genes):
+            handle.write(f">gene{i} synthetic target {i} [Synthetica example]\n{gene}\n")
+    fastas = []
+    for a in range(assemblies):
+        contigs = []
+        for c in range(rng.randint(2, 6)):
+            parts = [random_sequence(rng, rng.randint(1000, 5000))]
+            for gene in rng.sample(genes, k=max(1, targets // 3)):
+                copy = mutate(rng, gene, rng.choice([0, 0.01, 0.05]))
+                kind = rng.random()
+                if kind < 0.2:
+                    # Change both primer sites so primers have to slide
+                    copy = mutate(rng, copy[:10], 0.5) + copy[10:-10] + mutate(rng, copy[-10:], 0.5)
+                elif kind < 0.3:
+                    copy = copy[:len(copy) // 2]
+                if rng.random() < 0.5:
+                    copy = reverse_complement(copy)
+                parts += [copy, random_sequence(rng, rng.randint(200, 2000))]
+            contigs.append("".join(parts))
+        fasta = f"{directory}/assembly_{a}.fasta"
+        with open(fasta, "w") as handle:
+            for c, contig in enumerate(contigs):
+                handle.write(f">contig_{c}\n{contig}\n")
+        fastas.append(fasta)
+    return database, fastas
+
+def write_short_corpus(directory, seed):
+    """
+    Writes a database of targets barely longer than a primer and an assembly
+    that carries them on both strands, one with a changed reverse primer site.
+
+    Returns:
+        genes -- Sequences of the targets
+    """
+    rng = random.Random(seed)
+    genes = [random_sequence(rng, length) for length in (30, 34, 36)]
+    database = f"{directory}/short_targets.fasta"
+    with open(database, "w") as handle:
+        for i, gene in enumerate(genes):
+            handle.write(f">short{i} synthetic short target {i} [Synthetica example]\n{gene}\n")
+    copies = [genes[0], reverse_complement(genes[1]), genes[2][:-3] + mutate(rng, genes[2][-3:], 1)]
+    parts = [random_sequence(rng, 1000)]
+    for copy in copies:
+        parts += [copy, random_sequence(rng, 1000)]
+    fasta = f"{directory}/assembly_1.fasta"
+    with open(fasta, "w") as handle:
+        handle.write(f">contig_0\n{''.join(parts)}\n")
+    return genes
+
+def write_repeat_corpus(directory, genes, seed):
+    """
+    Writes an assembly in which the forward primers of the first two short
+    targets match more contigs than a search reports (BLAST_DEFAULT_MAX_TARGET_SEQS).
+    Only the last contigs of each carry a complete copy of the target, so the
+    amplicons are lost when a search reports the wrong subjects. The first
+    target matches enough contigs to fill the subjects of a batch of two
+    assemblies.
+
+    Arguments:
+        directory -- Directory of the corpus
+        genes -- Short targets from write_short_corpus
+        seed -- Random seed
+    """
+    from helpers.settings import BLAST_DEFAULT_MAX_TARGET_SEQS
+
+    rng = random.Random(seed)
+    complete = 100
+    copies = [2 * BLAST_DEFAULT_MAX_TARGET_SEQS + complete, BLAST_DEFAULT_MAX_TARGET_SEQS + complete]
+    with open(f"{directory}/assembly_2.fasta", "w") as handle:
+        for c in range(copies[0]):
+            parts = [random_sequence(rng, 10)]
+            for gene, count in zip(genes, copies):
+                if c < count - complete:
+                    # Change the reverse primer site
+                    parts += [gene[:-3] + mutate(rng, gene[-3:], 1), random_sequence(rng, 10)]
+                elif c < count:
+                    parts += [gene, random_sequence(rng, 10)]
+            handle.write(f">c{c}\n{''.join(parts)}\n")
+
+def write_decoy_corpus(directory, genes, seed):
+    """
+    Writes an assembly with many copies of the forward primer site of the
+    last short target ahead of a single complete copy, so its matches and
+    candidate pairs are capped and the complete copy is last in BLAST order.
+
+    Arguments:
+        directory -- Directory of the corpus
+        genes -- Short targets from write_short_corpus
+        seed -- Random seed
+    """
+    # Seeded apart from write_short_corpus, so the flanks do not repeat its targets
+    rng = random.Random(seed + 1)
+    gene = genes[-1]
+    parts = [random_sequence(rng, 100)]
+    for _ in range(120):
+        parts += [gene[:20], random_sequence(rng, 10)]
+    parts += [random_sequence(rng, 100), gene, random_sequence(rng, 100)]
+    with open(f"{directory}/assembly_3.fasta", "w") as handle:
+        handle.write(f">contig_0\n{''.join(parts)}\n")
+
+def crawl_batch_corpus(fastas, database, engine, options, slide_limit=5):
+    """
+    Crawls the assemblies of the corpus as a single batch with an engine.
+
+    Returns:
+        results -- Concatenated results table
+    """
+    from helpers.crawler import crawl_batch, concat_results
+
+    return concat_results(crawl_batch(list(fastas), database, slide_limit, 20, 0, 20, True, True, None, engine=engine, **options))
+
+def crawl_corpus(fastas, database, engine, options, slide_limit=5):
+    """
+    Crawls every assembly of the corpus with an engine.
+
+    Returns:
+        results -- Concatenated results table
+        seconds -- Wall time of the crawl
+    """
+    from helpers.crawler import crawl, concat_results
+
+    start = time.perf_counter()
+    tables = [crawl(fasta, database, slide_limit, 20, 0, 20, True, True, None, engine=engine, **options) for fasta in fastas]
+    return concat_results(tables), time.perf_counter() - start
+
+def record_fixture(directory):
+    """
+    Writes the corpus of tests/test_engines.py: small assemblies and databases,
+    the blastn searches of every mode in FIXTURE_MODES recorded in hits/, and
+    the crawl output of each mode in expected_{mode}.tsv.
+
+    Arguments:
+        directory -- Directory of the fixture
+    """
+    from helpers.engines import make_engine
+
+    write_corpus(directory, 1, FIXTURE_TARGETS, FIXTURE_SEED)
+    genes = write_short_corpus(directory, FIXTURE_SEED)
+    write_repeat_corpus(directory, genes, FIXTURE_SEED)
+    write_decoy_corpus(directory, genes, FIXTURE_SEED)
+    os.chdir(directory)
+    # Crawled by relative name, so the Query column does not depend on the directory
+    for mode, (fastas, database, slide_limit, options) in FIXTURE_MODES.items():
+        results, _ = crawl_corpus(fastas, database, make_engine("blastn", "hits"), options, slide_limit)
+        results.to_csv(f"expected_{mode}.tsv", sep="\t", index=None, na_rep="NA")
+        if mode in FIXTURE_BATCH_MODES:
+            batch_results = crawl_batch_corpus(fastas, database, make_engine("blastn", "hits"), options, slide_limit)
+            if not batch_results.astype(object).equals(results.astype(object)):
+                print(f"WARNING: the batch crawl of {mode} differs from crawling one assembly at a time", file=sys.stderr)
+    # Packed genome written next to the assembly by crawl
+    for name in os.listdir(directory):
+        if name.endswith(".spk"):
+            os.remove(name)
+
+def main():
+    parser = argparse.ArgumentParser(description="SPIDER search engine conformance check")
+    parser.add_argument("--assemblies", type=int, default=4, help="Number of synthetic assemblies. Default: 4")
+    parser.add_argument("--targets", type=int, default=30, help="Number of synthetic targets. Default: 30")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed of the corpus. Default: 1")
+    parser.add_argument("--keep", type=str, help="Write the corpus and recordings to this directory and keep them")
+    parser.add_argument("--record", type=str, help="Write the recorded corpus of tests/test_engines.py to this directory (e.g. tests/data/engines) and exit")
+    args = parser.parse_args()
+
+    if not shutil.which("blastn") or not shutil.which("makeblastdb"):
+        print("FAIL: blastn and makeblastdb must be on the PATH to record the searches", file=sys.stderr)
+        sys.exit(2)
+
+    if args.record:
+        os.makedirs(args.record, exist_ok=True)
+        record_fixture(os.path.abspath(args.record))
+        sys.exit(0)
+
+    from helpers.engines import make_engine
+    from helpers.settings import SEARCH_ENGINES
+
+    directory = args.keep or tempfile.mkdtemp(prefix="spider_conformance_")
+    os.makedirs(directory, exist_ok=True)
+    # crawl works in temporary folders of the current directory
+    os.chdir(directory)
+    try:
+        database, fastas = write_corpus(directory, args.assemblies, args.targets, args.seed)
+        rows = []
+        failed = False
+        for mode, options in MODES.items():
+            hits = f"{directory}/hits_{mode}"
+            # blastn runs first, and records the searches the other engines use
+            reference, seconds = crawl_corpus(fastas, database, make_engine("blastn", hits), options)
+            rows.append((mode, "blastn", seconds, len(reference), int(reference["Valid"].sum()), "reference"))
+            for name in SEARCH_ENGINES:
+                if name == "blastn":
+                    continue
+                results, seconds = crawl_corpus(fastas, database, make_engine(name, hits), options)
+                identical = results.astype(object).equals(reference.astype(object))
+                failed |= not identical
+                rows.append((mode, name, seconds, len(results), int(results["Valid"].sum()), "identical" if identical else "DIFFERENT"))
+    finally:
+        if not args.keep:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    print(f"{'Mode':<14}{'Engine':<10}{'Seconds':>10}{'Rows':>8}{'Valid':>8}  Results")
+    for mode, name, seconds, count, valid, status in rows:
+        print(f"{mode:<14}{name:<10}{seconds:>10.3f}{count:>8}{valid:>8}  {status}")
+    if failed:
+        print("FAIL: an engine gave different results from blastn", file=sys.stderr)
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
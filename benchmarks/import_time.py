@@ -0,0 +1,61 @@
+"""
+Measures how long it takes to start SPIDER for commands that do not crawl
+(e.g. --list_dbs) and checks that it stays under a time budget.
+
+Usage: python benchmarks/import_time.py [--budget SECONDS] [--repeats N]
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+# Default budget for a full `spider.py --list_dbs` invocation including interpreter startup
+DEFAULT_BUDGET = 0.25
+# Modules that must not be imported until a crawl or extraction needs them
+HEAVY_MODULES = ("pandas", "numpy", "pyfaidx", "Bio")
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def time_list_dbs(repeats):
+    """
+    Times `spider.py --list_dbs` and returns the best wall time of several runs.
+    """
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, os.path.join(REPO_DIR, "spider.py"), "--list_dbs"],
+                       cwd=REPO_DIR, stdout=subprocess.DEVNULL, check=True)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+def heavy_modules_loaded():
+    """
+    Returns the heavy modules that are loaded by importing spider.py.
+    """
+    check = ("import sys, spider; "
+             f"print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))")
+    output = subprocess.run([sys.executable, "-c", check], cwd=REPO_DIR,
+                            capture_output=True, text=True, check=True).stdout.strip()
+    return [module for module in output.split(",") if module]
+
+def main():
+    parser = argparse.ArgumentParser(description="SPIDER startup time benchmark")
+    parser.add_argument("--budget", type=float, default=DEFAULT_BUDGET, help=f"Maximum allowed seconds. Default: {DEFAULT_BUDGET}")
+    parser.add_argument("--repeats", type=int, default=5, help="Number of runs, the fastest is reported. Default: 5")
+    args = parser.parse_args()
+
+    loaded = heavy_modules_loaded()
+    best = time_list_dbs(args.repeats)
+    print(f"spider.py --list_dbs: {best:.3f}s (budget {args.budget:.3f}s)")
+
+    failed = False
+    if loaded:
+        print(f"FAIL: importing spider.py loads {', '.join(loaded)}", file=sys.stderr)
+        failed = True
+    if best > args.budget:
+        print("FAIL: startup exceeded the time budget", file=sys.stderr)
+        failed = True
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
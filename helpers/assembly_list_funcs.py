@@ -1,4 +1,5 @@
 import os
+from helpers.settings import FASTA_EXTENSIONS
 
 def parse_list(list):
     """
@@ -49,14 +50,14 @@ def parse_directory(directory):
         directory -- Path to directory that contains assemblies
 
     Return:
-        fasta_list -- List of fasta files in the directory
+        fasta_list -- List of fasta files in the directory, sorted by name
     """
     # Store fasta files in the directory
     fasta_list = []
     
     # Fine all files in the directory
-    for file in os.listdir(directory):
-        if file.endswith(".fasta") or file.endswith(".fna"):
+    for file in sorted(os.listdir(directory)):
+        if file.endswith(FASTA_EXTENSIONS):
             fasta_list.append(f"{directory}/{file}")
 
     return fasta_list
\ No newline at end of file
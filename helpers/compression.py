@@ -0,0 +1,158 @@
+import gzip
+import os
+import shutil
+import subprocess
+
+# First bytes of any gzip member
+GZIP_MAGIC = b"\x1f\x8b"
+
+def is_gzipped(file):
+    """
+    Checks if a file is gzip compressed (this includes BGZF files).
+
+    Arguments:
+        file -- Path to the file
+
+    Returns:
+        True/False if the file starts with the gzip magic number
+    """
+    with open(file, "rb") as handle:
+        return handle.read(2) == GZIP_MAGIC
+
+def is_bgzf(file):
+    """
+    Checks if a file is BGZF compressed (e.g. the output of bgzip). BGZF files
+    are gzip files whose first member carries a "BC" extra subfield, and can be
+    accessed randomly without decompressing the whole file.
+
+    Arguments:
+        file -- Path to the file
+
+    Returns:
+        True/False if the file is in BGZF format
+    """
+    with open(file, "rb") as handle:
+        header = handle.read(18)
+    # Magic number, deflate method, FEXTRA flag set, BC subfield of length 2
+    return (len(header) == 18 and header[:2] == GZIP_MAGIC and header[2] == 8
+            and header[3] & 4 == 4 and header[12:14] == b"BC" and header[14:16] == b"\x02\x00")
+
+def decompress_command(file):
+    """
+    Finds an external tool that can decompress the file using multiple threads.
+    bgzip decompresses BGZF blocks in parallel, pigz offloads reading, writing
+    and checksums to separate threads.
+
+    Arguments:
+        file -- Path to the compressed file
+
+    Returns:
+        cmd -- Command that writes the decompressed file to stdout or None if no tool is available
+    """
+    threads = str(os.cpu_count() or 1)
+    if is_bgzf(file) and shutil.which("bgzip"):
+        return ["bgzip", "-dc", "-@", threads, file]
+    if shutil.which("pigz"):
+        return ["pigz", "-dc", "-p", threads, file]
+    return None
+
+def copy_assembly(fasta, destination):
+    """
+    Copies an assembly to a destination as plain FASTA. Compressed assemblies
+    are streamed through a decompressor so they never need to be unpacked
+    next to the original file.
+
+    Arguments:
+        fasta -- Location of the assembly (plain, gzip or BGZF)
+        destination -- Location of the uncompressed copy
+    """
+    if not is_gzipped(fasta):
+        shutil.copy(fasta, destination)
+        return
+
+    cmd = decompress_command(fasta)
+    with open(destination, "wb") as out:
+        if cmd:
+            process = subprocess.run(cmd, stdout=out, stderr=subprocess.DEVNULL)
+            if process.returncode == 0:
+                return
+            # Fall back to python decompression if external tool failed
+            out.seek(0)
+            out.truncate()
+        with gzip.open(fasta, "rb") as handle:
+            shutil.copyfileobj(handle, out, length=1024 * 1024)
+
+def split_assembly(fasta, destination_prefix, chunk_bases):
+    """
+    Splits an assembly into FASTA files of whole contigs, each holding about
+    chunk_bases bases. Contigs are never split, so a contig longer than
+    chunk_bases is written to a chunk of its own. The assembly is streamed,
+    only one line is held in memory at a time.
+
+    Arguments:
+        fasta -- Location of the assembly (plain or gzip/BGZF compressed)
+        destination_prefix -- Chunks are written to {destination_prefix}_{i}.fasta
+        chunk_bases -- Number of bases after which a new chunk is started
+
+    Returns:
+        chunks -- List of chunk locations
+        total -- Total number of bases in the assembly
+    """
+    chunks = []
+    total = 0
+    chunk_total = 0
+    out = None
+    opener = gzip.open if is_gzipped(fasta) else open
+    try:
+        with opener(fasta, "rb") as handle:
+            for line in handle:
+                # Start a new chunk at a contig once the current one is full
+                if line.startswith(b">") and (out is None or chunk_total >= chunk_bases):
+                    if out is not None:
+                        out.close()
+                    chunks.append(f"{destination_prefix}_{len(chunks)}.fasta")
+                    out = open(chunks[-1], "wb")
+                    chunk_total = 0
+                elif not line.startswith(b">"):
+                    bases = len(line.strip())
+                    total += bases
+                    chunk_total += bases
+                if out is not None:
+                    out.write(line)
+    finally:
+        if out is not None:
+            out.close()
+    return chunks, total
+
+def write_batch_assembly(fastas, destination):
+    """
+    Concatenates several assemblies into one FASTA file so they can share a
+    BLAST database. The sequence IDs of assembly i are prefixed with "{i}__",
+    so hits can be assigned back to their assembly. Assemblies are streamed.
+
+    Arguments:
+        fastas -- List of assemblies (plain or gzip/BGZF compressed)
+        destination -- Location of the combined FASTA file
+
+    Returns:
+        sizes -- Number of bases in each assembly
+    """
+    sizes = []
+    with open(destination, "wb") as out:
+        for i, fasta in enumerate(fastas):
+            prefix = f">{i}__".encode()
+            size = 0
+            line = b"\n"
+            opener = gzip.open if is_gzipped(fasta) else open
+            with opener(fasta, "rb") as handle:
+                for line in handle:
+                    if line.startswith(b">"):
+                        out.write(prefix + line[1:])
+                    else:
+                        size += len(line.strip())
+                        out.write(line)
+            # Make sure the next assembly starts on a new line
+            if not line.endswith(b"\n"):
+                out.write(b"\n")
+            sizes.append(size)
+    return sizes
@@ -1,89 +1,508 @@
 import uuid
+import tempfile
+import asyncio
 import os
 import shutil
-import subprocess
 import math
-from helpers.settings import BLAST_COLUMNS_FMT_6, SPIDER_RESULTS_COLUMNS, GFF3_COLUMNS
+from helpers.settings import BLAST_COLUMNS_FMT_6, SPIDER_RESULTS_COLUMNS, SPIDER_RESULTS_DTYPES, GFF3_COLUMNS, ADAPTIVE_INITIAL_PRIMERS, ADAPTIVE_GROWTH, PREFILTER_MAX_K, PREFILTER_THRESHOLD, LARGE_CHUNK_BASES, BLAST_DEFAULT_EVALUE, BLAST_DEFAULT_MAX_TARGET_SEQS, MAX_PRIMER_HITS, MAX_PRIMER_PAIRS, CAPPED_MESSAGE
+from helpers.compression import copy_assembly, split_assembly, write_batch_assembly
+from helpers.prefilter import minimizer_parameters, build_sketch, primer_containment
+from helpers.result_cache import open_cache, assembly_hash, target_key, get_cached_results, store_results
+from helpers.packed_genome import get_packed_genome, reverse_complement_str, reverse_complement_array
+from helpers.engines import PrimerSearch, make_engine
+from helpers import telemetry
 import pandas as pd
 import numpy as np
-from pyfaidx import Fasta
 from Bio.Align import PairwiseAligner
-from Bio.Seq import Seq
-from Bio import SeqIO
-from itertools import combinations
-import re
 import sys
+import heapq
 
-def crawl(fasta, db_loc, slide_limit, length_limit, identity_limit, primer_size, check_overlaps, check_start_stop, annotation):
+# Message for targets where no primer matched the assembly
+NO_PRIMERS_MESSAGE = "Neither forward nor reverse primers were not identified."
+
+def crawl(fasta, db_loc, slide_limit, length_limit, identity_limit, primer_size, check_overlaps, check_start_stop, annotation, adaptive=False, prefilter=False, validate_prefilter=False, cache_loc=None, assembly_digest=None, blast_jobs=1, large=False, database_names=None, seed=False, primer_matches=None, max_primer_hits=MAX_PRIMER_HITS, max_primer_pairs=MAX_PRIMER_PAIRS, target_range=None, engine=None):
     """
     Runs SPIDER to identify targets in the supplied fasta file.
 
     Arguments:
         fasta -- Location of assembly to query
-        db_loc -- Location of target datavase
-        slide_limit -- Percentage of target gene that SPIDER can slide
+        db_loc -- Location of target datavase, or a list of databases searched in the same pass
+        slide_limit -- Percentage of target gene that SPIDER can slide, or a list of slide limits
+                       for a parameter sweep. Each primer size is searched once with the largest
+                       slide limit, and smaller slide limits use the matches of their first primers.
         length_limit -- Percentage limit of length for which a target will validate
         identity_limit -- Threshold identity at which to call a target as present
-        primer_size -- Size of primer for in-silico PCR
+        primer_size -- Size of primer for in-silico PCR, or a list of primer sizes for a parameter
+                       sweep. With a sweep, Primer_Size and Slide_Limit columns are added.
         check_overlap -- True/false check if amplicons in same sample are overlapping
         check_start_stop -- True/false check for closest start/stop codons near the extracted amplicon
+        annotation -- GFF3 annotation to compare amplicons against
+        adaptive -- True/false search primer offsets in growing batches instead of all at once
+        prefilter -- True/false skip targets whose primers cannot match the assembly sketch
+        validate_prefilter -- True/false search skipped targets anyway and report prefilter false negatives
+        cache_loc -- Location of a result cache. Targets already cached for this assembly
+                     and settings are not searched again.
+        assembly_digest -- Content hash of the assembly, calculated if not provided
+        blast_jobs -- Number of primer searches run at once. Searches for upcoming targets
+                      run while earlier targets are aligned.
+        large -- True/false search the assembly in chunks of whole contigs so that memory
+                 use does not grow with the size of the assembly
+        database_names -- Names of the databases in db_loc. When given, a Database column
+                          is added after Name.
+        seed -- True/false search the whole slide region of each direction as a single query
+        primer_matches -- Dictionary of target sequence to a directory holding its primer
+                          matches in this assembly, from search_batch. Targets are resolved
+                          from these matches instead of being searched, targets missing from
+                          it are searched in this assembly on its own.
+        max_primer_hits -- Maximum number of matches kept for the best primer in each direction
+        max_primer_pairs -- Maximum number of candidate primer pairs considered per target
+        target_range -- (start, end) positions of the targets to crawl, None for all targets.
+                        Overlaps are only compared within the range.
+        engine -- SearchEngine running the primer searches, blastn by default
 
     Returns:
         df_results -- Results of crawler in the form of pandas dataframe
     """
     # Create a temporary directory name
     temp_directory = f"spider_tmp_{uuid.uuid4().hex}"
-
-    # Setup crawler environment and temp directory
-    setup(fasta, temp_directory)
-
-    # Iterate through all targets to test
+    caps = (max_primer_hits, max_primer_pairs)
+    if engine is None:
+        engine = make_engine()
+    # Settings to crawl, as (primer size, slide limit)
+    sweep = isinstance(primer_size, list) or isinstance(slide_limit, list)
+    primer_sizes = primer_size if isinstance(primer_size, list) else [primer_size]
+    slide_limits = slide_limit if isinstance(slide_limit, list) else [slide_limit]
+    settings = [(size, limit) for size in primer_sizes for limit in slide_limits]
+    # The working environment is only set up once a target has to be searched
+    prepared = False
+    sketch = None
+    genome = None
+    databases = None
+    dbsize = None
+
+    def prepare(search=primer_matches is None):
+        nonlocal prepared, sketch, genome, databases, dbsize
+        if prepared:
+            # Targets the batch could not search are searched in this assembly on its own
+            if search and databases is None:
+                databases, dbsize = setup(fasta, temp_directory, LARGE_CHUNK_BASES if large else None, engine)
+            return
+        # Setup crawler environment and temp directory
+        if not search:
+            # Primers were searched with the batch, only the packed genome is needed
+            os.makedirs(temp_directory)
+        else:
+            databases, dbsize = setup(fasta, temp_directory, LARGE_CHUNK_BASES if large else None, engine)
+        # Packed genome used to read contig lengths and amplicons
+        genome = get_packed_genome(fasta, temp_directory)
+        # Sketch the assembly once for the prefilter
+        if prefilter or validate_prefilter:
+            sketch = build_sketch(f"{temp_directory}/reference.fasta", k, w)
+        prepared = True
+
+    if prefilter or validate_prefilter:
+        k, w = minimizer_parameters(primer_size, PREFILTER_MAX_K)
+        targets_count = 0
+        skipped_count = 0
+        false_negatives = []
+
+    # Open the result cache
+    cache = None
+    if cache_loc:
+        cache = open_cache(cache_loc)
+        if assembly_digest is None:
+            assembly_digest = assembly_hash(fasta)
+        cache_hits = 0
+
+    # Load targets by header and sequence, and the database of each target
+    targets, target_databases = load_targets(db_loc)
+    if target_range is not None:
+        targets = targets[target_range[0]:target_range[1]]
+        target_databases = target_databases[target_range[0]:target_range[1]]
+
+    # Targets with identical sequences share results. For each unique sequence store
+    # [header used for the search, results of each setting, skipped by prefilter]
+    sequence_results = {}
+    for header, sequence in targets:
+        if sequence in sequence_results:
+            continue
+        setting_results = {}
+        skip = False
+        for size, limit in settings:
+            results = None
+            if cache:
+                results = get_cached_results(cache, target_key(assembly_digest, sequence, size, limit, length_limit, identity_limit, caps, seed))
+                cache_hits += results is not None
+                telemetry.count("cache_lookups")
+                telemetry.count("cache_hits", results is not None)
+            setting_results[(size, limit)] = results
+
+        if any(results is None for results in setting_results.values()):
+            prepare()
+            if prefilter or validate_prefilter:
+                containment = primer_containment(sketch, sequence, count_primers(len(sequence), slide_limit), primer_size, k, w)
+                skip = containment <= PREFILTER_THRESHOLD
+            if skip and not validate_prefilter:
+                setting_results = {setting: [no_primers_result(len(sequence))] for setting in settings}
+        sequence_results[sequence] = [header, setting_results, skip]
+
+    # Search the remaining targets, in database order. Each primer size is searched
+    # once with the largest slide limit
+    search_slide_limit = max(slide_limits)
+    resolve_slide_limits = slide_limits if len(slide_limits) > 1 else None
+    for size in primer_sizes:
+        pending = [(header, sequence) for sequence, (header, setting_results, skip) in sequence_results.items()
+                   if any(setting_results[(size, limit)] is None for limit in slide_limits)]
+        # Targets searched with the batch are resolved from its matches
+        batch_pending = [(header, sequence) for header, sequence in pending if primer_matches is not None and sequence in primer_matches]
+        search_pending = [(header, sequence) for header, sequence in pending if primer_matches is None or sequence not in primer_matches]
+        found = {sequence: resolve_target(sequence, primer_matches[sequence], temp_directory, length_limit, identity_limit, genome, caps) for header, sequence in batch_pending}
+        if search_pending:
+            prepare(search=True)
+        if blast_jobs > 1 and len(search_pending) > 1:
+            searched = asyncio.run(identify_targets_async(search_pending, search_slide_limit, size, temp_directory, length_limit, identity_limit, adaptive, genome, blast_jobs, databases, dbsize, seed, caps, resolve_slide_limits, engine))
+        else:
+            # Targets with identical primers share primer searches
+            primer_searches = {}
+            searched = [identify_target(header, sequence, search_slide_limit, size, temp_directory, length_limit, identity_limit, adaptive, primer_searches, genome, databases, dbsize, seed, caps, resolve_slide_limits, engine) for header, sequence in search_pending]
+        found.update(zip((sequence for header, sequence in search_pending), searched))
+        for header, sequence in pending:
+            results = found[sequence]
+            for limit, limit_results in zip(slide_limits, results if resolve_slide_limits else [results]):
+                sequence_results[sequence][1][(size, limit)] = limit_results
+                if cache:
+                    store_results(cache, target_key(assembly_digest, sequence, size, limit, length_limit, identity_limit, caps, seed), limit_results)
+
+    # Give results to every target header
     all_results = []
-    with open(db_loc, "r") as database:
-        # Load targets by header and sequence
-        for header, sequence in zip(database, database):
-            results = identify_target(header, sequence.strip(), slide_limit, primer_size, temp_directory, length_limit, identity_limit)
-            for result in results:
+    result_databases = []
+    result_settings = []
+    for (header, sequence), database in zip(targets, target_databases):
+        _, setting_results, skip = sequence_results[sequence]
+        if prefilter or validate_prefilter:
+            targets_count += 1
+            skipped_count += skip
+            # A skipped target must not have any primer matches
+            if skip and setting_results[settings[0]] != [no_primers_result(len(sequence))]:
+                false_negatives.append(header.strip().replace(">",""))
+        for setting in settings:
+            for result in setting_results[setting]:
                 # Add header to the result as first item
                 result = (fasta,header.strip().replace(">",""),) + result
                 # Append to overall results
                 all_results.append(result)
-    spider_results = pd.DataFrame(all_results, columns=SPIDER_RESULTS_COLUMNS)
+                result_databases.append(database)
+                result_settings.append(setting)
+    spider_results = results_table(all_results)
+    if database_names:
+        spider_results.insert(2, "Database", pd.Categorical([database_names[database] for database in result_databases], categories=database_names))
+    if sweep:
+        setting_column = 3 if database_names else 2
+        spider_results.insert(setting_column, "Primer_Size", pd.array([size for size, _ in result_settings], dtype="Int64"))
+        spider_results.insert(setting_column + 1, "Slide_Limit", pd.array([limit for _, limit in result_settings], dtype="Float64"))
+
+    # Save new results to the cache
+    if cache:
+        cache.commit()
+        cache.close()
+        print(f"Result cache: {cache_hits} of {len(sequence_results) * len(settings)} unique targets reused for {fasta}", file=sys.stderr)
+
+    # Report how many targets the prefilter skipped
+    if prefilter or validate_prefilter:
+        skip_rate = round(skipped_count / targets_count * 100, 2) if targets_count > 0 else 0
+        print(f"Prefilter skipped {skipped_count} of {targets_count} targets ({skip_rate}%) in {fasta}", file=sys.stderr)
+        if validate_prefilter:
+            if false_negatives:
+                print(f"WARNING: Prefilter skipped {len(false_negatives)} targets with primer matches in {fasta}: {', '.join(false_negatives)}", file=sys.stderr)
+            else:
+                print(f"Prefilter validation found no false negatives in {fasta}", file=sys.stderr)
 
     # Add warnings for overlaps
     if check_overlaps:
         spider_results = find_overlaps(spider_results)
     # Add start and stop codons
     if check_start_stop:
-        spider_results = find_start_stop(spider_results, temp_directory)
+        prepare()
+        spider_results = find_start_stop(spider_results, genome)
     if annotation:
+        prepare()
         spider_results = find_annotations(spider_results, annotation, temp_directory)
 
 
     # Cleanup temporary environment
-    cleanup(temp_directory)
+    if prepared:
+        if databases:
+            engine.release(databases)
+        cleanup(temp_directory)
 
     # Return results
     return spider_results
 
-def setup(fasta, temp_directory):
+def load_targets(db_loc):
+    """
+    Loads the targets of one or more prepared databases.
+
+    Arguments:
+        db_loc -- Location of a prepared database, or a list of them
+
+    Returns:
+        targets -- List of (header, sequence) tuples
+        target_databases -- Index of the database of each target
+    """
+    targets = []
+    target_databases = []
+    for i, database_loc in enumerate(db_loc if isinstance(db_loc, list) else [db_loc]):
+        with open(database_loc, "r") as database:
+            for header, sequence in zip(database, database):
+                targets.append((header, sequence.strip()))
+                target_databases.append(i)
+    return targets, target_databases
+
+def crawl_batch(fastas, db_loc, slide_limit, length_limit, identity_limit, primer_size, check_overlaps, check_start_stop, annotation, assembly_digests=None, cache_loc=None, blast_jobs=1, seed=False, max_primer_hits=MAX_PRIMER_HITS, max_primer_pairs=MAX_PRIMER_PAIRS, engine=None, **options):
+    """
+    Runs SPIDER on a batch of assemblies that share a single BLAST database.
+    Every target is searched once against the whole batch, and the matches are
+    split by assembly before primers are paired, so the results are the same as
+    crawling each assembly on its own.
+
+    Arguments:
+        fastas -- List of assemblies to query
+        assembly_digests -- Content hashes of the assemblies, calculated if not provided
+        Remaining arguments as in crawl
+
+    Returns:
+        results -- List of results dataframes, one per assembly
+    """
+    if assembly_digests is None:
+        assembly_digests = [assembly_hash(fasta) for fasta in fastas]
+    # Targets with identical sequences are searched once, with the first header
+    targets, _ = load_targets(db_loc)
+    first_headers = {}
+    for header, sequence in targets:
+        first_headers.setdefault(sequence, header)
+    unique_targets = [(header, sequence) for sequence, header in first_headers.items()]
+
+    # Only search targets that are not cached for every assembly
+    if cache_loc:
+        cache = open_cache(cache_loc)
+        unique_targets = [(header, sequence) for header, sequence in unique_targets
+                          if any(get_cached_results(cache, target_key(digest, sequence, primer_size, slide_limit, length_limit, identity_limit, (max_primer_hits, max_primer_pairs), seed)) is None for digest in assembly_digests)]
+        cache.close()
+
+    batch_directory = f"spider_tmp_{uuid.uuid4().hex}"
+    try:
+        primer_matches = search_batch(fastas, unique_targets, slide_limit, primer_size, batch_directory, seed, blast_jobs, engine)
+        return [crawl(fasta, db_loc, slide_limit, length_limit, identity_limit, primer_size, check_overlaps, check_start_stop, annotation,
+                      cache_loc=cache_loc, assembly_digest=digest, blast_jobs=blast_jobs, seed=seed, primer_matches=matches,
+                      max_primer_hits=max_primer_hits, max_primer_pairs=max_primer_pairs, engine=engine, **options)
+                for fasta, digest, matches in zip(fastas, assembly_digests, primer_matches)]
+    finally:
+        if os.path.exists(batch_directory):
+            cleanup(batch_directory)
+
+def search_batch(fastas, targets, slide_limit, primer_size, batch_directory, seed=False, blast_jobs=1, engine=None):
+    """
+    Searches the primers of every target against a BLAST database of all
+    assemblies in a batch, and writes the matches of each assembly to its own
+    directory in the format of a single assembly search.
+
+    BLAST statistics depend on the size of the database. The e-value cutoff is
+    raised so that no match that passes for its own assembly is lost, and
+    matches are then kept if their e-value rescaled to the size of their
+    assembly passes the usual cutoff. The number of subject sequences per query
+    is raised with the number of assemblies, and the matches of each assembly
+    are then cut to the first BLAST_DEFAULT_MAX_TARGET_SEQS subjects of each
+    query, as a search of the assembly on its own would. A query that reaches
+    the limit of the batch may have lost matches, so its target is left out of
+    primer_matches and crawl searches it in each assembly on its own. Seed
+    regions are converted to primer matches after the matches are split.
+
+    Arguments:
+        fastas -- List of assemblies in the batch
+        targets -- List of (header, sequence) tuples to search
+        slide_limit -- User set slide limit for primers
+        primer_size -- User provided primer length
+        batch_directory -- Temporary directory to create for the batch
+        seed -- True/false search one seed region per direction
+        blast_jobs -- Number of BLAST processes run at once
+        engine -- SearchEngine running the primer searches, blastn by default
+
+    Returns:
+        primer_matches -- List with a dictionary per assembly of target sequence to
+                          the directory holding its primer matches. Targets whose
+                          search reached the limit of the batch are left out
+    """
+    os.makedirs(batch_directory)
+    database = f"{batch_directory}/batch.fasta"
+    sizes = write_batch_assembly(fastas, database)
+    if engine is None:
+        engine = make_engine()
+    engine.prepare_assembly(database)
+    total = sum(sizes)
+    evalue_scale = total / max(min(sizes), 1)
+    max_target_seqs = BLAST_DEFAULT_MAX_TARGET_SEQS * len(fastas)
+
+    # Start the search of every target, targets with the same primers share a search.
+    # Without adaptive search all searches of a target are in its first step. The
+    # remaining step (converting seed regions) is done per assembly below.
+    primer_searches = {}
+    search_directories = {}
+    searches = []
+    # E-value cutoff of each search for a single assembly
+    thresholds = {}
+    number_primers = {}
+    seed_lengths = {}
+    for header, sequence in targets:
+        search_directory, steps = start_target_search(header, sequence, slide_limit, primer_size, batch_directory, False, primer_searches, [database], None, seed, evalue_scale, max_target_seqs)
+        search_directories[sequence] = search_directory
+        if steps is not None:
+            searches.append([next(steps)])
+            steps.close()
+            number_primers[search_directory] = count_primers(len(sequence), slide_limit)
+            seed_lengths[search_directory] = seed_region_length(len(sequence), number_primers[search_directory], primer_size)
+            # Seed matches keep the e-value of the whole seed region alignment
+            seed_scale = seed_lengths[search_directory] / primer_size if seed else 1
+            thresholds[search_directory] = BLAST_DEFAULT_EVALUE * seed_scale
+    if blast_jobs > 1 and len(searches) > 1:
+        asyncio.run(run_primer_searches_async(searches, blast_jobs, engine))
+    else:
+        for steps in searches:
+            run_primer_search(steps, engine)
+    engine.release([database])
+
+    # Split the matches of each search by assembly
+    name = "seed" if seed else "primers"
+    saturated = set()
+    for search_directory in thresholds:
+        for direction in ["forward", "reverse"]:
+            assembly_lines = [[] for _ in fastas]
+            # Subjects of each query in the batch, and in each assembly in BLAST order
+            batch_subjects = {}
+            assembly_subjects = [{} for _ in fastas]
+            with open(f"{search_directory}/{direction}_{name}.blast.txt", "r") as matches:
+                for line in matches:
+                    fields = line.split("\t")
+                    batch_subjects.setdefault(fields[0], set()).add(fields[1])
+                    assembly, _, contig = fields[1].partition("__")
+                    assembly = int(assembly)
+                    if float(fields[10]) * sizes[assembly] / total > thresholds[search_directory]:
+                        continue
+                    subjects = assembly_subjects[assembly].setdefault(fields[0], {})
+                    if subjects.setdefault(contig, len(subjects)) >= BLAST_DEFAULT_MAX_TARGET_SEQS:
+                        continue
+                    fields[1] = contig
+                    assembly_lines[assembly].append("\t".join(fields))
+            if any(len(subjects) >= max_target_seqs for subjects in batch_subjects.values()):
+                saturated.add(search_directory)
+            for assembly, lines in enumerate(assembly_lines):
+                assembly_directory = f"{batch_directory}/assemblies/{assembly}/{os.path.basename(search_directory)}"
+                os.makedirs(assembly_directory, exist_ok=True)
+                with open(f"{assembly_directory}/{direction}_{name}.blast.txt", "w") as assembly_matches:
+                    assembly_matches.writelines(lines)
+                if seed:
+                    seed_matches(direction, number_primers[search_directory], seed_lengths[search_directory], primer_size, assembly_directory, 1)
+    primer_matches = [{} for _ in fastas]
+    for sequence, search_directory in search_directories.items():
+        if search_directory in saturated:
+            continue
+        for assembly in range(len(fastas)):
+            primer_matches[assembly][sequence] = f"{batch_directory}/assemblies/{assembly}/{os.path.basename(search_directory)}"
+    return primer_matches
+
+async def run_primer_searches_async(searches, blast_jobs, engine):
+    """
+    Runs several primer searches with up to blast_jobs BLAST processes at once.
+
+    Arguments:
+        searches -- List of generators of PrimerSearch lists from primer_search_steps
+        blast_jobs -- Maximum number of BLAST processes running at once
+        engine -- SearchEngine running the searches
+    """
+    semaphore = asyncio.Semaphore(blast_jobs)
+    await asyncio.gather(*(run_primer_search_async(steps, semaphore, engine) for steps in searches))
+
+def results_table(results):
+    """
+    Builds a typed results table from result tuples. Numeric columns use
+    nullable integer/float types and repeated text columns are categorical
+    (see SPIDER_RESULTS_DTYPES). Missing values (None, or "NA" in results
+    cached by earlier versions) become <NA>.
+
+    Arguments:
+        results -- List of result tuples with the Query and Name added
+
+    Returns:
+        table -- Dataframe of SPIDER results
+    """
+    columns = list(zip(*results)) if results else [()] * len(SPIDER_RESULTS_COLUMNS)
+    table = {}
+    for column, values in zip(SPIDER_RESULTS_COLUMNS, columns):
+        dtype = SPIDER_RESULTS_DTYPES[column]
+        if dtype == "category":
+            table[column] = pd.Series([None if value == "NA" else value for value in values], dtype=object).astype("category")
+        elif dtype == "bool":
+            table[column] = np.array(values, dtype=bool)
+        else:
+            table[column] = pd.array([None if isinstance(value, str) else value for value in values], dtype=dtype)
+    return pd.DataFrame(table)
+
+def concat_results(tables):
+    """
+    Concatenates results tables. Categorical columns are given the union of
+    their categories first, so they stay categorical instead of becoming
+    object columns.
+
+    Arguments:
+        tables -- List of results tables from crawl
+
+    Returns:
+        results -- Single results table
+    """
+    if not tables:
+        return results_table([])
+    tables = list(tables)
+    for column in tables[0].columns:
+        if SPIDER_RESULTS_DTYPES.get(column) == "category" and all(isinstance(table[column].dtype, pd.CategoricalDtype) for table in tables):
+            categories = pd.api.types.union_categoricals([table[column] for table in tables]).categories
+            tables = [table.assign(**{column: table[column].cat.set_categories(categories)}) for table in tables]
+    return pd.concat(tables, ignore_index=True)
+
+def setup(fasta, temp_directory, chunk_bases=None, engine=None):
     """
     Sets up a working environment for SPIDER.
 
     Arguments:
-        fasta -- Location of the assembly being searched
+        fasta -- Location of the assembly being searched (plain or gzip/BGZF compressed)
         temp_directory -- Location of temporary directory to be made
+        chunk_bases -- If set, the assembly is split into BLAST databases of whole
+                       contigs with about this many bases each
+        engine -- SearchEngine that prepares the databases, blastn by default
+
+    Returns:
+        databases -- List of BLAST databases of the assembly
+        dbsize -- Size of the whole assembly to use for BLAST statistics when it is
+                  split into several databases, None otherwise
     """
-    # Create temporary directory
-    os.makedirs(temp_directory)
+    # Create temporary directory, it already exists for assemblies of a batch
+    os.makedirs(temp_directory, exist_ok=True)
 
-    # Copy assembly to the temp directory
-    shutil.copy(fasta, f"{temp_directory}/reference.fasta")
+    if chunk_bases:
+        # Split the assembly into chunks, decompressing if needed
+        databases, dbsize = split_assembly(fasta, f"{temp_directory}/reference", chunk_bases)
+    else:
+        # Copy assembly to the temp directory, decompressing if needed
+        copy_assembly(fasta, f"{temp_directory}/reference.fasta")
+        databases, dbsize = [f"{temp_directory}/reference.fasta"], None
 
     # Make blast DB for primer lookup
-    makeblastdb_cmd = ["makeblastdb", "-in", f"{temp_directory}/reference.fasta", 
-                       "-dbtype", "nucl"]
-    subprocess.run(makeblastdb_cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    if engine is None:
+        engine = make_engine()
+    for database in databases:
+        engine.prepare_assembly(database)
+        # Only the BLAST database of a chunk is needed afterwards
+        if chunk_bases:
+            os.remove(database)
+    return databases, dbsize
 
 
 def cleanup(temp_directory):
@@ -98,7 +517,7 @@ def cleanup(temp_directory):
     shutil.rmtree(temp_directory)
 
 
-def identify_target(header, ref_sequence, slide_limit, primer_size, temp_directory, length_limit, identity_limit):
+def identify_target(header, ref_sequence, slide_limit, primer_size, temp_directory, length_limit, identity_limit, adaptive=False, primer_searches=None, genome=None, databases=None, dbsize=None, seed=False, caps=None, resolve_slide_limits=None, engine=None):
     """
     Identifies the target sequence if present.
 
@@ -110,82 +529,534 @@ def identify_target(header, ref_sequence, slide_limit, primer_size, temp_directo
         temp_directory -- Temporary directory to use
         length_limit -- User provided limit on length to use
         identity_limit -- User provided identity limit to use
+        adaptive -- True/false search primer offsets in growing batches, stopping at
+                    the first batch with a hit
+        primer_searches -- Optional dictionary of primer sets already searched in this
+                           assembly, mapped to the directory holding their matches.
+                           Targets with the same primers reuse that search.
+        genome -- PackedGenome of the assembly, built from the temporary copy if not provided
+        databases -- BLAST databases of the assembly, by default the temporary copy
+        dbsize -- Size of the whole assembly when it is split into several databases
+        seed -- True/false search the whole slide region of each direction as a single
+                query instead of one query per primer
+        caps -- (maximum matches per primer, maximum candidate pairs), None for no caps
+        resolve_slide_limits -- Optional list of slide limits (at most slide_limit) to
+                                resolve the search for. The results of each are returned
+                                as a list, in the same order.
+        engine -- SearchEngine running the primer searches, blastn by default
 
     Returns:
         results -- List of tuples that contain results. Each tuple is in the format: 
                    (Valid, Contig, Start, F_Slide, End, R_Slide, Strand, Identity, Target_length, 
                    Ref_Length, Coverage_Perc_Len, Coverage_Perc_Align, Message)
     """
+    search_directory, steps = start_target_search(header, ref_sequence, slide_limit, primer_size, temp_directory, adaptive, primer_searches, databases, dbsize, seed)
+    if steps is not None:
+        run_primer_search(steps, engine if engine is not None else make_engine())
+    return resolve_slide_limits_results(ref_sequence, search_directory, temp_directory, length_limit, identity_limit, genome, caps, resolve_slide_limits)
+
+async def identify_targets_async(targets, slide_limit, primer_size, temp_directory, length_limit, identity_limit, adaptive, genome, blast_jobs, databases=None, dbsize=None, seed=False, caps=None, resolve_slide_limits=None, engine=None):
+    """
+    Identifies several targets, running up to blast_jobs primer searches at once.
+    Searches are started in target order and each target is aligned as soon as
+    its search finishes, while the searches for later targets keep running.
+
+    Arguments:
+        targets -- List of (header, ref_sequence) tuples
+        blast_jobs -- Maximum number of BLAST processes running at once
+        Remaining arguments as in identify_target
+
+    Returns:
+        results -- List of identify_target results, in the same order as targets
+    """
+    semaphore = asyncio.Semaphore(blast_jobs)
+    primer_searches = {}
+    # Running searches by the directory they write to
+    searches = {}
+
+    async def identify(header, ref_sequence):
+        search_directory, steps = start_target_search(header, ref_sequence, slide_limit, primer_size, temp_directory, adaptive, primer_searches, databases, dbsize, seed)
+        if steps is not None:
+            searches[search_directory] = asyncio.ensure_future(run_primer_search_async(steps, semaphore, engine if engine is not None else make_engine()))
+        # Targets sharing primers wait for the original search
+        await searches[search_directory]
+        return resolve_slide_limits_results(ref_sequence, search_directory, temp_directory, length_limit, identity_limit, genome, caps, resolve_slide_limits)
+
+    return await asyncio.gather(*(identify(header, ref_sequence) for header, ref_sequence in targets))
+
+def resolve_slide_limits_results(ref_sequence, search_directory, temp_directory, length_limit, identity_limit, genome=None, caps=None, resolve_slide_limits=None):
+    """
+    Resolves a finished search for one or several slide limits. Primers are the
+    same for every slide limit, so a smaller slide limit only keeps the matches
+    of its first primers.
+
+    Arguments:
+        resolve_slide_limits -- List of slide limits, None to resolve the search as it was made
+        Remaining arguments as in resolve_target
+
+    Returns:
+        results -- Results of resolve_target, or a list of them for each slide limit
+    """
+    if resolve_slide_limits is None:
+        return resolve_target(ref_sequence, search_directory, temp_directory, length_limit, identity_limit, genome, caps)
+    return [resolve_target(ref_sequence, search_directory, temp_directory, length_limit, identity_limit, genome, caps, count_primers(len(ref_sequence), limit))
+            for limit in resolve_slide_limits]
+
+def start_target_search(header, ref_sequence, slide_limit, primer_size, temp_directory, adaptive=False, primer_searches=None, databases=None, dbsize=None, seed=False, evalue_scale=1, max_target_seqs=None):
+    """
+    Makes the target directory and prepares the primer search for a target.
+
+    Arguments:
+        evalue_scale, max_target_seqs -- See search_commands
+        Remaining arguments as in identify_target
+
+    Returns:
+        search_directory -- Directory that will hold the primer matches for the target
+        steps -- Generator of searches to run (see primer_search_steps), or None
+                 if the matches of an earlier target with the same primers are reused
+    """
     # Make directory for the target
     target_directory = f"{temp_directory}/{header.split(' ')[0].replace('>','')}"
-    os.makedirs(target_directory)
+    try:
+        os.makedirs(target_directory)
+    except FileExistsError:
+        # Another target (e.g. from a different database) has the same name
+        target_directory = tempfile.mkdtemp(prefix=f"{os.path.basename(target_directory)}_", dir=temp_directory)
 
     # Find sequence length for number of primers to generate
     ref_length = len(ref_sequence)
-    number_primers = math.floor(slide_limit / 100 * ref_length)
-    # Make sure that the number of primers can never be 0
-    if number_primers < 1: number_primers = 1
+    number_primers = count_primers(ref_length, slide_limit)
+
+    # Primers only depend on the sequence covered by the forward and reverse slides
+    primer_span = number_primers - 1 + primer_size
+    primer_key = (ref_sequence[:primer_span], ref_sequence[max(ref_length-primer_span, 0):])
+    if primer_searches is not None and primer_key in primer_searches:
+        return primer_searches[primer_key], None
+    if primer_searches is not None:
+        primer_searches[primer_key] = target_directory
+    return target_directory, primer_search_steps(ref_sequence, number_primers, primer_size, target_directory, temp_directory, adaptive, databases, dbsize, seed, evalue_scale, max_target_seqs)
+
+def primer_search_steps(ref_sequence, number_primers, primer_size, target_directory, temp_directory, adaptive=False, databases=None, dbsize=None, seed=False, evalue_scale=1, max_target_seqs=None):
+    """
+    Writes primers and yields the searches that find them. Every yielded
+    list holds searches that can run at the same time, and all of them must have
+    finished before the next list is requested.
 
-    # Generate the forward primers
-    with open(f"{target_directory}/forward_primers.fasta", "w") as forward_primers:
-        for i in range(0, number_primers):
-            forward_primers.write(f">forward_{i}\n{ref_sequence[i:i+primer_size]}\n")
-
-    # Generate the reverse primers
-    with open(f"{target_directory}/reverse_primers.fasta", "w") as reverse_primers:
-        for i in range(0, number_primers):
-            reverse_primers.write(f">reverse_{i}\n{ref_sequence[ref_length-i-primer_size:ref_length-i]}\n")
-
-    # BLAST both sets of primers
-    for primer_set in ("forward_primers", "reverse_primers"):
-        blast_cmd = ["blastn", "-query", f"{target_directory}/{primer_set}.fasta", 
-                     "-db", f"{temp_directory}/reference.fasta", 
-                     "-outfmt", "6", "-word_size", f"{primer_size}", 
-                     "-out", f"{target_directory}/{primer_set}.blast.txt"]
-        subprocess.run(blast_cmd)
-        
+    In adaptive mode primer offsets are searched in geometrically growing batches
+    and a direction stops at the first batch with any match. Only the lowest
+    matching offset is kept by parse_primer_matches, and every lower offset was
+    searched without a match in an earlier batch, so the matches kept are the
+    same as when all number_primers offsets are searched at once.
+
+    In seed mode the region covered by all primers of a direction is searched
+    as a single query, and the primer matches are derived from the alignments
+    (see seed_matches).
+
+    Arguments:
+        ref_sequence -- target reference sequence
+        number_primers -- Total number of offsets allowed by the slide limit
+        primer_size -- User provided primer length
+        target_directory -- Temporary directory being used for the target
+        temp_directory -- Temporary directory containing the assembly BLAST database
+        adaptive -- True/false search offsets in growing batches
+        databases -- BLAST databases of the assembly, by default the temporary copy.
+                     Matches from several databases are combined once all have finished.
+        dbsize -- Size of the whole assembly when it is split into several databases
+        seed -- True/false search one seed region per direction
+        evalue_scale, max_target_seqs -- See search_commands
+
+    Yields:
+        searches -- List of PrimerSearch
+    """
+    if databases is None:
+        databases = [f"{temp_directory}/reference.fasta"]
+    directions = ["forward", "reverse"]
+    if seed:
+        seed_length = seed_region_length(len(ref_sequence), number_primers, primer_size)
+        for direction in directions:
+            write_seed_region(direction, ref_sequence, number_primers, primer_size, target_directory)
+        yield [primer_search for direction in directions for primer_search in search_commands(direction, primer_size, target_directory, databases, dbsize, seed_length, evalue_scale, max_target_seqs)]
+        for direction in directions:
+            seed_matches(direction, number_primers, seed_length, primer_size, target_directory, len(databases))
+        return
+    if not adaptive:
+        for direction in directions:
+            write_primers(direction, ref_sequence, range(0, number_primers), primer_size, target_directory)
+        yield [primer_search for direction in directions for primer_search in search_commands(direction, primer_size, target_directory, databases, dbsize, None, evalue_scale, max_target_seqs)]
+        for direction in directions:
+            combine_matches(direction, target_directory, len(databases))
+        return
+
+    batch_start = 0
+    batch_size = ADAPTIVE_INITIAL_PRIMERS
+    while directions and batch_start < number_primers:
+        batch_end = min(batch_start + batch_size, number_primers)
+        for direction in directions:
+            write_primers(direction, ref_sequence, range(batch_start, batch_end), primer_size, target_directory)
+        yield [primer_search for direction in directions for primer_search in search_commands(direction, primer_size, target_directory, databases, dbsize, None, evalue_scale, max_target_seqs)]
+        for direction in directions:
+            combine_matches(direction, target_directory, len(databases))
+        # Only keep searching directions without a match in this batch
+        directions = [direction for direction in directions if os.path.getsize(f"{target_directory}/{direction}_primers.blast.txt") == 0]
+        batch_start = batch_end
+        batch_size *= ADAPTIVE_GROWTH
+
+def run_primer_search(steps, engine):
+    """
+    Runs the searches of a primer search one after another.
+
+    Arguments:
+        steps -- Generator of PrimerSearch lists from primer_search_steps
+        engine -- SearchEngine running the searches
+    """
+    for searches in steps:
+        for primer_search in searches:
+            engine.search(primer_search)
+
+async def run_primer_search_async(steps, semaphore, engine):
+    """
+    Runs the searches of a primer search as asyncio tasks.
+
+    Arguments:
+        steps -- Generator of PrimerSearch lists from primer_search_steps
+        semaphore -- asyncio.Semaphore limiting the number of searches running at once
+        engine -- SearchEngine running the searches
+    """
+    async def run(primer_search):
+        async with semaphore:
+            await engine.search_async(primer_search)
+
+    for searches in steps:
+        await asyncio.gather(*(run(primer_search) for primer_search in searches))
+
+def resolve_target(ref_sequence, search_directory, temp_directory, length_limit, identity_limit, genome=None, caps=None, number_primers=None):
+    """
+    Pairs the primer matches of a finished search and validates the amplicons.
+
+    Arguments:
+        ref_sequence -- target reference sequence
+        search_directory -- Directory holding the primer matches
+        temp_directory -- Temporary directory to use
+        length_limit -- User provided limit on length to use
+        identity_limit -- User provided identity limit to use
+        genome -- PackedGenome of the assembly, built from the temporary copy if not provided
+        caps -- (maximum matches per primer, maximum candidate pairs), None for no caps.
+                CAPPED_MESSAGE is added to the messages of a target that reached a cap.
+        number_primers -- Only use the matches of the first number_primers primers, None for all
+
+    Returns:
+        results -- List of result tuples, see identify_target
+    """
+    telemetry.target_searched()
+    ref_length = len(ref_sequence)
     # Obtain primer matches
-    forward_matches, reverse_matches = parse_primer_matches(target_directory)
+    max_hits, max_pairs = caps if caps is not None else (None, None)
+    forward_matches, reverse_matches, hits_capped = parse_primer_matches(search_directory, max_hits, number_primers, ref_length)
     # Sort the primers into pairs
-    primer_pairs, error = sort_primer_pairs(forward_matches, reverse_matches, ref_length)
+    primer_pairs, error, pairs_capped = sort_primer_pairs(forward_matches, reverse_matches, ref_length, max_pairs)
+    if hits_capped:
+        telemetry.count("primer_hits_capped")
+    if pairs_capped:
+        telemetry.count("primer_pairs_capped")
     # Store returned output
     results = []
+    if len(primer_pairs) > 0 and genome is None:
+        genome = get_packed_genome(f"{temp_directory}/reference.fasta")
 
-    # Extract target sequence for each primer pair
+    # Extract and validate the targets of all primer pairs at once, only the alignment is done per pair
     if len(primer_pairs) > 0:
-        target_extracted_counter = 0
-        for pair in primer_pairs:
-            contig, start, end, strand, forward_slide, reverse_slide = extract_target_location(pair, forward_matches, reverse_matches, temp_directory)
-            
-            # Extract the target sequence
-            target_sequence, target_length = extract_target_sequence(contig, start, end, temp_directory)
-            
-            # Align the target to get identity and coverage
-            identity, coverage_percent_length, coverage_alignment = align_target(ref_sequence, target_sequence, strand)
-            
-            # Check validity of target
-            valid, error = validate_target(identity, coverage_percent_length, length_limit, identity_limit)
+        contigs, starts, ends, strands, forward_slides, reverse_slides = extract_target_locations(primer_pairs, forward_matches, reverse_matches, genome)
+
+        # Extract the target sequences
+        target_sequences = [extract_target_sequence(contig, start, end, genome)[0] for contig, start, end in zip(contigs, starts.tolist(), ends.tolist())]
+        target_lengths = ends - starts + 1
+        sequence_lengths = np.array([len(target_sequence) for target_sequence in target_sequences], dtype=np.int64)
+
+        # Align the targets to get identity and coverage
+        matches, alignment_lengths, gaps = align_targets(ref_sequence, target_sequences, strands)
+        identity = np.round(matches / alignment_lengths * 100, 2)
+        coverage_percent_length = np.round(sequence_lengths / ref_length * 100, 2)
+        coverage_alignment = np.round((sequence_lengths - gaps) / ref_length * 100, 2)
 
-            # Add tuple for output: (Valid, Start, F_Slide, End, R_Slide, Strand, Identity, target_length, Ref_Length, Coverage_Perc_Len, Coverage_Perc_Align, Error Message)
-            results.append((valid, contig, start, forward_slide, end, reverse_slide, strand, identity, target_length, ref_length, coverage_percent_length, coverage_alignment, error))
+        # Check validity of targets
+        valid, errors = validate_targets(identity, coverage_percent_length, length_limit, identity_limit)
+
+        # Add tuples for output: (Valid, Start, F_Slide, End, R_Slide, Strand, Identity, target_length, Ref_Length, Coverage_Perc_Len, Coverage_Perc_Align, Error Message)
+        results = list(zip(valid.tolist(), contigs.tolist(), starts.tolist(), forward_slides.tolist(), ends.tolist(), reverse_slides.tolist(), strands.tolist(),
+                           identity.tolist(), target_lengths.tolist(), [ref_length] * len(primer_pairs), coverage_percent_length.tolist(), coverage_alignment.tolist(), errors.tolist()))
     else:
-        results.append((False, "NA", "NA", "NA", "NA", "NA", "NA", "NA", "NA", ref_length, "NA", "NA", error))
+        results.append(no_primers_result(ref_length, error))
 
+    if hits_capped or pairs_capped:
+        results = [result[:-1] + ((f"{result[-1]} {CAPPED_MESSAGE}" if result[-1] else CAPPED_MESSAGE),) for result in results]
     return results
 
-def parse_primer_matches(target_directory):
+def count_primers(ref_length, slide_limit):
+    """
+    Calculates the number of primers to generate in each direction.
+
+    Arguments:
+        ref_length -- Length of the target reference sequence
+        slide_limit -- User set slide limit for primers
+
+    Returns:
+        number_primers -- Number of primer slide offsets
+    """
+    number_primers = math.floor(slide_limit / 100 * ref_length)
+    # Make sure that the number of primers can never be 0
+    if number_primers < 1: number_primers = 1
+    return number_primers
+
+def seed_region_length(ref_length, number_primers, primer_size):
+    """
+    Calculates the length of the seed region of a direction: the bases covered
+    by all of its primers, cut to the reference when the slides cover all of it.
+
+    Arguments:
+        ref_length -- Length of the target reference sequence
+        number_primers -- Number of primer slide offsets
+        primer_size -- User provided primer length
+
+    Returns:
+        seed_length -- Length of the seed region
+    """
+    return min(number_primers - 1 + primer_size, ref_length)
+
+def no_primers_result(ref_length, error=NO_PRIMERS_MESSAGE):
+    """
+    Builds the result tuple for a target without any primer pairs.
+
+    Arguments:
+        ref_length -- Length of the target reference sequence
+        error -- Reason why no pairs were found
+
+    Returns:
+        result -- Result tuple in the same format as identify_target
+    """
+    return (False, None, None, None, None, None, None, None, None, ref_length, None, None, error)
+
+def write_primers(direction, ref_sequence, offsets, primer_size, target_directory):
+    """
+    Writes the primers for a set of slide offsets to {direction}_primers.fasta.
+    Forward primers slide in from the start of the reference and reverse
+    primers slide in from the end.
+
+    Arguments:
+        direction -- forward/reverse
+        ref_sequence -- target reference sequence
+        offsets -- Slide offsets to generate primers for
+        primer_size -- User provided primer length
+        target_directory -- Temporary directory being used for the target
+    """
+    ref_length = len(ref_sequence)
+    with open(f"{target_directory}/{direction}_primers.fasta", "w") as primers:
+        for i in offsets:
+            if direction == "forward":
+                primers.write(f">forward_{i}\n{ref_sequence[i:i+primer_size]}\n")
+            else:
+                primers.write(f">reverse_{i}\n{ref_sequence[ref_length-i-primer_size:ref_length-i]}\n")
+
+
+def search_commands(direction, primer_size, target_directory, databases, dbsize=None, seed_length=None, evalue_scale=1, max_target_seqs=None):
+    """
+    Builds the searches of {direction}_primers.fasta against the assembly.
+    With a single database the matches are written to {direction}_primers.blast.txt,
+    otherwise the matches against database i are written to
+    {direction}_primers.{i}.blast.txt and combined by combine_matches.
+
+    For seed regions ({direction}_seed.fasta) the output is {direction}_seed(.{i}).blast.txt,
+    with the aligned sequences added so that seed_matches can find the exact primer
+    matches. The e-value cutoff is raised by the length of the seed region over the
+    primer size, so a full-length primer match passes exactly when it would pass as
+    a query of its own.
+
+    Arguments:
+        direction -- forward/reverse
+        primer_size -- User provided primer length
+        target_directory -- Temporary directory being used for the target
+        databases -- BLAST databases of the assembly
+        dbsize -- Size of the whole assembly, so that statistics (and the e-value
+                  cutoff) are the same as for a single database
+        seed_length -- Length of the seed region, None to search primers
+        evalue_scale -- Factor the e-value cutoff is raised by (see search_batch)
+        max_target_seqs -- Maximum number of subject sequences per query, None for
+                           the BLAST default
+
+    Returns:
+        searches -- List of PrimerSearch, one per database
+    """
+    name = f"{direction}_seed" if seed_length else f"{direction}_primers"
+    searches = []
+    for i, database in enumerate(databases):
+        output = f"{target_directory}/{name}.blast.txt" if len(databases) == 1 else f"{target_directory}/{name}.{i}.blast.txt"
+        evalue = BLAST_DEFAULT_EVALUE * evalue_scale * (seed_length / primer_size if seed_length else 1)
+        searches.append(PrimerSearch(f"{target_directory}/{name}.fasta", database, output, primer_size,
+                                     ("qseq", "sseq") if seed_length else (), evalue, max_target_seqs, dbsize))
+    return searches
+
+
+def combine_matches(direction, target_directory, number_databases):
+    """
+    Combines the matches against several databases into {direction}_primers.blast.txt.
+    BLAST lists matches in primer order, and parse_primer_matches relies on the
+    first line being a match of the lowest matching primer, so the combined
+    matches are sorted by primer and then by database. Each database search
+    keeps its own BLAST_DEFAULT_MAX_TARGET_SEQS subjects per primer, so the
+    combined matches are cut to that many subjects (see limit_subjects).
+
+    Arguments:
+        direction -- forward/reverse
+        target_directory -- Temporary directory being used for the target
+        number_databases -- Number of databases searched
+    """
+    if number_databases == 1:
+        return
+    lines = []
+    for i in range(number_databases):
+        with open(f"{target_directory}/{direction}_primers.{i}.blast.txt", "r") as matches:
+            lines.extend(line for line in matches if line.strip())
+        os.remove(f"{target_directory}/{direction}_primers.{i}.blast.txt")
+    lines = limit_subjects(lines, BLAST_DEFAULT_MAX_TARGET_SEQS)
+    # Primers are named {direction}_{offset}
+    lines.sort(key=lambda line: int(line.split("\t", 1)[0].rsplit("_", 1)[1]))
+    with open(f"{target_directory}/{direction}_primers.blast.txt", "w") as combined:
+        combined.writelines(lines)
+
+
+def limit_subjects(lines, max_subjects):
+    """
+    Keeps the matches of the first max_subjects subject sequences of each query,
+    as a search of a single database with -max_target_seqs would. Subjects are
+    ranked the way BLAST lists them, by their best e-value and then their best
+    bit score, with ties kept in the order they were found.
+
+    Arguments:
+        lines -- BLAST outfmt 6 lines of one or more queries
+        max_subjects -- Maximum number of subject sequences per query
+
+    Returns:
+        lines -- The lines of the kept subjects, in their original order
+    """
+    best = {}
+    for position, line in enumerate(lines):
+        fields = line.split("\t")
+        rank = (float(fields[10]), -float(fields[11]), position)
+        if rank < best.get((fields[0], fields[1]), (np.inf,)):
+            best[(fields[0], fields[1])] = rank
+    subject_counts = {}
+    kept = set()
+    for query, subject in sorted(best, key=best.get):
+        subject_counts[query] = subject_counts.get(query, 0) + 1
+        if subject_counts[query] <= max_subjects:
+            kept.add((query, subject))
+    return [line for line in lines if tuple(line.split("\t", 2)[:2]) in kept]
+
+
+def write_seed_region(direction, ref_sequence, number_primers, primer_size, target_directory):
+    """
+    Writes the region covered by all primers of a direction to {direction}_seed.fasta.
+
+    Arguments:
+        direction -- forward/reverse
+        ref_sequence -- target reference sequence
+        number_primers -- Number of primer slide offsets
+        primer_size -- User provided primer length
+        target_directory -- Temporary directory being used for the target
+    """
+    ref_length = len(ref_sequence)
+    seed_length = seed_region_length(ref_length, number_primers, primer_size)
+    with open(f"{target_directory}/{direction}_seed.fasta", "w") as seed:
+        if direction == "forward":
+            seed.write(f">forward_seed\n{ref_sequence[:seed_length]}\n")
+        else:
+            seed.write(f">reverse_seed\n{ref_sequence[ref_length-seed_length:]}\n")
+
+
+def seed_matches(direction, number_primers, seed_length, primer_size, target_directory, number_databases):
+    """
+    Converts the alignments of a seed region into primer matches and writes them
+    to {direction}_primers.blast.txt in the format of blast_primers. Every window
+    of primer_size aligned bases without mismatches or gaps is the match of one
+    primer: forward primer i starts at position i of the seed region, and reverse
+    primer i ends i bases before the end of the seed region. Matches are listed by
+    primer offset, so parse_primer_matches keeps the lowest matching offset as usual.
+
+    Arguments:
+        direction -- forward/reverse
+        number_primers -- Number of primer slide offsets
+        seed_length -- Length of the seed region written by write_seed_region
+        primer_size -- User provided primer length
+        target_directory -- Temporary directory being used for the target
+        number_databases -- Number of databases searched
+    """
+    if number_databases == 1:
+        outputs = [f"{target_directory}/{direction}_seed.blast.txt"]
+    else:
+        outputs = [f"{target_directory}/{direction}_seed.{i}.blast.txt" for i in range(number_databases)]
+    lines = []
+    for output in outputs:
+        with open(output, "r") as alignments:
+            lines.extend(line for line in alignments if line.strip())
+        os.remove(output)
+    # Each database search keeps its own subjects, cut them to those of a single search
+    if number_databases > 1:
+        lines = limit_subjects(lines, BLAST_DEFAULT_MAX_TARGET_SEQS)
+    matches = []
+    # Order of contigs in the BLAST output, used to list matches of one primer
+    contig_order = {}
+    for line in lines:
+        fields = line.rstrip("\n").split("\t")
+        if len(fields) < 14:
+            continue
+        sseqid, evalue, bitscore = fields[1], fields[10], fields[11]
+        qstart, sstart, send = int(fields[6]), int(fields[8]), int(fields[9])
+        contig_order.setdefault(sseqid, len(contig_order))
+        query = np.frombuffer(fields[12].upper().encode(), dtype=np.uint8)
+        subject = np.frombuffer(fields[13].upper().encode(), dtype=np.uint8)
+        step = 1 if sstart <= send else -1
+        # Positions in the seed region (0-based) and subject at every alignment column
+        query_positions = qstart - 1 + np.cumsum(query != ord("-")) - 1
+        subject_positions = sstart + step * (np.cumsum(subject != ord("-")) - 1)
+        exact = (query == subject) & (query != ord("-"))
+        # Columns that start a run of primer_size exact columns
+        runs = np.convolve(exact.astype(np.int32), np.ones(primer_size, dtype=np.int32), mode="valid")
+        for column in np.flatnonzero(runs == primer_size):
+            window = int(query_positions[column])
+            offset = window if direction == "forward" else seed_length - primer_size - window
+            if 0 <= offset < number_primers:
+                match_start = int(subject_positions[column])
+                match_end = match_start + step * (primer_size - 1)
+                matches.append((offset, contig_order[sseqid], min(match_start, match_end),
+                                f"{direction}_{offset}\t{sseqid}\t100.000\t{primer_size}\t0\t0\t1\t{primer_size}\t{match_start}\t{match_end}\t{evalue}\t{bitscore}\n"))
+    matches.sort(key=lambda match: match[:3])
+    with open(f"{target_directory}/{direction}_primers.blast.txt", "w") as primers:
+        primers.writelines(match[3] for match in matches)
+
+
+def parse_primer_matches(target_directory, max_hits=None, number_primers=None, expected_target_length=None):
     """
     Identifies the best primer match for target.
 
     Arguments:
         target_directory -- Temporary directory being used for the target
+        max_hits -- Maximum number of matches kept for the best primer, None or 0
+                    for no limit. The matches closest to forming an amplicon of the
+                    expected length are kept (see nearest_matches).
+        number_primers -- Only use the matches of primers with a slide below this, None for all
+        expected_target_length -- Expected length of the target, used to rank matches
+                                  when they are capped. None keeps them in BLAST order.
     
     Returns:
         forward_matches - Pandas dataframe with best forward primer matches
         reverse_matches - Pandas dataframe with best reverse primer matches
+        capped - True if matches of the best primer were dropped
     """
+    capped = False
     # Parse the best forward primer match(es)
     forward_matches = pd.read_csv(f"{target_directory}/forward_primers.blast.txt", sep="\t", header=None, names=BLAST_COLUMNS_FMT_6)
+    if number_primers is not None and len(forward_matches) > 0:
+        # Keep the primers of a smaller slide limit
+        forward_matches = forward_matches[forward_matches["qseqid"].str.replace("forward_", "").astype(int) < number_primers].reset_index(drop=True)
     if len(forward_matches) > 0:
         # Set names to just the slide amount
         forward_matches["qseqid"] = forward_matches["qseqid"].str.replace("forward_", "")
@@ -203,6 +1074,9 @@ def parse_primer_matches(target_directory):
     
     # Parse the best reverse primer match(es)
     reverse_matches = pd.read_csv(f"{target_directory}/reverse_primers.blast.txt", sep="\t", header=None, names=BLAST_COLUMNS_FMT_6)
+    if number_primers is not None and len(reverse_matches) > 0:
+        # Keep the primers of a smaller slide limit
+        reverse_matches = reverse_matches[reverse_matches["qseqid"].str.replace("reverse_", "").astype(int) < number_primers].reset_index(drop=True)
     if len(reverse_matches) > 0:
         # Set names to just the slide amount
         reverse_matches["qseqid"] = reverse_matches["qseqid"].str.replace("reverse_", "")
@@ -218,10 +1092,71 @@ def parse_primer_matches(target_directory):
     else:
         reverse_matches = None
 
-    return forward_matches, reverse_matches
+    # Cap the matches of each direction, ranked against all matches of the other direction
+    if max_hits:
+        capped_forward = nearest_matches(forward_matches, reverse_matches, "forward", expected_target_length, max_hits)
+        capped_reverse = nearest_matches(reverse_matches, forward_matches, "reverse", expected_target_length, max_hits)
+        capped = capped_forward is not forward_matches or capped_reverse is not reverse_matches
+        forward_matches, reverse_matches = capped_forward, capped_reverse
+
+    return forward_matches, reverse_matches, capped
 
 
-def sort_primer_pairs(forward_matches, reverse_matches, expected_target_length):
+def nearest_matches(matches, partners, direction, expected_target_length, max_hits):
+    """
+    Keeps the max_hits matches of a primer that come closest to forming an
+    amplicon of the expected length with a correctly placed match of the other
+    primer, measured the same way as in nearest_primer_pairs. Matches without
+    such a partner are ranked last, and ties keep BLAST order.
+
+    Arguments:
+        matches -- Pandas dataframe of the matches of the best primer of one direction
+        partners -- Pandas dataframe of the matches of the other direction, or None
+        direction -- forward/reverse, the direction of matches
+        expected_target_length -- Expected length of the target, None to keep
+                                  matches in BLAST order
+        max_hits -- Number of matches to keep
+
+    Returns:
+        matches -- The kept matches in BLAST order, or the matches unchanged if
+                   there are no more than max_hits
+    """
+    if matches is None or len(matches) <= max_hits:
+        return matches
+    distances = np.full(len(matches), np.inf)
+    if partners is not None and expected_target_length is not None:
+        # Forward primers start an amplicon and reverse primers end it
+        position_column, partner_column = ("sstart", "send") if direction == "forward" else ("send", "sstart")
+        partner_groups = {key: np.sort(group[partner_column].to_numpy(dtype=np.int64)) for key, group in partners.groupby(["sseqid", "strand"], sort=False)}
+        for key, rows in matches.groupby(["sseqid", "strand"], sort=False).indices.items():
+            if key not in partner_groups:
+                continue
+            partner_positions = partner_groups[key]
+            positions = matches[position_column].to_numpy(dtype=np.int64)[rows]
+            # Partners are at higher positions for forward matches on + and reverse
+            # matches on -, and at lower positions otherwise
+            downstream = (direction == "forward") == (key[1] == "+")
+            if downstream:
+                expected = positions + expected_target_length
+                lowest = np.searchsorted(partner_positions, positions, side="right")
+                highest = np.full(len(rows), len(partner_positions))
+            else:
+                expected = positions - expected_target_length
+                lowest = np.zeros(len(rows), dtype=np.int64)
+                highest = np.searchsorted(partner_positions, positions, side="left")
+            # The nearest partner in range is on one side of the expected position
+            right = np.clip(np.searchsorted(partner_positions, expected), lowest, highest)
+            left = right - 1
+            has_left = left >= lowest
+            has_right = right < highest
+            left_distances = np.where(has_left, np.abs(partner_positions[np.maximum(left, 0)] - expected), np.inf)
+            right_distances = np.where(has_right, np.abs(partner_positions[np.minimum(right, len(partner_positions) - 1)] - expected), np.inf)
+            distances[rows] = np.minimum(left_distances, right_distances)
+    kept = np.sort(np.argsort(distances, kind="stable")[:max_hits])
+    return matches.iloc[kept].reset_index(drop=True)
+
+
+def sort_primer_pairs(forward_matches, reverse_matches, expected_target_length, max_pairs=None):
     """
     Identifies primer pairs. The total number of pairs will be whichever 
     direction primer had less hits. E.g. if forward primer was found once, but
@@ -235,12 +1170,17 @@ def sort_primer_pairs(forward_matches, reverse_matches, expected_target_length):
         reverse_matches -- Pandas dataframe containing the reverse primer matches
         expected_target_length -- Expected length of the target is the length of the reference
                               target sequence.
+        max_pairs -- Maximum number of candidate pairs, None or 0 for no limit. If
+                     more pairs are possible, only the max_pairs pairs closest to the
+                     expected length are considered (see nearest_primer_pairs).
 
     Returns:
         primer_pairs_indices -- List of tuples containing indices of the 
         forward and reverse primers that form pairs
         error -- Reason why target failed to be identified
+        capped -- True if candidate pairs were dropped
     """
+    capped = False
     # Store pairs as tuples of forward and reverse index
     primer_pairs_indices = []
     # Store error message
@@ -258,23 +1198,32 @@ def sort_primer_pairs(forward_matches, reverse_matches, expected_target_length):
         forward_matches["index"] = forward_matches.index
         reverse_matches["index"] = reverse_matches.index 
         
-        # Merge on sseqid and strand to make sure primers are on correct contig and in correct direction
-        pairs = pd.merge(forward_matches, reverse_matches, on=["sseqid", "strand"], suffixes=("_f", "_r"))
-
-        if len(pairs) == 0:
+        # Number of forward x reverse pairs on the same contig and strand
+        pair_counts = pd.merge(forward_matches.groupby(["sseqid", "strand"]).size().rename("forward"),
+                               reverse_matches.groupby(["sseqid", "strand"]).size().rename("reverse"), left_index=True, right_index=True)
+        candidate_count = int((pair_counts["forward"] * pair_counts["reverse"]).sum())
+        if max_pairs and candidate_count > max_pairs:
+            # Only generate the pairs closest to the expected length
+            capped = True
+            valid_ordered_pairs = nearest_primer_pairs(forward_matches, reverse_matches, expected_target_length, max_pairs)
+        else:
+            # Merge on sseqid and strand to make sure primers are on correct contig and in correct direction
+            pairs = pd.merge(forward_matches, reverse_matches, on=["sseqid", "strand"], suffixes=("_f", "_r"))
+
+            # Filter out bad pairs that are in improper order
+            valid_ordered_pairs = pairs[
+                ((pairs["strand"] == "+") & (pairs["sstart_f"] < pairs["send_r"])) |
+                ((pairs["strand"] == "-") & (pairs["send_r"] < pairs["sstart_f"]))
+            ].copy()
+            if len(valid_ordered_pairs) > 0:
+                # Calculate distances
+                valid_ordered_pairs["distance"] = abs(abs(valid_ordered_pairs["sstart_f"] - valid_ordered_pairs["send_r"]) - expected_target_length)
+
+        if candidate_count == 0:
             error = f"Forward primers found on {','.join(pd.unique(forward_matches['sseqid'].astype(str)))} ({'/'.join(forward_matches['strand'])}) and reverse primers found on {','.join(pd.unique(reverse_matches['sseqid'].astype(str)))} ({'/'.join(reverse_matches['strand'])}) "
 
-        # Filter out bad pairs that are in improper order
-        valid_ordered_pairs = pairs[
-            ((pairs["strand"] == "+") & (pairs["sstart_f"] < pairs["send_r"])) |
-            ((pairs["strand"] == "-") & (pairs["send_r"] < pairs["sstart_f"]))
-        ].copy()
-
-        # Calculate distance from expected length to get primer pairs distances
+        # Pick primer pairs by distance from the expected length
         if len(valid_ordered_pairs) > 0:
-            # Calculate distances
-            valid_ordered_pairs["distance"] = abs(abs(valid_ordered_pairs["sstart_f"] - valid_ordered_pairs["send_r"]) - expected_target_length)
-            
             # Sort by distance
             valid_ordered_pairs.sort_values(by="distance", ascending = True, inplace= True)
 
@@ -298,168 +1247,208 @@ def sort_primer_pairs(forward_matches, reverse_matches, expected_target_length):
                     break
             # Error is empty
             error = ""
-        elif len(pairs) > 0:
+        elif candidate_count > 0:
             error = "Forward and reverse primers were identified, but they were not in the correct order (i.e. F after R or R after F)."
     elif forward_matches is None and reverse_matches is None:
-        error = "Neither forward nor reverse primers were not identified."
+        error = NO_PRIMERS_MESSAGE
     elif forward_matches is None:
         error = f"The forward primer was not identified, a reverse primer was found with slide of {reverse_matches['qseqid'][0]}."
     elif reverse_matches is None:
         error = f"The reverse primer was not identified, a forward primer was found with slide of {forward_matches['qseqid'][0]}."
 
-    return primer_pairs_indices, error
+    return primer_pairs_indices, error, capped
+
+
+def nearest_primer_pairs(forward_matches, reverse_matches, expected_target_length, max_pairs):
+    """
+    Finds the max_pairs correctly ordered primer pairs closest to the expected
+    length without building every forward x reverse pair. Reverse matches of
+    each contig and strand are sorted by position, so the reverse matches of a
+    forward match are visited in order of distance by moving outwards from its
+    expected position. A heap merges these visits over all forward matches.
 
+    Arguments:
+        forward_matches -- Pandas dataframe containing forward primer matches
+        reverse_matches -- Pandas dataframe containing the reverse primer matches
+        expected_target_length -- Expected length of the target
+        max_pairs -- Number of pairs to return
 
-def extract_target_location(primer_pair_indices, forward_matches, reverse_matches, temp_directory):
+    Returns:
+        pairs -- Dataframe of pairs with index_f, index_r and distance columns,
+                 sorted by distance
+    """
+    reverse_groups = {key: group for key, group in reverse_matches.groupby(["sseqid", "strand"], sort=False)}
+    # One stream per forward match: [positions, reverse indices, expected position, next left, next right, lowest, highest, forward index]
+    streams = []
+    heap = []
+
+    def push(stream_id):
+        positions, _, expected, left, right, lowest, highest, _ = streams[stream_id]
+        candidates = []
+        if left >= lowest:
+            candidates.append((abs(int(positions[left]) - expected), left))
+        if right < highest:
+            candidates.append((abs(int(positions[right]) - expected), right))
+        if candidates:
+            distance, position = min(candidates)
+            heapq.heappush(heap, (distance, stream_id, position))
+
+    for key, forward_group in forward_matches.groupby(["sseqid", "strand"], sort=False):
+        if key not in reverse_groups:
+            continue
+        reverse_group = reverse_groups[key]
+        order = np.argsort(reverse_group["send"].to_numpy(), kind="stable")
+        positions = reverse_group["send"].to_numpy()[order]
+        reverse_indices = reverse_group["index"].to_numpy()[order]
+        for forward_index, forward_start in zip(forward_group["index"], forward_group["sstart"]):
+            forward_start = int(forward_start)
+            # Reverse primers must end after (+) or before (-) the forward primer starts
+            if key[1] == "+":
+                expected = forward_start + expected_target_length
+                lowest, highest = int(np.searchsorted(positions, forward_start, side="right")), len(positions)
+            else:
+                expected = forward_start - expected_target_length
+                lowest, highest = 0, int(np.searchsorted(positions, forward_start, side="left"))
+            start = min(max(int(np.searchsorted(positions, expected)), lowest), highest)
+            streams.append([positions, reverse_indices, expected, start - 1, start, lowest, highest, forward_index])
+            push(len(streams) - 1)
+
+    pairs = []
+    while heap and len(pairs) < max_pairs:
+        distance, stream_id, position = heapq.heappop(heap)
+        stream = streams[stream_id]
+        pairs.append((stream[7], stream[1][position], distance))
+        if position == stream[3]:
+            stream[3] -= 1
+        else:
+            stream[4] += 1
+        push(stream_id)
+    return pd.DataFrame(pairs, columns=["index_f", "index_r", "distance"])
+
+
+def extract_target_locations(primer_pairs, forward_matches, reverse_matches, genome):
     """
-    Returns the location of the target given a set of primer pair indices
-    for the forward and reverse BLAST searches.
+    Returns the locations of the targets of a set of primer pairs, given as
+    indices of the forward and reverse BLAST matches. Locations are clamped to
+    the ends of their contigs.
 
     Arguments:
-        primer_pair_indiced -- Tuple of indices for the forward and reverse
-                               BLAST matches for the primers.
+        primer_pairs -- List of (forward index, reverse index) tuples of the
+                        BLAST matches of each primer pair
         forward_matches -- Pandas dataframe containing forward primer matches
         reverse_matches -- Pandas dataframe containing the reverse primer matches
+        genome -- PackedGenome of the assembly
 
     Return:
-        contig -- Contig on which target is located
-        start -- Start position
-        end -- End position
-        strand -- +/- strand
-        forward_slide -- # of bases slide on forward primer
-        reverse_slide -- # of bases slide on reverse primer
+        contigs -- Contig on which each target is located
+        starts -- Start positions
+        ends -- End positions
+        strands -- +/- strand of each target
+        forward_slides -- # of bases slide on forward primers
+        reverse_slides -- # of bases slide on reverse primers
     """
-    # Obtain location of target
-    contig = forward_matches.iloc[primer_pair_indices[0]]["sseqid"]
-    strand = forward_matches.iloc[primer_pair_indices[0]]["strand"]
-    
-    ## If positive strand then going from sstart to send
-    if strand == "+":
-        # Start position is where primer landed and subtract off primer slide amount
-        start = int(forward_matches.iloc[primer_pair_indices[0]]["sstart"]) - int(forward_matches.iloc[primer_pair_indices[0]]["qseqid"])
-        # End position is where primer landed and add primer slide amount
-        end = int(reverse_matches.iloc[primer_pair_indices[1]]["send"]) + int(reverse_matches.iloc[primer_pair_indices[1]]["qseqid"])
-    # If negative strand, then reverse the direction
-    else:
-        # Start position is where reverse primer landed and add slide amount
-        start = int(reverse_matches.iloc[primer_pair_indices[1]]["send"]) - int(reverse_matches.iloc[primer_pair_indices[1]]["qseqid"])
-        # End position is where forward primer landed, and subtract slide amount
-        end = int(forward_matches.iloc[primer_pair_indices[0]]["sstart"]) + int(forward_matches.iloc[primer_pair_indices[0]]["qseqid"])
-    
+    pairs = np.asarray(primer_pairs, dtype=np.int64).reshape(-1, 2)
+    forward = forward_matches.iloc[pairs[:, 0]]
+    reverse = reverse_matches.iloc[pairs[:, 1]]
+    contigs = forward["sseqid"].to_numpy(dtype=object)
+    strands = forward["strand"].to_numpy(dtype=object)
+    forward_slides = forward["qseqid"].to_numpy(dtype=np.int64)
+    reverse_slides = reverse["qseqid"].to_numpy(dtype=np.int64)
+    forward_starts = forward["sstart"].to_numpy(dtype=np.int64)
+    reverse_ends = reverse["send"].to_numpy(dtype=np.int64)
+
+    # On the positive strand the target goes from the forward primer (minus its
+    # slide) to the reverse primer (plus its slide), on the negative strand the
+    # other way around
+    positive = strands == "+"
+    starts = np.where(positive, forward_starts - forward_slides, reverse_ends - reverse_slides)
+    ends = np.where(positive, reverse_ends + reverse_slides, forward_starts + forward_slides)
 
-    # Grab length of the contig to ensure that sliding doesn't exceed the ends
-    contigs = SeqIO.index(f"{temp_directory}/reference.fasta", "fasta")
-    contig_length = len(contigs[str(contig)].seq)
-    
     # Check that not exceeding the contig limits
-    if start < 1:
-        start = 1
-    if end > contig_length:
-        end = contig_length
-
-    forward_slide = forward_matches.iloc[primer_pair_indices[0]]["qseqid"]
-    reverse_slide = reverse_matches.iloc[primer_pair_indices[1]]["qseqid"]
+    contig_lengths = {contig: genome.contig_length(contig) for contig in pd.unique(contigs)}
+    starts = np.maximum(starts, 1)
+    ends = np.minimum(ends, pd.Series(contigs).map(contig_lengths).to_numpy(dtype=np.int64))
 
-    return contig, start, end, strand, forward_slide, reverse_slide
+    return contigs, starts, ends, strands, forward_slides, reverse_slides
 
 
-def extract_target_sequence(contig, start, end, temp_directory):
+def extract_target_sequence(contig, start, end, genome):
     """
-    Extracts the target sequence using pyfaidx.
+    Extracts the target sequence from the packed genome.
 
     Arguments:
         contig -- Contig on which target is located.
         start -- Start position
         end -- End position
-        temp_directory -- Working directory for SPIDER
+        genome -- PackedGenome of the assembly
 
     Returns:
         seq -- Target sequence that was identified
         length -- Length of the target sequence extracted
     """
-    genome = Fasta(f"{temp_directory}/reference.fasta")
-    contig = str(contig)
     # Must subtract 1 base from start since python index at 0 and BLAST coordinate index at 1
-    seq = str(genome[contig][start-1:end])
+    seq = genome.fetch(contig, start-1, end)
     length = end-start+1 # Add 1 to be inclusive of ends
     
     return seq, length
 
 
-def align_target(reference_sequence, target_sequence, target_strand):
+def align_targets(reference_sequence, target_sequences, target_strands):
     """
-    Aligns target sequence to the reference sequence.
+    Aligns target sequences to the reference sequence.
 
     Arguments:
         reference_sequence -- Target sequence
-        target_sequence -- Extracted sequence from in-silico PCR
-        target_strand -- Which strand the extracted target was identified on.
-                     This is used to determine whether reverse complement
-                     is needed.
+        target_sequences -- Extracted sequences from in-silico PCR
+        target_strands -- Which strand each extracted target was identified on.
+                          This is used to determine whether reverse complement
+                          is needed.
 
     Returns:
-        identity -- Percent identity between target sequence and reference
-        coverage_percent_length -- Length of target_sequence divided by the length of the reference
-        coverage_alignment -- Alternative coverage metric that ignores gaps. Length of target_sequence minus gaps divided by length of the reference.
+        matches -- Number of matching bases of each alignment
+        alignment_lengths -- Length of each alignment
+        gaps -- Number of gaps in each aligned target sequence
     """
-
      # Create pairwise alignment of the reference and target_sequence
     aligner = PairwiseAligner(scoring="blastn")
     aligner.mode = 'global'
 
-    # Reverse complement if - strand
-    if target_strand == "-":
-        target_sequence = reverse_complement(target_sequence)
-
-    # Grab the best alignment
-    alignment = aligner.align(reference_sequence, target_sequence)[0]
-    # Number of matches is the number of | characters in the printout
-    matches = alignment.format().count("|")
-    # Identity is the number of matches over the total length, multiply by 100 for %
-    identity = round(matches/alignment.length*100, 2)
-    # Simple coverage metric that looks at length discrepency
-    coverage_percent_length = round(len(target_sequence)/len(reference_sequence)*100, 2)
-    # Alternative coverage metric that does not count gaps
-    coverage_alignment = round((len(target_sequence) - alignment[1].count("-"))/len(reference_sequence)*100, 2)
+    counts = []
+    for target_sequence, target_strand in zip(target_sequences, target_strands):
+        # Reverse complement if - strand
+        if target_strand == "-":
+            target_sequence = reverse_complement(target_sequence)
+        # Grab the best alignment
+        alignment = aligner.align(reference_sequence, target_sequence)[0]
+        # Number of matches is the number of | characters in the printout
+        counts.append((alignment.format().count("|"), alignment.length, alignment[1].count("-")))
+    counts = np.array(counts, dtype=np.int64).reshape(-1, 3)
+    return counts[:, 0], counts[:, 1], counts[:, 2]
 
-    return identity, coverage_percent_length, coverage_alignment
 
-
-def validate_target(identity, coverage_percent_length, length_limit, identity_limit):
+def validate_targets(identity, coverage_percent_length, length_limit, identity_limit):
     """
-    Validates that a target meets criteria to be called.
+    Validates that targets meet the criteria to be called.
 
     Arguments:
-        reference_sequence -- Target sequence
-        target_sequence -- Extracted sequence from in-silico PCR
-        target_strand -- Which strand the extracted target was identified on.
-                     This is used to determine whether reverse complement
-                     is needed.
+        identity -- Array of percent identities of the targets
+        coverage_percent_length -- Array of target lengths as percent of the reference length
         length_limit -- Argument for length limit provided by the user.
                         This is written as a percent +/- the length of
                         the reference sequence.
         identity_limit -- Argument for identity limit provided by the user.
 
     Return:
-        valid -- True or false if valid or not
-        error -- Reason that target was not validated
+        valid -- Array of True or false if valid or not
+        errors -- Array of reasons that targets were not validated
     """
-    valid = False
-    error = ""
-    # Check that identity and length limits are met
-    if identity >= identity_limit and coverage_percent_length >= 100 - length_limit and coverage_percent_length <= 100 + length_limit:
-        error = ""
-        valid = True
-    # Identity meets criteria, but not length
-    elif identity >= identity_limit and not (coverage_percent_length >= 100 - length_limit and coverage_percent_length <= 100 + length_limit):
-        error = "Length limit not satisfied."
-    # Length meets criteria, but not identity
-    elif coverage_percent_length >= 100 - length_limit and coverage_percent_length <= 100 + length_limit and not identity >= identity_limit:
-        error = "Identity limit not satisfied."
-    else:
-        error = "Identity and length limits not satisfied."
-    
-    return valid, error
+    identity_ok = identity >= identity_limit
+    length_ok = (coverage_percent_length >= 100 - length_limit) & (coverage_percent_length <= 100 + length_limit)
+    valid = identity_ok & length_ok
+    errors = np.select([valid, identity_ok, length_ok],
+                       ["", "Length limit not satisfied.", "Identity limit not satisfied."],
+                       "Identity and length limits not satisfied.")
+    return valid, errors
 
 def reverse_complement(sequence):
     """
@@ -471,10 +1460,7 @@ def reverse_complement(sequence):
     Returns:
         reverse_complement -- Reverse complement of the sequence
     """
-    # Convert to bioconda sequence object
-    sequence = Seq(sequence)
-    
-    return sequence.reverse_complement()
+    return reverse_complement_str(str(sequence))
 
 def find_overlaps(table):
     """
@@ -486,33 +1472,35 @@ def find_overlaps(table):
     Returns:
         table -- Input table with overlapping regions appended to message
     """
-    table["Overlap"] = ""
-    # Iterate over all unique pairs
-    for idx1, idx2 in combinations(table.index, 2):
-        row1, row2 = table.loc[idx1], table.loc[idx2]
-
-        # Check conditions
-        if row1["Valid"] and row2["Valid"] and row1["Query"] == row2["Query"] and row1["Strand"] == row2["Strand"] and row1["Contig"] == row2["Contig"]:
-            # Check for overlap
-            if row1["End"] >= row2["Start"] and row2["End"] >= row1["Start"]:
-                warning1 = f"{row2['Name']}"
-                warning2 = f"{row1['Name']}"
-
-                # Append warning to both rows
-                for idx, warning in [(idx1, warning1), (idx2, warning2)]:
-                    if table.at[idx, "Overlap"]:
-                        table.at[idx, "Overlap"] += "; " + warning
-                    else:
-                        table.at[idx, "Overlap"] = warning
+    overlaps = np.full(len(table), "", dtype=object)
+    valid = table["Valid"].fillna(False).to_numpy(dtype=bool)
+    located = table[valid]
+    # Only valid amplicons of the same assembly, strand and contig can overlap
+    # Rows of different settings in a parameter sweep are compared separately
+    groups = ["Query", "Strand", "Contig"] + [column for column in ("Primer_Size", "Slide_Limit") if column in table.columns]
+    for positions in located.groupby(groups, sort=False, observed=True).indices.values():
+        if len(positions) < 2:
+            continue
+        rows = np.flatnonzero(valid)[positions]
+        starts = table["Start"].to_numpy(dtype=float, na_value=np.nan)[rows]
+        ends = table["End"].to_numpy(dtype=float, na_value=np.nan)[rows]
+        names = table["Name"].to_numpy()[rows]
+        overlapping = (ends[:, None] >= starts[None, :]) & (ends[None, :] >= starts[:, None])
+        np.fill_diagonal(overlapping, False)
+        # Warnings list the other rows in table order
+        for row, others in zip(rows, overlapping):
+            if others.any():
+                overlaps[row] = "; ".join(str(name) for name in names[others])
+    table["Overlap"] = overlaps
     return table
 
-def find_start_stop(table, temp_directory):
+def find_start_stop(table, genome):
     """
     Scans in silico amplicons and nearby sequences for start and stop codons.
     
     Arguments:
         table - Table of results from SPIDER
-        temp_directory - Temporary directory used by SPIDER to search a sequence
+        genome - PackedGenome of the assembly that was searched
 
     Returns:
         table - Table with appended columns for start_codon, stop_codon, and in-frame
@@ -522,73 +1510,84 @@ def find_start_stop(table, temp_directory):
     table['Closest_Stop_Codon'] = ""
     table['Closest_Stop_Codon_Matches_Amplicon'] = ""
     table['Closest_Start_Stop_In_Frame'] = ""
-    for idx, row in table.iterrows():
-        if not row['Contig'] == "NA":
-            # Grab length of the contig to ensure that sliding doesn't exceed the ends
-            contigs = SeqIO.index(f"{temp_directory}/reference.fasta", "fasta")
-            contig_length = len(contigs[str(row['Contig'])].seq)
-
-            # Extract 100 bp before and after start/end
-            start_search = row['Start'] - 100
-            
-            # Make sure don't go off ends of contig
-            if start_search < 1:
-                start_search = 1
-            start_dist = row['Start'] - start_search
-            end_search = row['End'] + 100
-            if end_search > contig_length:
-                end_search = contig_length
-
-            # Grab sequence
-            extracted_seq, length = extract_target_sequence(row['Contig'], start_search, end_search, temp_directory)
-            if row['Strand'] == '-':
-                extracted_seq = reverse_complement(extracted_seq)
-            extracted_seq = str(extracted_seq)
-
-            # Find start codon locations
-            start_codon_idx = [codon.start() for codon in re.finditer('ATG', extracted_seq)]
-            if len(start_codon_idx) > 0:
-                start_codon_idx = np.array(start_codon_idx)
-                # Find distances from the start
-                start_codon_distances = start_codon_idx - start_dist
-                start_codon_distances_abs = abs(start_codon_distances)
-                closest_start_codon_idx = start_codon_idx[np.argmin(start_codon_distances_abs)]
-
-                # Add start codon result
-                closest_start_codon_position = closest_start_codon_idx - start_dist + row['Start']
-                table.at[idx, "Closest_Start_Codon"] = closest_start_codon_position
-                table.at[idx, 'Closest_Start_Codon_Matches_Amplicon'] = closest_start_codon_position == row['Start']
-            else:
-                table.at[idx, "Closest_Start_Codon"] = "No start codons found"
-
-            # Find stop codon locations
-            stop_codons = ["TAA", "TAG", "TGA"]
-            stop_codon_idx = []
-            for stop_codon in stop_codons:
-                stop_codon_idx += [codon.start() for codon in re.finditer(stop_codon, extracted_seq)]
-
-            if len(stop_codon_idx) > 0:
-                stop_codon_idx = np.array(stop_codon_idx)
-
-                # Find distances from the end
-                stop_codon_distances = stop_codon_idx - (row['Target_Length'] - 2 + start_dist)
-                stop_codon_distances_abs = abs(stop_codon_distances)
-                closest_stop_codon_idx = stop_codon_idx[np.argmin(stop_codon_distances_abs)]
-
-                # Add stop codon result
-                closest_stop_codon_position = closest_stop_codon_idx - start_dist + row['Start']
-                table.at[idx, "Closest_Stop_Codon"] = closest_stop_codon_position
-                table.at[idx, 'Closest_Stop_Codon_Matches_Amplicon'] = closest_stop_codon_position + 2 == row['End']
-            else:
-                table.at[idx, "Closest_Stop_Codon"] = "No stop codons found"
+    # Only rows with an amplicon are scanned
+    for idx, row in table[table['Contig'].notna()].iterrows():
+        # Grab length of the contig to ensure that sliding doesn't exceed the ends
+        contig_length = genome.contig_length(row['Contig'])
 
-            # Check that closest start and stop codons are in frame with one another
-            if len(start_codon_idx) > 0 and len(stop_codon_idx) > 0:
-                closest_in_frame = (closest_stop_codon_idx - closest_start_codon_idx) % 3 == 0
-                table.at[idx, "Closest_Start_Stop_In_Frame"] = closest_in_frame
-            
+        # Extract 100 bp before and after start/end
+        start_search = row['Start'] - 100
+        
+        # Make sure don't go off ends of contig
+        if start_search < 1:
+            start_search = 1
+        start_dist = row['Start'] - start_search
+        end_search = row['End'] + 100
+        if end_search > contig_length:
+            end_search = contig_length
+
+        # Grab sequence as an array of bases
+        extracted_seq = genome.fetch_array(row['Contig'], start_search-1, end_search)
+        if row['Strand'] == '-':
+            extracted_seq = reverse_complement_array(extracted_seq)
+
+        # Find start codon locations
+        start_codon_idx = find_codon(extracted_seq, "ATG")
+        if len(start_codon_idx) > 0:
+            # Find distances from the start
+            start_codon_distances = start_codon_idx - start_dist
+            start_codon_distances_abs = abs(start_codon_distances)
+            closest_start_codon_idx = start_codon_idx[np.argmin(start_codon_distances_abs)]
+
+            # Add start codon result
+            closest_start_codon_position = closest_start_codon_idx - start_dist + row['Start']
+            table.at[idx, "Closest_Start_Codon"] = closest_start_codon_position
+            table.at[idx, 'Closest_Start_Codon_Matches_Amplicon'] = closest_start_codon_position == row['Start']
+        else:
+            table.at[idx, "Closest_Start_Codon"] = "No start codons found"
+
+        # Find stop codon locations
+        stop_codons = ["TAA", "TAG", "TGA"]
+        stop_codon_idx = np.concatenate([find_codon(extracted_seq, stop_codon) for stop_codon in stop_codons])
+
+        if len(stop_codon_idx) > 0:
+            # Find distances from the end
+            stop_codon_distances = stop_codon_idx - (row['Target_Length'] - 2 + start_dist)
+            stop_codon_distances_abs = abs(stop_codon_distances)
+            closest_stop_codon_idx = stop_codon_idx[np.argmin(stop_codon_distances_abs)]
+
+            # Add stop codon result
+            closest_stop_codon_position = closest_stop_codon_idx - start_dist + row['Start']
+            table.at[idx, "Closest_Stop_Codon"] = closest_stop_codon_position
+            table.at[idx, 'Closest_Stop_Codon_Matches_Amplicon'] = closest_stop_codon_position + 2 == row['End']
+        else:
+            table.at[idx, "Closest_Stop_Codon"] = "No stop codons found"
+
+        # Check that closest start and stop codons are in frame with one another
+        if len(start_codon_idx) > 0 and len(stop_codon_idx) > 0:
+            closest_in_frame = (closest_stop_codon_idx - closest_start_codon_idx) % 3 == 0
+            table.at[idx, "Closest_Start_Stop_In_Frame"] = closest_in_frame
+        
     return table
 
+def find_codon(sequence, codon):
+    """
+    Finds all positions of a codon in a sequence.
+
+    Arguments:
+        sequence -- uint8 numpy array of bases
+        codon -- Codon to find (case sensitive)
+
+    Returns:
+        positions -- Sorted numpy array of 0-based codon start positions
+    """
+    if len(sequence) < 3:
+        return np.empty(0, dtype=np.int64)
+    matches = np.ones(len(sequence) - 2, dtype=bool)
+    for i, base in enumerate(codon.encode()):
+        matches &= sequence[i:len(sequence) - 2 + i] == base
+    return np.flatnonzero(matches)
+
 def find_annotations(table, annotation, temp_directory):
     try:
         # Create temporary table
@@ -601,7 +1600,7 @@ def find_annotations(table, annotation, temp_directory):
 
         # Go through each entry
         for idx, row in mod_table.iterrows():
-            if not row['Contig'] == "NA":
+            if pd.notna(row['Contig']):
                 ann_filtered = ann_table[(ann_table['strand'] == row['Strand']) & (row['End'] >= ann_table['start']) & (ann_table['end'] >= row['Start'])]
                 if len(ann_filtered) > 0:
                     # Insert all overlapping annotated genes
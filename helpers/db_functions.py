@@ -1,10 +1,9 @@
 from helpers.settings import DATABASE_DESCRIPTIONS, DATABASE_FILENAMES, DATABASE_URL, SPIDER_DBS_FOLDER
+from helpers.header_index import open_header_index, search_header_index
 import os
-from urllib.request import urlretrieve
 import gzip
 import sys
 import uuid
-from Bio import SeqIO
 
 def list_databases():
     """
@@ -65,6 +64,8 @@ def download_db(db_name):
     Arguments:
         db_name - Name of the requested database
     """
+    from urllib.request import urlretrieve
+
     os.makedirs(f"{SPIDER_DBS_FOLDER}", exist_ok=True)
     
     urlretrieve(DATABASE_URL[db_name], f"{SPIDER_DBS_FOLDER}/{DATABASE_FILENAMES[db_name]}") # In future add versioning to this
@@ -78,19 +79,40 @@ def open_correct_format(file):
     else:
         return open(file, 'r')
     
+def read_database(database_loc):
+    """
+    Reads the records of a database.
+
+    Arguments:
+        database_loc - Database to read (plain or gzipped FASTA)
+
+    Yields:
+        record - (description, sequence) of each record
+    """
+    from Bio import SeqIO
+
+    with open_correct_format(database_loc) as handle:
+        for record in SeqIO.parse(handle, "fasta"):
+            yield record.description, str(record.seq)
+
 def prepare_db(database_loc, search_term):
     """
     Prepares database for SPIDER search. If a search term is specified, only
     sequences with the search term in the fasta header will be included.
+    Search terms are looked up in a header index of the database, built the
+    first time the database is searched and whenever it changes.
 
     Arguments:
-        search_term - String to look for in fasta headers
+        search_term - String (or query, see parse_query) to look for in fasta headers
         database_loc - Database to search
 
     Returns:
         count -- Number of VFs belonging to the search_term
         tmp_db -- Location of the output database for SPIDER
     """
+    # Deferred so that listing databases does not load biopython
+    from Bio import SeqIO
+
     # If don't have the output folder yet, create it
     os.makedirs(SPIDER_DBS_FOLDER, exist_ok=True)
 
@@ -100,13 +122,17 @@ def prepare_db(database_loc, search_term):
     # Write to the temp db and count sequences included
     count = 0
     with open(tmp_db, "w") as out_db:
-        with open_correct_format(database_loc) as handle:
-            for record in SeqIO.parse(handle, "fasta"):
-                if search_term:
-                    if search_term.lower() in record.description.lower():
-                        out_db.write(f">{record.description}\n{record.seq}\n")
-                        count += 1
-                else:
+        if search_term:
+            connection = open_header_index(database_loc, lambda: read_database(database_loc))
+            try:
+                for description, sequence in search_header_index(connection, search_term):
+                    out_db.write(f">{description}\n{sequence}\n")
+                    count += 1
+            finally:
+                connection.close()
+        else:
+            with open_correct_format(database_loc) as handle:
+                for record in SeqIO.parse(handle, "fasta"):
                     out_db.write(f">{record.description}\n{record.seq}\n")
                     count += 1
 
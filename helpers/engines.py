@@ -0,0 +1,212 @@
+import abc
+import asyncio
+import hashlib
+import os
+import shutil
+import subprocess
+import sys
+import uuid
+from collections import namedtuple
+from helpers.settings import BLAST_COLUMNS_FMT_6, BLAST_DEFAULT_EVALUE
+from helpers import telemetry
+
+# A search of the primers (or seed regions) in a query FASTA against one database
+# of an assembly. Every engine writes the matches to output as tab-separated rows
+# of BLAST_COLUMNS_FMT_6 followed by extra_columns, in BLAST order (by query, then
+# by score), the same as blastn -outfmt 6.
+#   query -- FASTA of primers named {direction}_{offset}, or of a seed region
+#   database -- Database of the assembly, as given to prepare_assembly
+#   output -- Location of the matches
+#   word_size -- Primer size, the shortest match reported
+#   extra_columns -- Tuple of columns after BLAST_COLUMNS_FMT_6 (e.g. ("qseq", "sseq"))
+#   evalue -- E-value cutoff
+#   max_target_seqs -- Maximum number of subject sequences per query, None for the default
+#   dbsize -- Size of the whole assembly for statistics when it is split into several databases
+PrimerSearch = namedtuple("PrimerSearch", ["query", "database", "output", "word_size", "extra_columns", "evalue", "max_target_seqs", "dbsize"])
+
+def file_digest(location):
+    """
+    Hashes the content of a file.
+
+    Arguments:
+        location -- Location of the file
+
+    Returns:
+        digest -- Hex SHA-256 digest of the file
+    """
+    digest = hashlib.sha256()
+    with open(location, "rb") as handle:
+        for block in iter(lambda: handle.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+class SearchEngine(abc.ABC):
+    """
+    Interface of primer search engines. An engine prepares each assembly
+    database, runs primer searches against it, and releases the databases once
+    the assembly is done. Engines must implement search.
+    """
+    name = None
+
+    def __init__(self, hits_loc=None):
+        """
+        Arguments:
+            hits_loc -- Directory of recorded searches (see recording_loc), None for no recordings
+        """
+        self.hits_loc = hits_loc
+        # Content hash of each prepared database, used to name recordings
+        self.database_digests = {}
+
+    def prepare_assembly(self, database):
+        """
+        Prepares a FASTA file of (part of) an assembly to be searched. The file
+        can be removed once this returns.
+
+        Arguments:
+            database -- Location of the FASTA file, used as the database of searches
+        """
+        if self.hits_loc:
+            self.database_digests[database] = file_digest(database)
+
+    @abc.abstractmethod
+    def search(self, primer_search):
+        """
+        Runs a primer search.
+
+        Arguments:
+            primer_search -- PrimerSearch to run
+        """
+
+    async def search_async(self, primer_search):
+        """
+        Runs a primer search without blocking other asyncio tasks. By default
+        the search runs in the calling thread.
+
+        Arguments:
+            primer_search -- PrimerSearch to run
+        """
+        self.search(primer_search)
+
+    def release(self, databases):
+        """
+        Releases the databases of an assembly once it has been crawled.
+
+        Arguments:
+            databases -- List of databases given to prepare_assembly
+        """
+        for database in databases:
+            self.database_digests.pop(database, None)
+
+    def recording_loc(self, primer_search):
+        """
+        Gives the location of the recording of a search. Recordings are named by
+        the content of the database and query and the search settings, so they
+        do not depend on temporary file names.
+
+        Arguments:
+            primer_search -- PrimerSearch that is recorded
+
+        Returns:
+            location -- Location of the recorded matches
+        """
+        fields = (self.database_digests[primer_search.database], file_digest(primer_search.query),
+                  primer_search.word_size, tuple(primer_search.extra_columns), float(primer_search.evalue),
+                  primer_search.max_target_seqs, primer_search.dbsize)
+        key = hashlib.sha256(repr(fields).encode()).hexdigest()
+        return f"{self.hits_loc}/{key[:2]}/{key}.tsv"
+
+class BlastnEngine(SearchEngine):
+    """
+    Searches primers with makeblastdb and blastn. If a hits directory is given,
+    every search is recorded in it for the replay engine.
+    """
+    name = "blastn"
+
+    def prepare_assembly(self, database):
+        super().prepare_assembly(database)
+        subprocess.run(["makeblastdb", "-in", database, "-dbtype", "nucl"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        telemetry.count("makeblastdb_calls")
+
+    def command(self, primer_search):
+        """
+        Builds the blastn command of a search.
+
+        Arguments:
+            primer_search -- PrimerSearch to run
+
+        Returns:
+            blast_cmd -- blastn command list
+        """
+        outfmt = "6 " + " ".join(list(BLAST_COLUMNS_FMT_6) + list(primer_search.extra_columns)) if primer_search.extra_columns else "6"
+        blast_cmd = ["blastn", "-query", primer_search.query,
+                     "-db", primer_search.database,
+                     "-outfmt", outfmt, "-word_size", f"{primer_search.word_size}",
+                     "-out", primer_search.output]
+        if primer_search.evalue != BLAST_DEFAULT_EVALUE:
+            blast_cmd += ["-evalue", f"{primer_search.evalue}"]
+        if primer_search.max_target_seqs is not None:
+            blast_cmd += ["-max_target_seqs", f"{primer_search.max_target_seqs}"]
+        if primer_search.dbsize is not None:
+            blast_cmd += ["-dbsize", f"{primer_search.dbsize}"]
+        return blast_cmd
+
+    def search(self, primer_search):
+        telemetry.count("active_blast")
+        subprocess.run(self.command(primer_search))
+        telemetry.count("active_blast", -1)
+        telemetry.count("blastn_calls")
+        self.record(primer_search)
+
+    async def search_async(self, primer_search):
+        telemetry.count("active_blast")
+        process = await asyncio.create_subprocess_exec(*self.command(primer_search))
+        await process.wait()
+        telemetry.count("active_blast", -1)
+        telemetry.count("blastn_calls")
+        self.record(primer_search)
+
+    def record(self, primer_search):
+        """
+        Copies the matches of a finished search to the hits directory, if one was given.
+
+        Arguments:
+            primer_search -- PrimerSearch that finished
+        """
+        if not self.hits_loc:
+            return
+        recording = self.recording_loc(primer_search)
+        os.makedirs(os.path.dirname(recording), exist_ok=True)
+        # Written under a temporary name, so parallel runs never read a partial recording
+        temp_recording = f"{recording}.{uuid.uuid4().hex}.tmp"
+        shutil.copyfile(primer_search.output, temp_recording)
+        os.replace(temp_recording, recording)
+
+class ReplayEngine(SearchEngine):
+    """
+    Answers primer searches with matches recorded by the blastn engine, without
+    running BLAST. Used for regression runs of the steps after the search.
+    """
+    name = "replay"
+
+    def search(self, primer_search):
+        recording = self.recording_loc(primer_search)
+        if not os.path.exists(recording):
+            print(f"ERROR: No recorded primer search in {self.hits_loc} for {os.path.basename(primer_search.query)}. Record the searches with --engine blastn --hits {self.hits_loc} using the same assemblies, database and settings.", file=sys.stderr)
+            sys.exit(1)
+        shutil.copyfile(recording, primer_search.output)
+
+# Engines that can be selected with --engine, by their name in SEARCH_ENGINES
+ENGINES = {engine.name: engine for engine in (BlastnEngine, ReplayEngine)}
+
+def make_engine(name="blastn", hits_loc=None):
+    """
+    Creates a primer search engine.
+
+    Arguments:
+        name -- Name of the engine in ENGINES
+        hits_loc -- Directory of recorded searches, None for no recordings
+
+    Returns:
+        engine -- SearchEngine instance
+    """
+    return ENGINES[name](hits_loc)
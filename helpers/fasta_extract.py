@@ -1,30 +1,39 @@
 import pandas as pd
-from pyfaidx import Fasta
 from helpers.crawler import reverse_complement
+from helpers.packed_genome import get_packed_genome
+from helpers.results_db import is_results_db, read_valid_results
+import sqlite3
 from Bio.Seq import Seq
 import sys
 import os
 
-def extract_sequences(input_tsv, translate, output, separate, upstream, downstream):
+def extract_sequences(input_tsv, translate, output, separate, upstream, downstream, result_filter=None):
 	"""
 	Extracts target sequences from a SPIDER search and outputs in FASTA format.
 
 	Arguments:
-		input_tsv -- tsv output generated by SPIDER
+		input_tsv -- tsv output or SQLite results store generated by SPIDER
 		translate -- True/false whether or not to translate the sequence from nucleotide to amino acid
 		output -- Output file location. If none, output to console.
 		upstream -- Amount of nucleotides upstream of amplicon to include.
 		downstream -- Amount of nucleotides downstream of amplicon to include.
+		result_filter -- SQL filter selecting hits from a SQLite results store.
 
 	Returns:
 		True/False -- If extracted sequences (have valid sequences) return True. Otherwise return False.
 	"""
 	try:
-		# Read SPIDER output file
-		df_input = pd.read_csv(input_tsv, sep="\t")
+		# Results stores select only the valid (and filtered) hits
+		if is_results_db(input_tsv):
+			if not os.path.exists(input_tsv):
+				raise FileNotFoundError(input_tsv)
+			valid_inputs = read_valid_results(input_tsv, result_filter)
+		else:
+			# Read SPIDER output file
+			df_input = pd.read_csv(input_tsv, sep="\t")
 
-		# Filter to valid inputs
-		valid_inputs = df_input[df_input["Valid"]]
+			# Filter to valid inputs
+			valid_inputs = df_input[df_input["Valid"]]
 
 		if len(valid_inputs) > 0:
 			# If separating output, create output folder
@@ -76,13 +85,17 @@ def extract_sequences(input_tsv, translate, output, separate, upstream, downstre
 		print(f"ERROR: The file {input_tsv} is not in the correct format. Make sure your input to --extract is a valid output from SPIDER.", file=sys.stderr)
 	except UnicodeDecodeError:
 		print(f"ERROR: The file {input_tsv} is not in the correct format. Make sure your input to --extract is a valid output from SPIDER.", file=sys.stderr)
+	except (sqlite3.Error, pd.errors.DatabaseError) as e:
+		print(f"ERROR: Could not read results from {input_tsv}: {e}", file=sys.stderr)
 	# Return false in event of errors or no sequences to extract
 	return False
 
 
 def get_sequence(genome_loc, contig, start, end, strand, upstream, downstream):
 	"""
-	Extracts the virulence factor sequence using pyfaidx.
+	Extracts the virulence factor sequence from the packed genome of the assembly,
+	which is built next to the assembly on first use. Gzip compressed genomes
+	are supported.
 
 	Arguments:
 		genome_loc -- Location of genome file.
@@ -102,10 +115,10 @@ def get_sequence(genome_loc, contig, start, end, strand, upstream, downstream):
 		end_position -- End position used when extracting sequence. Same as above
 						regarding upstream/downstream modifications.
 	"""
-	genome = Fasta(genome_loc)
+	genome = get_packed_genome(genome_loc)
 	contig = str(contig)
 	# Use contig length for validating position is in bounds
-	contig_length = len(genome[contig])
+	contig_length = genome.contig_length(contig)
 
 	# Add upstream and downstream
 	# If strand is + start = start - upstream and end = end + downtream
@@ -135,7 +148,7 @@ def get_sequence(genome_loc, contig, start, end, strand, upstream, downstream):
 		print(f"WARNING: {genome_loc} contig {contig} did not support full {error_type} modification. Maximum allowed extension was performed.", file=sys.stderr)
 
 	# Grab sequence
-	seq = str(genome[contig][start_position:end_position])
+	seq = genome.fetch(contig, start_position, end_position)
 	
 	# Reverse complement negative strand
 	if strand == "-":
@@ -0,0 +1,342 @@
+import hashlib
+import os
+import re
+import sqlite3
+import uuid
+from helpers.settings import HEADER_INDEX_FOLDER
+
+# Bump when a change alters the contents of header indexes
+HEADER_INDEX_VERSION = 1
+# Headers are split into lowercase tokens of letters and digits
+TOKEN_SEPARATOR = re.compile(r"[^0-9a-z]+")
+# Words that make a search term a query
+QUERY_OPERATORS = ("AND", "OR", "NOT")
+
+def tokenize(text):
+    """
+    Splits text into the tokens of a header index.
+
+    Arguments:
+        text -- Header or search phrase
+
+    Returns:
+        tokens -- List of lowercase tokens of letters and digits
+    """
+    return [token for token in TOKEN_SEPARATOR.split(text.lower()) if token]
+
+def is_query(search_term):
+    """
+    Checks if a search term uses the query language. Other search terms are
+    a single phrase, matched as a case-insensitive substring of the header.
+
+    Arguments:
+        search_term -- Search term given with -s/--search
+
+    Returns:
+        True/False if the term contains AND, OR or NOT (in capitals) or is a /regex/
+    """
+    stripped = search_term.strip()
+    if len(stripped) > 1 and stripped.startswith("/") and stripped.endswith("/"):
+        return True
+    return any(word in QUERY_OPERATORS for word in stripped.split())
+
+def query_tokens(search_term):
+    """
+    Splits a query into words, operators, parentheses, quoted phrases and regexes.
+
+    Arguments:
+        search_term -- Query to split
+
+    Returns:
+        tokens -- List of (kind, value) tuples, kind being "word", "phrase",
+                  "regex", "operator", "(" or ")"
+    """
+    tokens = []
+    position = 0
+    while position < len(search_term):
+        character = search_term[position]
+        if character.isspace():
+            position += 1
+        elif character in "()":
+            tokens.append((character, character))
+            position += 1
+        elif character in "\"/":
+            # Quoted phrases and regexes end at the next unescaped quote or slash
+            end = position + 1
+            while end < len(search_term) and search_term[end] != character:
+                end += 2 if search_term[end] == "\\" and character == "/" else 1
+            if end >= len(search_term):
+                raise ValueError(f"missing closing {character} in {search_term}")
+            value = search_term[position + 1:end]
+            if character == "/":
+                try:
+                    re.compile(value)
+                except re.error as error:
+                    raise ValueError(f"invalid regex /{value}/ ({error})")
+            tokens.append(("phrase" if character == "\"" else "regex", value))
+            position = end + 1
+        else:
+            end = position
+            while end < len(search_term) and not search_term[end].isspace() and search_term[end] not in "()\"":
+                end += 1
+            word = search_term[position:end]
+            tokens.append(("operator" if word in QUERY_OPERATORS else "word", word))
+            position = end
+    return tokens
+
+def parse_query(search_term):
+    """
+    Parses a search term into an expression tree. Queries combine phrases and
+    /regexes/ with AND, OR, NOT and parentheses, e.g.
+    Staphylococcus aureus AND (ExoU OR /exo[st]/) AND NOT hypothetical.
+    Consecutive words form a single phrase. NOT binds tightest, then AND, then OR.
+
+    Arguments:
+        search_term -- Search term given with -s/--search
+
+    Returns:
+        tree -- Nested tuples: ("phrase", text), ("regex", pattern), ("not", tree),
+                ("and", [trees]) or ("or", [trees])
+    """
+    if not is_query(search_term):
+        return ("phrase", search_term)
+    tokens = query_tokens(search_term)
+    position = 0
+
+    def peek():
+        return tokens[position] if position < len(tokens) else (None, None)
+
+    def parse_or():
+        nonlocal position
+        operands = [parse_and()]
+        while peek() == ("operator", "OR"):
+            position += 1
+            operands.append(parse_and())
+        return operands[0] if len(operands) == 1 else ("or", operands)
+
+    def parse_and():
+        nonlocal position
+        operands = [parse_not()]
+        while peek() == ("operator", "AND"):
+            position += 1
+            operands.append(parse_not())
+        return operands[0] if len(operands) == 1 else ("and", operands)
+
+    def parse_not():
+        nonlocal position
+        if peek() == ("operator", "NOT"):
+            position += 1
+            return ("not", parse_not())
+        return parse_atom()
+
+    def parse_atom():
+        nonlocal position
+        kind, value = peek()
+        if kind == "(":
+            position += 1
+            tree = parse_or()
+            if peek()[0] != ")":
+                raise ValueError(f"missing closing ) in {search_term}")
+            position += 1
+            return tree
+        if kind == "regex":
+            position += 1
+            return ("regex", value)
+        if kind in ("word", "phrase"):
+            words = []
+            while peek()[0] in ("word", "phrase"):
+                words.append(peek()[1])
+                position += 1
+            return ("phrase", " ".join(words))
+        raise ValueError(f"expected a phrase, regex or ( in {search_term}, found {value or 'the end of the query'}")
+
+    tree = parse_or()
+    if position < len(tokens):
+        raise ValueError(f"unexpected {tokens[position][1]} in {search_term}")
+    return tree
+
+def header_index_loc(database_loc):
+    """
+    Gives the location of the header index of a database.
+
+    Arguments:
+        database_loc -- Location of the database
+
+    Returns:
+        index_loc -- Location of the SQLite header index
+    """
+    name = hashlib.sha256(os.path.abspath(database_loc).encode()).hexdigest()
+    return f"{HEADER_INDEX_FOLDER}/{name}.sqlite"
+
+def database_version(database_loc):
+    """
+    Identifies the version of a database file by its size and modification time.
+
+    Arguments:
+        database_loc -- Location of the database
+
+    Returns:
+        version -- Text that changes when the database file changes
+    """
+    stats = os.stat(database_loc)
+    return f"{HEADER_INDEX_VERSION}:{stats.st_size}:{stats.st_mtime_ns}"
+
+def build_header_index(records, index_loc, version):
+    """
+    Writes a header index. The index holds every record, so matching records
+    can be written out without reading the database again, and an inverted
+    index from header tokens to records.
+
+    Arguments:
+        records -- Iterable of (description, sequence) in database order
+        index_loc -- Location of the SQLite header index
+        version -- Version of the database from database_version
+    """
+    os.makedirs(os.path.dirname(index_loc), exist_ok=True)
+    # Built under a temporary name, so runs reading the index never see a partial one
+    temp_loc = f"{index_loc}.{uuid.uuid4().hex}.tmp"
+    connection = sqlite3.connect(temp_loc)
+    try:
+        connection.executescript("""
+CREATE TABLE meta (version TEXT NOT NULL);
+CREATE TABLE records (id INTEGER PRIMARY KEY, description TEXT NOT NULL, sequence TEXT NOT NULL);
+CREATE TABLE tokens (id INTEGER PRIMARY KEY, token TEXT NOT NULL UNIQUE);
+CREATE TABLE postings (token_id INTEGER NOT NULL, record_id INTEGER NOT NULL, PRIMARY KEY (token_id, record_id)) WITHOUT ROWID;
+""")
+        token_ids = {}
+        postings = []
+        for record_id, (description, sequence) in enumerate(records):
+            connection.execute("INSERT INTO records (id, description, sequence) VALUES (?, ?, ?)", (record_id, description, sequence))
+            for token in set(tokenize(description)):
+                if token not in token_ids:
+                    token_ids[token] = len(token_ids)
+                postings.append((token_ids[token], record_id))
+        connection.executemany("INSERT INTO tokens (id, token) VALUES (?, ?)", ((token_id, token) for token, token_id in token_ids.items()))
+        connection.executemany("INSERT INTO postings (token_id, record_id) VALUES (?, ?)", postings)
+        connection.execute("INSERT INTO meta (version) VALUES (?)", (version,))
+        connection.commit()
+    finally:
+        connection.close()
+    os.replace(temp_loc, index_loc)
+
+def open_header_index(database_loc, read_records):
+    """
+    Opens the header index of a database, building it first if there is none
+    or the database has changed since it was built.
+
+    Arguments:
+        database_loc -- Location of the database
+        read_records -- Function returning an iterable of (description, sequence)
+                        of the database, only called to build the index
+
+    Returns:
+        connection -- SQLite connection to the header index
+    """
+    index_loc = header_index_loc(database_loc)
+    version = database_version(database_loc)
+    if os.path.exists(index_loc):
+        connection = sqlite3.connect(f"file:{index_loc}?mode=ro", uri=True)
+        try:
+            if connection.execute("SELECT version FROM meta").fetchone() == (version,):
+                return connection
+        except sqlite3.DatabaseError:
+            pass
+        connection.close()
+    build_header_index(read_records(), index_loc, version)
+    return sqlite3.connect(f"file:{index_loc}?mode=ro", uri=True)
+
+def phrase_candidates(connection, phrase):
+    """
+    Finds records that may contain a phrase, using the inverted index. A phrase
+    of several tokens starts at the end of a header token, ends at the start of
+    one, and covers whole tokens in between. A phrase of a single token can be
+    anywhere inside a header token.
+
+    Arguments:
+        connection -- Connection from open_header_index
+        phrase -- Phrase to look up
+
+    Returns:
+        candidates -- Set of record ids, None if the phrase has no tokens (every record is a candidate)
+    """
+    tokens = tokenize(phrase)
+    if not tokens:
+        return None
+    conditions = []
+    for position, token in enumerate(tokens):
+        if len(tokens) == 1:
+            conditions.append(("instr(token, ?) > 0", token))
+        elif position == 0:
+            conditions.append(("token LIKE ?", f"%{token}"))
+        elif position == len(tokens) - 1:
+            conditions.append(("token LIKE ?", f"{token}%"))
+        else:
+            conditions.append(("token = ?", token))
+    candidates = None
+    for condition, value in conditions:
+        records = {row[0] for row in connection.execute(f"SELECT DISTINCT record_id FROM postings WHERE token_id IN (SELECT id FROM tokens WHERE {condition})", (value,))}
+        candidates = records if candidates is None else candidates & records
+        if not candidates:
+            break
+    return candidates
+
+def descriptions(connection, record_ids=None):
+    """
+    Reads the headers of records in the header index.
+
+    Arguments:
+        connection -- Connection from open_header_index
+        record_ids -- Set of record ids to read, None for every record
+
+    Yields:
+        record -- (record id, description) tuples
+    """
+    if record_ids is None:
+        yield from connection.execute("SELECT id, description FROM records")
+        return
+    record_ids = sorted(record_ids)
+    # Stay below the SQLite limit on query parameters
+    for start in range(0, len(record_ids), 900):
+        chunk = record_ids[start:start + 900]
+        yield from connection.execute(f"SELECT id, description FROM records WHERE id IN ({','.join('?' * len(chunk))})", chunk)
+
+def evaluate_query(connection, tree):
+    """
+    Finds the records of a parsed query. Phrases are case-insensitive
+    substrings of the header, regexes are searched case-insensitively.
+
+    Arguments:
+        connection -- Connection from open_header_index
+        tree -- Expression tree from parse_query
+
+    Returns:
+        record_ids -- Set of ids of matching records
+    """
+    kind, value = tree
+    if kind == "phrase":
+        phrase = value.lower()
+        return {record_id for record_id, description in descriptions(connection, phrase_candidates(connection, value)) if phrase in description.lower()}
+    if kind == "regex":
+        pattern = re.compile(value, re.IGNORECASE)
+        return {record_id for record_id, description in descriptions(connection) if pattern.search(description)}
+    if kind == "not":
+        all_ids = {row[0] for row in connection.execute("SELECT id FROM records")}
+        return all_ids - evaluate_query(connection, value)
+    results = [evaluate_query(connection, operand) for operand in value]
+    return set.intersection(*results) if kind == "and" else set.union(*results)
+
+def search_header_index(connection, search_term):
+    """
+    Finds the records of a database matching a search term.
+
+    Arguments:
+        connection -- Connection from open_header_index
+        search_term -- Search term or query given with -s/--search
+
+    Yields:
+        record -- (description, sequence) of each matching record, in database order
+    """
+    record_ids = sorted(evaluate_query(connection, parse_query(search_term)))
+    for start in range(0, len(record_ids), 900):
+        chunk = record_ids[start:start + 900]
+        yield from connection.execute(f"SELECT description, sequence FROM records WHERE id IN ({','.join('?' * len(chunk))}) ORDER BY id", chunk)
@@ -0,0 +1,173 @@
+import gzip
+import os
+import shutil
+
+# Values that can be written to a matrix
+MATRIX_VALUES = ["valid", "identity"]
+
+def is_sparse_matrix(matrix_loc):
+    """
+    Checks if a matrix output should be written in the sparse MatrixMarket format.
+
+    Arguments:
+        matrix_loc -- Location of the matrix output
+
+    Returns:
+        True/False if the location ends in .mtx or .mtx.gz
+    """
+    return matrix_loc.endswith(".mtx") or matrix_loc.endswith(".mtx.gz")
+
+def open_output(location):
+    """
+    Opens a text output, gzip compressed if the location ends in .gz.
+
+    Arguments:
+        location -- Location of the output
+
+    Returns:
+        handle -- Writable text file
+    """
+    if location.endswith(".gz"):
+        return gzip.open(location, "wt", newline="")
+    return open(location, "w", newline="")
+
+def matrix_columns(targets, target_databases, database_names=None):
+    """
+    Lists the genes of a matrix, one column per target name in database order.
+
+    Arguments:
+        targets -- List of (header, sequence) tuples from load_targets
+        target_databases -- Index of the database of each target
+        database_names -- Names of the databases when several are searched, None for one
+
+    Returns:
+        columns -- List of column names. With several databases, names are
+                   given as <database>:<name>
+        index -- Dictionary of column position by (database name or None, target name)
+    """
+    columns = []
+    index = {}
+    for (header, _), database in zip(targets, target_databases):
+        name = header.strip().replace(">", "")
+        database_name = database_names[database] if database_names else None
+        if (database_name, name) in index:
+            continue
+        index[(database_name, name)] = len(columns)
+        columns.append(f"{database_name}:{name}" if database_name else name)
+    return columns, index
+
+def open_matrix(matrix_loc, columns, index, values="valid"):
+    """
+    Starts an assembly by gene matrix. Rows are written as each assembly is
+    crawled, so only one row is held in memory. Dense matrices are written as
+    TSV (gzip compressed if the location ends in .gz). Sparse matrices
+    (.mtx/.mtx.gz) are written in MatrixMarket coordinate format, with the
+    row and column names in <matrix>.rows.txt and <matrix>.columns.txt.
+
+    Arguments:
+        matrix_loc -- Location of the matrix output
+        columns -- Column names from matrix_columns
+        index -- Column positions from matrix_columns
+        values -- "valid" for 1 when a gene has a valid amplicon, "identity" for
+                  the highest identity of its valid amplicons. Genes without a
+                  valid amplicon are 0
+
+    Returns:
+        matrix -- Dictionary with the state of the matrix, for add_matrix_row and close_matrix
+    """
+    matrix = {
+        "location": matrix_loc,
+        "sparse": is_sparse_matrix(matrix_loc),
+        "columns": columns,
+        "index": index,
+        "values": values,
+        "rows": 0,
+        "entries": 0
+    }
+    if matrix["sparse"]:
+        # Entries are kept in a temporary file until their number is known for the header
+        matrix["entries_loc"] = f"{matrix_loc}.entries.tmp"
+        matrix["handle"] = open(matrix["entries_loc"], "w", newline="")
+        matrix["rows_handle"] = open(f"{sparse_prefix(matrix_loc)}.rows.txt", "w", newline="")
+        with open(f"{sparse_prefix(matrix_loc)}.columns.txt", "w", newline="") as columns_file:
+            columns_file.writelines(f"{column}\n" for column in columns)
+    else:
+        matrix["handle"] = open_output(matrix_loc)
+        matrix["handle"].write("\t".join(["Query"] + columns) + "\n")
+    return matrix
+
+def sparse_prefix(matrix_loc):
+    """
+    Gives the location of a sparse matrix without its .mtx/.mtx.gz extension.
+
+    Arguments:
+        matrix_loc -- Location of the matrix output
+
+    Returns:
+        prefix -- Location used for the row and column name files
+    """
+    return matrix_loc[:-len(".mtx.gz")] if matrix_loc.endswith(".mtx.gz") else matrix_loc[:-len(".mtx")]
+
+def add_matrix_row(matrix, results):
+    """
+    Adds the row of an assembly to a matrix.
+
+    Arguments:
+        matrix -- Matrix from open_matrix
+        results -- Dataframe of SPIDER results of one assembly
+    """
+    if len(results) == 0:
+        return
+    # Highest value of each gene with a valid amplicon
+    valid = results[results["Valid"].fillna(False).astype(bool)]
+    databases = valid["Database"] if "Database" in valid.columns else [None] * len(valid)
+    found = {}
+    for database, name, identity in zip(databases, valid["Name"], valid["Identity"]):
+        column = matrix["index"].get((database, name))
+        if column is None:
+            continue
+        value = 1 if matrix["values"] == "valid" else float(identity)
+        found[column] = max(found.get(column, value), value)
+
+    query = str(results["Query"].iloc[0])
+    matrix["rows"] += 1
+    if matrix["sparse"]:
+        matrix["rows_handle"].write(f"{query}\n")
+        # MatrixMarket rows and columns start at 1
+        matrix["handle"].writelines(f"{matrix['rows']} {column + 1} {format_value(found[column])}\n" for column in sorted(found))
+        matrix["entries"] += len(found)
+    else:
+        row = [query] + [format_value(found.get(column, 0)) for column in range(len(matrix["columns"]))]
+        matrix["handle"].write("\t".join(row) + "\n")
+
+def format_value(value):
+    """
+    Formats a matrix value, writing whole numbers without a decimal point.
+
+    Arguments:
+        value -- Value of a matrix cell
+
+    Returns:
+        text -- Value as text
+    """
+    return str(int(value)) if float(value).is_integer() else str(value)
+
+def close_matrix(matrix):
+    """
+    Finishes a matrix. Sparse matrices get their MatrixMarket header, now that
+    the number of rows and entries is known.
+
+    Arguments:
+        matrix -- Matrix from open_matrix
+    """
+    matrix["handle"].close()
+    if not matrix["sparse"]:
+        return
+    matrix["rows_handle"].close()
+    field = "integer" if matrix["values"] == "valid" else "real"
+    with open_output(matrix["location"]) as destination:
+        destination.write(f"%%MatrixMarket matrix coordinate {field} general\n")
+        destination.write(f"{matrix['rows']} {len(matrix['columns'])} {matrix['entries']}\n")
+        with open(matrix["entries_loc"], "r") as entries:
+            shutil.copyfileobj(entries, destination)
+    os.remove(matrix["entries_loc"])
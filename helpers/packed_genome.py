@@ -0,0 +1,371 @@
+import json
+import os
+import struct
+import shutil
+import hashlib
+import tempfile
+from array import array
+from functools import lru_cache
+import numpy as np
+from helpers.compression import is_gzipped
+import gzip
+
+# File layout: magic, header length, JSON header, then 8-byte aligned arrays
+PACKED_MAGIC = b"SPIDERPK"
+PACKED_VERSION = 2
+PACKED_EXTENSION = ".spk"
+# Number of bases packed at a time while building, must be a multiple of 4
+BUILD_CHUNK_BASES = 1 << 22
+
+# 2-bit codes for nucleotides, 4 marks anything that is not A/C/G/T
+BASE_CODES = np.full(256, 4, dtype=np.uint8)
+for code, base in enumerate(b"ACGT"):
+    BASE_CODES[base] = code
+    BASE_CODES[base + 32] = code
+CODE_BASES = np.frombuffer(b"ACGT", dtype=np.uint8)
+# Complement of every IUPAC code, keeping case
+COMPLEMENT = np.arange(256, dtype=np.uint8)
+for base, complement in zip(b"ACGTURYKMBVDHSWNX", b"TGCAAYRMKVBHDSWNX"):
+    COMPLEMENT[base] = complement
+    COMPLEMENT[base + 32] = complement + 32
+COMPLEMENT_TRANSLATION = bytes(COMPLEMENT)
+
+# Arrays stored after the header, in file order
+SECTIONS = (
+    ("packed", np.uint8),        # 4 bases per byte, first base in the high bits
+    ("n_starts", np.uint64),     # Runs of N/n (start, end) in genome coordinates
+    ("n_ends", np.uint64),
+    ("mask_starts", np.uint64),  # Runs of lowercase bases
+    ("mask_ends", np.uint64),
+    ("exception_positions", np.uint64),  # Other IUPAC/ambiguous bases
+    ("exception_bases", np.uint8),
+    ("contig_offsets", np.uint64),  # Genome coordinate of the first base of each contig
+    ("contig_lengths", np.uint64),
+    ("name_ends", np.uint64),    # End of each contig name in names
+    ("names", np.uint8),         # Contig names, one after another
+    ("name_hashes", np.uint64),  # Sorted hashes of the contig names
+    ("name_order", np.uint64)    # Contig of each sorted hash
+)
+
+def name_hash(name):
+    """
+    Hashes a contig name (bytes) for the contig lookup table.
+    """
+    return int.from_bytes(hashlib.blake2b(name, digest_size=8).digest(), "little")
+
+def reverse_complement_array(sequence):
+    """
+    Reverse complements an array of ASCII bases.
+
+    Arguments:
+        sequence -- uint8 numpy array of bases
+
+    Returns:
+        reverse_complement -- uint8 numpy array of the reverse complement
+    """
+    return COMPLEMENT[sequence[::-1]]
+
+def reverse_complement_str(sequence):
+    """
+    Reverse complements a sequence string, supporting IUPAC codes and lowercase bases.
+
+    Arguments:
+        sequence -- DNA sequence
+
+    Returns:
+        reverse_complement -- Reverse complement of the sequence
+    """
+    return sequence.encode().translate(COMPLEMENT_TRANSLATION)[::-1].decode()
+
+def runs(flags, offset):
+    """
+    Finds runs of True values.
+
+    Arguments:
+        flags -- Boolean numpy array
+        offset -- Genome coordinate of the first value
+
+    Returns:
+        starts, ends -- uint64 arrays of the runs (end exclusive)
+    """
+    edges = np.diff(np.concatenate(([0], flags.view(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1).astype(np.uint64) + np.uint64(offset)
+    ends = np.flatnonzero(edges == -1).astype(np.uint64) + np.uint64(offset)
+    return starts, ends
+
+def build_packed_genome(fasta, packed_loc):
+    """
+    Builds a packed genome file from an assembly. Bases are stored with 2 bits,
+    N runs, lowercase runs and other ambiguous bases are stored separately so
+    that sequences are returned exactly as written in the assembly. Sections
+    are spilled to temporary files while reading, so memory use does not grow
+    with the size of the assembly (apart from 24 bytes per contig).
+
+    Arguments:
+        fasta -- Location of the assembly (plain or gzip/BGZF compressed)
+        packed_loc -- Location of the packed genome file to write
+    """
+    directory = os.path.dirname(os.path.abspath(packed_loc))
+    spills = {name: tempfile.TemporaryFile(dir=directory) for name, _ in SECTIONS}
+    counts = {name: 0 for name, _ in SECTIONS}
+    # Last run of each kind, held back in case it continues into the next chunk
+    held_runs = {"n": None, "mask": None}
+    contig_offsets = array("Q")
+    contig_lengths = array("Q")
+    name_ends = array("Q")
+    name_hashes = array("Q")
+    pending = bytearray()
+    packed_bases = 0
+    total = 0
+
+    def spill(name, values):
+        values = np.asarray(values, dtype=dict(SECTIONS)[name])
+        spills[name].write(values.tobytes())
+        counts[name] += len(values)
+
+    def add_runs(kind, starts, ends):
+        held = held_runs[kind]
+        if held is not None:
+            if len(starts) > 0 and starts[0] == held[1]:
+                starts[0] = held[0]
+            else:
+                spill(f"{kind}_starts", [held[0]])
+                spill(f"{kind}_ends", [held[1]])
+            held_runs[kind] = None
+        if len(starts) > 0:
+            spill(f"{kind}_starts", starts[:-1])
+            spill(f"{kind}_ends", ends[:-1])
+            held_runs[kind] = (starts[-1], ends[-1])
+
+    def pack(chunk):
+        nonlocal packed_bases
+        bases = np.frombuffer(bytes(chunk), dtype=np.uint8)
+        codes = BASE_CODES[bases]
+        upper = bases & 0xDF
+        n_flags = upper == ord("N")
+        add_runs("n", *runs(n_flags, packed_bases))
+        # Lowercase letters, including n
+        lower_flags = (bases >= ord("a")) & (bases <= ord("z"))
+        add_runs("mask", *runs(lower_flags, packed_bases))
+        exceptions = np.flatnonzero((codes == 4) & ~n_flags)
+        spill("exception_positions", exceptions.astype(np.uint64) + np.uint64(packed_bases))
+        spill("exception_bases", bases[exceptions])
+        codes[codes == 4] = 0
+        # Pad the final chunk to a multiple of 4 bases
+        if len(codes) % 4:
+            codes = np.concatenate((codes, np.zeros(4 - len(codes) % 4, dtype=np.uint8)))
+        codes = codes.reshape(-1, 4)
+        spill("packed", (codes[:, 0] << 6) | (codes[:, 1] << 4) | (codes[:, 2] << 2) | codes[:, 3])
+        packed_bases += len(bases)
+
+    try:
+        opener = gzip.open if is_gzipped(fasta) else open
+        with opener(fasta, "rb") as handle:
+            for line in handle:
+                if line.startswith(b">"):
+                    name = line[1:].split()
+                    name = name[0] if name else b""
+                    spills["names"].write(name)
+                    name_ends.append((name_ends[-1] if name_ends else 0) + len(name))
+                    name_hashes.append(name_hash(name))
+                    contig_offsets.append(total)
+                    contig_lengths.append(0)
+                elif contig_lengths:
+                    sequence = line.strip()
+                    pending += sequence
+                    total += len(sequence)
+                    contig_lengths[-1] += len(sequence)
+                    if len(pending) >= BUILD_CHUNK_BASES:
+                        pack(pending[:BUILD_CHUNK_BASES])
+                        del pending[:BUILD_CHUNK_BASES]
+        if pending or packed_bases == 0:
+            pack(pending)
+        for kind, held in held_runs.items():
+            if held is not None:
+                spill(f"{kind}_starts", [held[0]])
+                spill(f"{kind}_ends", [held[1]])
+        counts["names"] = name_ends[-1] if name_ends else 0
+
+        # Contig lookup table sorted by name hash
+        hashes = np.frombuffer(name_hashes, dtype=np.uint64) if name_hashes else np.empty(0, dtype=np.uint64)
+        order = np.argsort(hashes, kind="stable")
+        for name, values in (("contig_offsets", contig_offsets), ("contig_lengths", contig_lengths), ("name_ends", name_ends),
+                             ("name_hashes", hashes[order]), ("name_order", order)):
+            spill(name, values)
+
+        source = os.stat(fasta)
+        header = {
+            "version": PACKED_VERSION,
+            "source_size": source.st_size,
+            "source_mtime_ns": source.st_mtime_ns,
+            "total": total,
+            "contig_count": len(contig_lengths),
+            "sections": counts
+        }
+        header_bytes = json.dumps(header).encode()
+        # Pad so that the arrays start on 8 byte boundaries
+        header_bytes += b" " * (-(len(PACKED_MAGIC) + 8 + len(header_bytes)) % 8)
+
+        # Write next to the final location and move into place, so readers never see a partial file
+        handle, temp_loc = tempfile.mkstemp(dir=directory, suffix=PACKED_EXTENSION)
+        try:
+            with os.fdopen(handle, "wb") as out:
+                out.write(PACKED_MAGIC)
+                out.write(struct.pack("<Q", len(header_bytes)))
+                out.write(header_bytes)
+                for name, dtype in SECTIONS:
+                    spills[name].seek(0)
+                    shutil.copyfileobj(spills[name], out)
+                    out.write(b"\0" * (-counts[name] * np.dtype(dtype).itemsize % 8))
+            os.replace(temp_loc, packed_loc)
+        except BaseException:
+            if os.path.exists(temp_loc):
+                os.remove(temp_loc)
+            raise
+    finally:
+        for spill_file in spills.values():
+            spill_file.close()
+
+class PackedGenome:
+    """
+    Memory-mapped packed genome. Sequences are decoded only for the requested
+    region, and the mapping is shared between processes reading the same file.
+    """
+
+    def __init__(self, packed_loc):
+        with open(packed_loc, "rb") as handle:
+            if handle.read(len(PACKED_MAGIC)) != PACKED_MAGIC:
+                raise ValueError(f"{packed_loc} is not a SPIDER packed genome")
+            header_length = struct.unpack("<Q", handle.read(8))[0]
+            self.header = json.loads(handle.read(header_length))
+        self.location = packed_loc
+
+        offset = len(PACKED_MAGIC) + 8 + header_length
+        for name, dtype in SECTIONS:
+            count = self.header["sections"][name]
+            if count > 0:
+                setattr(self, name, np.memmap(packed_loc, dtype=dtype, mode="r", offset=offset, shape=(count,)))
+            else:
+                setattr(self, name, np.empty(0, dtype=dtype))
+            offset += count * np.dtype(dtype).itemsize
+            offset += -offset % 8
+
+    def is_current(self, fasta):
+        """
+        Checks that the packed genome was built from the current version of an assembly.
+        """
+        source = os.stat(fasta)
+        return (self.header["version"] == PACKED_VERSION and self.header["source_size"] == source.st_size
+                and self.header["source_mtime_ns"] == source.st_mtime_ns)
+
+    def contig_location(self, contig):
+        """
+        Looks up a contig by name in the hash table stored in the file, so the
+        contig names are never loaded into memory.
+
+        Returns:
+            offset -- Genome coordinate of the first base of the contig
+            length -- Length of the contig
+        """
+        name = str(contig).encode()
+        hashed = np.uint64(name_hash(name))
+        low = np.searchsorted(self.name_hashes, hashed, side="left")
+        high = np.searchsorted(self.name_hashes, hashed, side="right")
+        for index in self.name_order[low:high]:
+            index = int(index)
+            name_start = int(self.name_ends[index - 1]) if index > 0 else 0
+            if self.names[name_start:int(self.name_ends[index])].tobytes() == name:
+                return int(self.contig_offsets[index]), int(self.contig_lengths[index])
+        raise KeyError(contig)
+
+    def contig_length(self, contig):
+        """
+        Returns the length of a contig.
+        """
+        return self.contig_location(contig)[1]
+
+    def fetch_array(self, contig, start, end):
+        """
+        Decodes part of a contig.
+
+        Arguments:
+            contig -- Contig name
+            start -- 0-based start position
+            end -- End position (exclusive), clamped to the contig length
+
+        Returns:
+            sequence -- uint8 numpy array of ASCII bases
+        """
+        contig_offset, contig_length = self.contig_location(contig)
+        start = min(max(start, 0), contig_length)
+        end = min(max(end, start), contig_length)
+        first = contig_offset + start
+        last = contig_offset + end
+
+        # Unpack only the bytes covering the region
+        packed = self.packed[first // 4:(last + 3) // 4]
+        codes = np.empty((len(packed), 4), dtype=np.uint8)
+        for i, shift in enumerate((6, 4, 2, 0)):
+            codes[:, i] = (packed >> shift) & 3
+        skip = first - (first // 4) * 4
+        sequence = CODE_BASES[codes.ravel()[skip:skip + last - first]]
+
+        # Restore N runs, lowercase runs and ambiguous bases within the region
+        for starts, ends, apply in ((self.n_starts, self.n_ends, "N"), (self.mask_starts, self.mask_ends, "lower")):
+            low = np.searchsorted(ends, first, side="right")
+            high = np.searchsorted(starts, last, side="left")
+            for run_start, run_end in zip(starts[low:high], ends[low:high]):
+                run = slice(int(max(run_start, first)) - first, int(min(run_end, last)) - first)
+                if apply == "N":
+                    sequence[run] = ord("N")
+                else:
+                    sequence[run] |= 0x20
+        low = np.searchsorted(self.exception_positions, first, side="left")
+        high = np.searchsorted(self.exception_positions, last, side="left")
+        sequence[(self.exception_positions[low:high] - np.uint64(first)).astype(np.intp)] = self.exception_bases[low:high]
+        return sequence
+
+    def fetch(self, contig, start, end):
+        """
+        Returns part of a contig as a string, using python slice coordinates.
+        """
+        return self.fetch_array(contig, start, end).tobytes().decode()
+
+@lru_cache(maxsize=16)
+def open_packed_genome(packed_loc, modified):
+    """
+    Opens a packed genome, reusing open mappings. The modification time is part
+    of the cache key so a rebuilt file is opened again.
+    """
+    return PackedGenome(packed_loc)
+
+def get_packed_genome(fasta, fallback_directory=None):
+    """
+    Returns the packed genome of an assembly. The packed genome is cached next
+    to the assembly (<assembly>.spk) and rebuilt when the assembly changes. If
+    the assembly folder cannot be written to, the packed genome is built in
+    fallback_directory instead.
+
+    Arguments:
+        fasta -- Location of the assembly (plain or gzip/BGZF compressed)
+        fallback_directory -- Directory used when the cache cannot be written next to the assembly
+
+    Returns:
+        genome -- PackedGenome for the assembly
+    """
+    packed_loc = f"{fasta}{PACKED_EXTENSION}"
+    if os.path.exists(packed_loc):
+        try:
+            genome = open_packed_genome(packed_loc, os.stat(packed_loc).st_mtime_ns)
+            if genome.is_current(fasta):
+                return genome
+        except (ValueError, KeyError, OSError):
+            pass
+    try:
+        build_packed_genome(fasta, packed_loc)
+    except OSError:
+        if fallback_directory is None:
+            raise
+        packed_loc = os.path.join(fallback_directory, os.path.basename(packed_loc))
+        build_packed_genome(fasta, packed_loc)
+    return open_packed_genome(packed_loc, os.stat(packed_loc).st_mtime_ns)
@@ -0,0 +1,151 @@
+import numpy as np
+
+# 2-bit codes for nucleotides, anything else (N, IUPAC, gaps) is invalid
+BASE_CODES = np.full(256, 4, dtype=np.uint8)
+for base, code in zip(b"ACGT", range(4)):
+    BASE_CODES[base] = code
+    BASE_CODES[ord(chr(base).lower())] = code
+# Hash value marking k-mers that contain an invalid base
+INVALID_HASH = np.uint64(np.iinfo(np.uint64).max)
+
+def minimizer_parameters(primer_size, max_k):
+    """
+    Chooses the k-mer size and window of the minimizer sketch. The window spans
+    exactly one primer, so every primer has a single minimizer and any exact
+    primer match in the assembly shares that minimizer with the assembly sketch.
+
+    Arguments:
+        primer_size -- Length of primers
+        max_k -- Largest k-mer size to use
+
+    Returns:
+        k -- k-mer size
+        w -- Number of consecutive k-mers per window
+    """
+    k = min(max_k, primer_size)
+    return k, primer_size - k + 1
+
+def kmer_hashes(sequence, k):
+    """
+    Hashes all canonical k-mers of a sequence. Canonical k-mers are the smaller
+    of a k-mer and its reverse complement, so both strands hash the same way.
+
+    Arguments:
+        sequence -- Nucleotide sequence (str)
+        k -- k-mer size (at most 31)
+
+    Returns:
+        hashes -- uint64 array with one hash per k-mer position. K-mers that
+                  contain an invalid base are set to INVALID_HASH.
+    """
+    codes = BASE_CODES[np.frombuffer(sequence.encode(), dtype=np.uint8)]
+    n_kmers = len(codes) - k + 1
+    if n_kmers < 1:
+        return np.empty(0, dtype=np.uint64)
+
+    # Build forward and reverse complement k-mer integers two bits at a time
+    forward = np.zeros(n_kmers, dtype=np.uint64)
+    reverse = np.zeros(n_kmers, dtype=np.uint64)
+    invalid = np.zeros(n_kmers, dtype=bool)
+    for i in range(k):
+        window = codes[i:i + n_kmers]
+        invalid |= window == 4
+        values = (window & 3).astype(np.uint64)
+        forward = (forward << np.uint64(2)) | values
+        reverse |= (np.uint64(3) - values) << np.uint64(2 * i)
+    canonical = np.minimum(forward, reverse)
+
+    # Mix bits so that minimizers are not biased toward low complexity k-mers
+    hashes = canonical * np.uint64(0x9E3779B97F4A7C15)
+    hashes ^= hashes >> np.uint64(29)
+    # Keep the sentinel value free for invalid k-mers
+    hashes[hashes == INVALID_HASH] -= np.uint64(1)
+    hashes[invalid] = INVALID_HASH
+    return hashes
+
+def window_minimizers(hashes, w):
+    """
+    Finds the minimum hash of every window of w consecutive k-mers.
+
+    Arguments:
+        hashes -- k-mer hashes from kmer_hashes
+        w -- Number of consecutive k-mers per window
+
+    Returns:
+        minimizers -- uint64 array with the minimum of each window
+    """
+    if len(hashes) < w:
+        return np.empty(0, dtype=np.uint64)
+    return np.lib.stride_tricks.sliding_window_view(hashes, w).min(axis=1)
+
+def build_sketch(fasta, k, w):
+    """
+    Builds a minimizer sketch of an assembly.
+
+    Arguments:
+        fasta -- Location of an uncompressed assembly
+        k -- k-mer size
+        w -- Number of consecutive k-mers per window
+
+    Returns:
+        sketch -- Sorted array of unique minimizer hashes
+    """
+    sketch_parts = []
+
+    def add_contig(chunks):
+        minimizers = window_minimizers(kmer_hashes("".join(chunks), k), w)
+        sketch_parts.append(np.unique(minimizers[minimizers != INVALID_HASH]))
+
+    with open(fasta, "r") as handle:
+        contig = None
+        for line in handle:
+            if line.startswith(">"):
+                if contig is not None:
+                    add_contig(contig)
+                contig = []
+            elif contig is not None:
+                contig.append(line.strip())
+        if contig is not None:
+            add_contig(contig)
+
+    if len(sketch_parts) == 0:
+        return np.empty(0, dtype=np.uint64)
+    return np.unique(np.concatenate(sketch_parts))
+
+def primer_containment(sketch, ref_sequence, number_primers, primer_size, k, w):
+    """
+    Calculates the fraction of forward and reverse primers whose minimizer is
+    found in the assembly sketch. A primer whose minimizer is missing cannot
+    have an exact match in the assembly.
+
+    Arguments:
+        sketch -- Assembly sketch from build_sketch
+        ref_sequence -- target reference sequence
+        number_primers -- Number of primers generated in each direction
+        primer_size -- Length of primers
+        k -- k-mer size
+        w -- Number of consecutive k-mers per window
+
+    Returns:
+        containment -- Fraction of primers (0-1) that may match the assembly
+    """
+    ref_length = len(ref_sequence)
+    # Primers shorter than primer_size never reach the BLAST word size, so cannot match
+    if ref_length < primer_size or len(sketch) == 0:
+        return 0.0
+    # Forward primers cover the start of the reference and reverse primers cover the end
+    span = min(number_primers - 1 + primer_size, ref_length)
+    regions = (ref_sequence[:span], ref_sequence[ref_length - span:])
+
+    found = 0
+    total = 0
+    for region in regions:
+        minimizers = window_minimizers(kmer_hashes(region, k), w)
+        valid = minimizers != INVALID_HASH
+        positions = np.searchsorted(sketch, minimizers[valid])
+        positions[positions == len(sketch)] = 0
+        found += int(np.count_nonzero(sketch[positions] == minimizers[valid]))
+        total += len(minimizers)
+    if total == 0:
+        return 0.0
+    return found / total
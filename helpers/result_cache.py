@@ -0,0 +1,105 @@
+import hashlib
+import pickle
+import sqlite3
+import subprocess
+from functools import lru_cache
+from helpers.compression import is_gzipped
+import gzip
+
+# Bump when a change to SPIDER alters the results stored for the same inputs
+CACHE_FORMAT_VERSION = 3
+
+def assembly_hash(fasta):
+    """
+    Hashes the content of an assembly. Compressed assemblies are hashed after
+    decompression, so the same genome has the same hash however it is stored.
+
+    Arguments:
+        fasta -- Location of the assembly
+
+    Returns:
+        digest -- Hex SHA-256 digest of the uncompressed assembly
+    """
+    digest = hashlib.sha256()
+    opener = gzip.open if is_gzipped(fasta) else open
+    with opener(fasta, "rb") as handle:
+        for block in iter(lambda: handle.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+@lru_cache(maxsize=None)
+def search_backend_version():
+    """
+    Returns the version of the search backend, so that results are not reused
+    across BLAST versions.
+    """
+    try:
+        version = subprocess.run(["blastn", "-version"], capture_output=True, text=True).stdout
+        return version.strip().splitlines()[0] if version.strip() else "unknown"
+    except OSError:
+        return "unknown"
+
+def target_key(assembly_digest, ref_sequence, primer_size, slide_limit, length_limit, identity_limit, caps=None, seed=False):
+    """
+    Builds the cache key of one target in one assembly.
+
+    Arguments:
+        assembly_digest -- Hash of the assembly from assembly_hash
+        ref_sequence -- target reference sequence
+        primer_size -- User provided primer length
+        slide_limit -- User set slide limit for primers
+        length_limit -- User provided limit on length to use
+        identity_limit -- User provided identity limit to use
+        caps -- (maximum matches per primer, maximum candidate pairs)
+        seed -- True/false if primers were searched as one seed region per direction,
+                which can give different matches than searching each primer
+
+    Returns:
+        key -- Hex SHA-256 digest identifying the result
+    """
+    target_digest = hashlib.sha256(ref_sequence.encode()).hexdigest()
+    fields = (CACHE_FORMAT_VERSION, assembly_digest, target_digest, primer_size, float(slide_limit),
+              float(length_limit), float(identity_limit), search_backend_version(), caps, bool(seed))
+    return hashlib.sha256(repr(fields).encode()).hexdigest()
+
+def open_cache(cache_loc):
+    """
+    Opens (and creates if needed) a result cache.
+
+    Arguments:
+        cache_loc -- Location of the SQLite cache file
+
+    Returns:
+        connection -- SQLite connection to the cache
+    """
+    connection = sqlite3.connect(cache_loc, timeout=60)
+    connection.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, results BLOB NOT NULL)")
+    connection.commit()
+    return connection
+
+def get_cached_results(connection, key):
+    """
+    Looks up the results of a target.
+
+    Arguments:
+        connection -- Connection from open_cache
+        key -- Key from target_key
+
+    Returns:
+        results -- List of result tuples as returned by identify_target, or None if not cached
+    """
+    row = connection.execute("SELECT results FROM results WHERE key = ?", (key,)).fetchone()
+    if row is None:
+        return None
+    return pickle.loads(row[0])
+
+def store_results(connection, key, results):
+    """
+    Stores the results of a target. Changes are written when the connection is committed.
+
+    Arguments:
+        connection -- Connection from open_cache
+        key -- Key from target_key
+        results -- List of result tuples as returned by identify_target
+    """
+    connection.execute("INSERT OR REPLACE INTO results (key, results) VALUES (?, ?)", (key, pickle.dumps(results)))
@@ -0,0 +1,199 @@
+import sqlite3
+from helpers.settings import SPIDER_RESULTS_COLUMNS, RESULTS_DB_EXTENSIONS
+
+# Columns stored per hit, everything except the assembly and target fields
+HIT_COLUMNS = tuple(column for column in SPIDER_RESULTS_COLUMNS if column not in ("Query", "Name", "Ref_Length"))
+# SQLite type of each hit column
+HIT_COLUMN_TYPES = {
+    "Valid": "INTEGER",
+    "Contig": "TEXT",
+    "Start": "INTEGER",
+    "F_Slide": "INTEGER",
+    "End": "INTEGER",
+    "R_Slide": "INTEGER",
+    "Strand": "TEXT",
+    "Identity": "REAL",
+    "Target_Length": "INTEGER",
+    "Coverage_Perc_Len": "REAL",
+    "Coverage_Perc_Align": "REAL",
+    "Message": "TEXT"
+}
+# Optional columns that crawl inserts right after Name (databases and sweeps)
+LEADING_COLUMNS = ("Database", "Primer_Size", "Slide_Limit")
+# Columns stored as 0/1 that hold True/False values
+BOOLEAN_COLUMNS = ("Valid", "Closest_Start_Codon_Matches_Amplicon", "Closest_Stop_Codon_Matches_Amplicon", "Closest_Start_Stop_In_Frame")
+
+def is_results_db(file):
+    """
+    Checks if a results location refers to a SQLite results store.
+
+    Arguments:
+        file -- Output or input location
+
+    Returns:
+        True/False if the location has a SQLite extension
+    """
+    return file is not None and file.lower().endswith(RESULTS_DB_EXTENSIONS)
+
+def quote(identifier):
+    """
+    Quotes a column name for use in SQL.
+    """
+    return '"' + identifier.replace('"', '""') + '"'
+
+def to_sql_value(value):
+    """
+    Converts a result value to a type SQLite can store. Missing values ("NA") become NULL.
+    """
+    if value is None or (isinstance(value, str) and value == "NA"):
+        return None
+    # Unwrap numpy scalars
+    if hasattr(value, "item"):
+        value = value.item()
+    if isinstance(value, float) and value != value:
+        return None
+    if isinstance(value, bool):
+        return int(value)
+    return value
+
+def open_results_db(db_loc):
+    """
+    Opens (and creates if needed) a SQLite results store. Results are kept in
+    normalized tables for assemblies, targets and hits, and exposed with the
+    usual SPIDER column names through the results view.
+
+    Arguments:
+        db_loc -- Location of the SQLite file
+
+    Returns:
+        connection -- SQLite connection to the results store
+    """
+    connection = sqlite3.connect(db_loc, timeout=60)
+    hit_columns = ",\n".join(f"    {quote(column)} {HIT_COLUMN_TYPES[column]}" for column in HIT_COLUMNS)
+    connection.executescript(f"""
+CREATE TABLE IF NOT EXISTS assemblies (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS targets (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    ref_length INTEGER,
+    UNIQUE (name, ref_length)
+);
+CREATE TABLE IF NOT EXISTS hits (
+    id INTEGER PRIMARY KEY,
+    assembly_id INTEGER NOT NULL REFERENCES assemblies(id),
+    target_id INTEGER NOT NULL REFERENCES targets(id),
+{hit_columns}
+);
+CREATE INDEX IF NOT EXISTS hits_assembly ON hits(assembly_id);
+CREATE INDEX IF NOT EXISTS hits_target ON hits(target_id);
+CREATE INDEX IF NOT EXISTS hits_valid ON hits("Valid");
+""")
+    create_results_view(connection)
+    connection.commit()
+    return connection
+
+def hit_table_columns(connection):
+    """
+    Returns the result columns stored in the hits table, including optional
+    columns such as Overlap that were added by earlier writes.
+    """
+    columns = [row[1] for row in connection.execute("PRAGMA table_info(hits)")]
+    return [column for column in columns if column not in ("id", "assembly_id", "target_id")]
+
+def create_results_view(connection):
+    """
+    (Re)creates the results view that joins the normalized tables back into
+    the SPIDER output columns, in the order crawl writes them: Query, Name,
+    the database and sweep columns, the SPIDER columns and then the optional
+    columns (e.g. overlaps, codons, annotations) in the order they were added.
+    """
+    hit_columns = hit_table_columns(connection)
+    leading_columns = [column for column in LEADING_COLUMNS if column in hit_columns]
+    trailing_columns = [column for column in hit_columns if column not in HIT_COLUMNS and column not in LEADING_COLUMNS]
+    selected = ["assemblies.path AS Query", "targets.name AS Name"]
+    for column in leading_columns + list(HIT_COLUMNS) + trailing_columns:
+        selected.append(f"hits.{quote(column)} AS {quote(column)}")
+        # Keep the SPIDER column order, with Ref_Length after Target_Length
+        if column == "Target_Length":
+            selected.append("targets.ref_length AS Ref_Length")
+    connection.execute("DROP VIEW IF EXISTS results")
+    connection.execute(f"""CREATE VIEW results AS
+SELECT {", ".join(selected)}
+FROM hits
+JOIN assemblies ON assemblies.id = hits.assembly_id
+JOIN targets ON targets.id = hits.target_id
+ORDER BY hits.id""")
+
+def write_results(connection, results):
+    """
+    Writes the results of crawled assemblies in a single transaction. Earlier
+    results for the same assemblies are replaced.
+
+    Arguments:
+        connection -- Connection from open_results_db
+        results -- Dataframe of SPIDER results
+    """
+    with connection:
+        # Add any optional columns (e.g. overlaps, codons, annotations) not stored yet
+        existing_columns = hit_table_columns(connection)
+        extra_columns = [column for column in results.columns if column not in SPIDER_RESULTS_COLUMNS]
+        new_columns = [column for column in extra_columns if column not in existing_columns]
+        for column in new_columns:
+            connection.execute(f"ALTER TABLE hits ADD COLUMN {quote(column)}")
+        if new_columns:
+            create_results_view(connection)
+
+        assembly_ids = {}
+        for path in results["Query"].unique():
+            connection.execute("INSERT OR IGNORE INTO assemblies (path) VALUES (?)", (str(path),))
+            assembly_ids[path] = connection.execute("SELECT id FROM assemblies WHERE path = ?", (str(path),)).fetchone()[0]
+            connection.execute("DELETE FROM hits WHERE assembly_id = ?", (assembly_ids[path],))
+
+        target_ids = {}
+        # Targets are keyed on name and length, as targets of the same name (duplicate
+        # headers, or the same name in several databases) can have different lengths
+        for name, ref_length in results[["Name", "Ref_Length"]].drop_duplicates().itertuples(index=False):
+            ref_length = to_sql_value(ref_length)
+            connection.execute("INSERT OR IGNORE INTO targets (name, ref_length) VALUES (?, ?)", (str(name), ref_length))
+            target_ids[(name, ref_length)] = connection.execute("SELECT id FROM targets WHERE name = ? AND ref_length IS ?", (str(name), ref_length)).fetchone()[0]
+
+        stored_columns = list(HIT_COLUMNS) + extra_columns
+        placeholders = ", ".join("?" for _ in range(len(stored_columns) + 2))
+        insert = f"INSERT INTO hits (assembly_id, target_id, {', '.join(quote(column) for column in stored_columns)}) VALUES ({placeholders})"
+        rows = []
+        # Missing values of typed columns (<NA>/NaN) become None
+        values = results[["Query", "Name", "Ref_Length"] + stored_columns].astype(object)
+        values = values.where(values.notna(), None)
+        for row in values.itertuples(index=False):
+            rows.append((assembly_ids[row[0]], target_ids[(row[1], to_sql_value(row[2]))]) + tuple(to_sql_value(value) for value in row[3:]))
+        connection.executemany(insert, rows)
+
+def read_valid_results(db_loc, where=None):
+    """
+    Reads valid hits from a results store, optionally restricted by a SQL
+    filter over the result columns (e.g. "Name LIKE '%ExoU%' AND Identity >= 95").
+    Only the selected rows are loaded.
+
+    Arguments:
+        db_loc -- Location of the SQLite file
+        where -- SQL expression used to filter results
+
+    Returns:
+        df_results -- Dataframe of the selected valid results
+    """
+    import pandas as pd
+
+    # Open read only so that a wrong path does not create an empty store
+    connection = sqlite3.connect(f"file:{db_loc}?mode=ro", uri=True)
+    try:
+        query = "SELECT * FROM results WHERE Valid = 1"
+        if where:
+            query += f" AND ({where})"
+        df_results = pd.read_sql_query(query, connection)
+    finally:
+        connection.close()
+    df_results["Valid"] = df_results["Valid"].astype(bool)
+    return df_results
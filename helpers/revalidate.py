@@ -0,0 +1,181 @@
+import sqlite3
+import sys
+from helpers.settings import REVALIDATE_CHUNK_ROWS, CAPPED_MESSAGE
+from helpers.results_db import quote
+
+# Messages written by validate_targets
+LENGTH_MESSAGE = "Length limit not satisfied."
+IDENTITY_MESSAGE = "Identity limit not satisfied."
+BOTH_MESSAGE = "Identity and length limits not satisfied."
+
+def revalidate_chunk(chunk, length_limit, identity_limit):
+    """
+    Recomputes Valid and Message of a chunk of results, the same way as
+    validate_targets. Rows without an identity or length coverage (no amplicon
+    was found) are left unchanged. All columns are kept as text, so values are
+    written back exactly as they were read. Messages keep the flag of targets
+    whose primer matches were capped.
+
+    Arguments:
+        chunk -- Dataframe of results read with dtype=str
+        length_limit -- New length limit
+        identity_limit -- New identity limit
+
+    Returns:
+        chunk -- Dataframe with updated Valid and Message columns
+    """
+    import pandas as pd
+    import numpy as np
+
+    identity = pd.to_numeric(chunk["Identity"], errors="coerce")
+    coverage = pd.to_numeric(chunk["Coverage_Perc_Len"], errors="coerce")
+    measured = (identity.notna() & coverage.notna()).to_numpy()
+    identity_ok = (identity >= identity_limit).to_numpy()
+    length_ok = ((coverage >= 100 - length_limit) & (coverage <= 100 + length_limit)).to_numpy()
+    valid = identity_ok & length_ok
+    message = np.select([valid, identity_ok, length_ok], ["", LENGTH_MESSAGE, IDENTITY_MESSAGE], BOTH_MESSAGE)
+    # Keep the flag of capped targets
+    capped = chunk["Message"].str.endswith(CAPPED_MESSAGE).to_numpy()
+    flagged = np.char.add(message.astype(str), f" {CAPPED_MESSAGE}")
+    message = np.where(capped, np.where(valid, CAPPED_MESSAGE, flagged), message)
+
+    chunk["Valid"] = np.where(measured, np.where(valid, "True", "False"), chunk["Valid"].to_numpy())
+    chunk["Message"] = np.where(measured, message, chunk["Message"].to_numpy())
+    return chunk
+
+def overlap_messages(results):
+    """
+    Recomputes the Overlap column with find_overlaps, which only compares
+    valid amplicons and so changes with the validity of each row.
+
+    Arguments:
+        results -- Dataframe of results with Query, Name, Valid (True/False or
+                   "True"/"False"), Strand, Contig, Start and End columns, and
+                   the Primer_Size and Slide_Limit columns of a parameter sweep
+
+    Returns:
+        overlaps -- List of Overlap values in the order of results
+    """
+    import pandas as pd
+    from helpers.crawler import find_overlaps
+
+    table = pd.DataFrame({
+        "Query": results["Query"].to_numpy(),
+        "Name": results["Name"].to_numpy(),
+        "Valid": results["Valid"].isin([True, "True", 1]).to_numpy(),
+        "Strand": results["Strand"].to_numpy(),
+        "Contig": results["Contig"].to_numpy(),
+        "Start": pd.to_numeric(results["Start"], errors="coerce").to_numpy(),
+        "End": pd.to_numeric(results["End"], errors="coerce").to_numpy()
+    })
+    # Settings of a parameter sweep are compared separately
+    for column in ("Primer_Size", "Slide_Limit"):
+        if column in results.columns:
+            table[column] = results[column].to_numpy()
+    # Rows of an assembly are next to each other, so the groups keep the order of results
+    overlaps = []
+    for _, assembly in table.groupby("Query", sort=False):
+        overlaps.extend(find_overlaps(assembly.reset_index(drop=True))["Overlap"])
+    return overlaps
+
+def revalidate_tsv(input_tsv, output, length_limit, identity_limit):
+    """
+    Revalidates a TSV results file chunk by chunk, so files of any size can be
+    revalidated with little memory. If the results include overlaps, they are
+    recomputed one assembly at a time.
+
+    Arguments:
+        input_tsv -- SPIDER results table
+        output -- Location of the revalidated table, None for stdout
+        length_limit -- New length limit
+        identity_limit -- New identity limit
+
+    Returns:
+        counts -- (rows, valid rows) in the revalidated table
+    """
+    import pandas as pd
+
+    rows = 0
+    valid_rows = 0
+    destination = open(output, "w", newline="") if output else sys.stdout
+    try:
+        chunks = pd.read_csv(input_tsv, sep="\t", dtype=str, keep_default_na=False, chunksize=REVALIDATE_CHUNK_ROWS)
+        header = True
+        # Rows of the last assembly in a chunk, which may continue in the next chunk
+        carry = None
+        for chunk in chunks:
+            chunk = revalidate_chunk(chunk, length_limit, identity_limit)
+            if "Overlap" in chunk.columns:
+                if carry is not None:
+                    chunk = pd.concat([carry, chunk], ignore_index=True)
+                queries = chunk["Query"].to_numpy()
+                last_start = len(queries) - 1
+                while last_start > 0 and queries[last_start - 1] == queries[-1]:
+                    last_start -= 1
+                carry = chunk.iloc[last_start:]
+                chunk = chunk.iloc[:last_start].copy()
+                if len(chunk) == 0:
+                    continue
+                chunk["Overlap"] = overlap_messages(chunk)
+            rows += len(chunk)
+            valid_rows += int((chunk["Valid"] == "True").sum())
+            destination.write(chunk.to_csv(sep="\t", index=None, header=header))
+            header = False
+        if carry is not None and len(carry) > 0:
+            carry = carry.copy()
+            carry["Overlap"] = overlap_messages(carry)
+            rows += len(carry)
+            valid_rows += int((carry["Valid"] == "True").sum())
+            destination.write(carry.to_csv(sep="\t", index=None, header=header))
+    finally:
+        if output:
+            destination.close()
+    return rows, valid_rows
+
+def revalidate_results_db(db_loc, length_limit, identity_limit):
+    """
+    Revalidates a SQLite results store in place with a single UPDATE. If the
+    store has overlaps, they are recomputed one assembly at a time. Messages
+    keep the flag of targets whose primer matches were capped.
+
+    Arguments:
+        db_loc -- Location of the SQLite file
+        length_limit -- New length limit
+        identity_limit -- New identity limit
+
+    Returns:
+        counts -- (rows, valid rows) in the results store
+    """
+    connection = sqlite3.connect(f"file:{db_loc}?mode=rw", uri=True)
+    try:
+        identity_ok = f"{quote('Identity')} >= :identity"
+        length_ok = f"({quote('Coverage_Perc_Len')} >= 100 - :length AND {quote('Coverage_Perc_Len')} <= 100 + :length)"
+        capped = f"substr({quote('Message')}, -length(:capped_message)) = :capped_message"
+        message = f"""CASE
+        WHEN {identity_ok} THEN :length_message
+        WHEN {length_ok} THEN :identity_message
+        ELSE :both_message END"""
+        with connection:
+            connection.execute(f"""UPDATE hits SET
+    {quote('Valid')} = CASE WHEN {identity_ok} AND {length_ok} THEN 1 ELSE 0 END,
+    {quote('Message')} = CASE
+        WHEN {identity_ok} AND {length_ok} THEN CASE WHEN {capped} THEN :capped_message ELSE '' END
+        WHEN {capped} THEN {message} || ' ' || :capped_message
+        ELSE {message} END
+WHERE {quote('Identity')} IS NOT NULL AND {quote('Coverage_Perc_Len')} IS NOT NULL""",
+                {"identity": identity_limit, "length": length_limit, "length_message": LENGTH_MESSAGE,
+                 "identity_message": IDENTITY_MESSAGE, "both_message": BOTH_MESSAGE, "capped_message": CAPPED_MESSAGE})
+            hit_columns = [row[1] for row in connection.execute("PRAGMA table_info(hits)")]
+            if "Overlap" in hit_columns:
+                import pandas as pd
+                assembly_ids = [row[0] for row in connection.execute("SELECT DISTINCT assembly_id FROM hits")]
+                settings = "".join(f", hits.{quote(column)}" for column in ("Primer_Size", "Slide_Limit") if column in hit_columns)
+                for assembly_id in assembly_ids:
+                    assembly = pd.read_sql_query(f"""SELECT hits.id, assemblies.path AS Query, targets.name AS Name, hits.Valid, hits.Strand, hits.Contig, hits.Start, hits."End"{settings}
+FROM hits JOIN assemblies ON assemblies.id = hits.assembly_id JOIN targets ON targets.id = hits.target_id
+WHERE hits.assembly_id = ? ORDER BY hits.id""", connection, params=(assembly_id,))
+                    connection.executemany(f"UPDATE hits SET {quote('Overlap')} = ? WHERE id = ?", zip(overlap_messages(assembly), assembly["id"].tolist()))
+        rows, valid_rows = connection.execute(f"SELECT COUNT(*), COALESCE(SUM({quote('Valid')}), 0) FROM hits").fetchone()
+    finally:
+        connection.close()
+    return rows, valid_rows
@@ -0,0 +1,210 @@
+import math
+import os
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from helpers.compression import is_gzipped, is_bgzf
+from helpers.settings import SCHEDULER_GZIP_RATIO
+
+def assembly_size(fasta):
+    """
+    Estimates the uncompressed size of an assembly without reading it. gzip
+    files end with the uncompressed size of their last member (modulo 4 GiB),
+    which is the size of the whole file for a single member below 4 GiB. Other
+    compressed files (BGZF ends with an empty member) are estimated from their
+    compressed size.
+
+    Arguments:
+        fasta -- Location of the assembly
+
+    Returns:
+        size -- Estimated uncompressed size in bytes (about its number of bases)
+    """
+    size = os.path.getsize(fasta)
+    if not is_gzipped(fasta):
+        return size
+    with open(fasta, "rb") as handle:
+        handle.seek(max(size - 4, 0))
+        trailer_size = int.from_bytes(handle.read(4), "little")
+    # A single member is never smaller uncompressed than compressed
+    if trailer_size >= size and not is_bgzf(fasta):
+        return trailer_size
+    return size * SCHEDULER_GZIP_RATIO
+
+def assembly_cost(size, target_bases):
+    """
+    Estimates the cost of crawling an assembly. Primer searches scale with the
+    size of the assembly and of the database. The number of contigs is
+    intentionally ignored: counting them means reading every assembly before
+    the first worker starts, and per-contig work is small next to the search.
+
+    Arguments:
+        size -- Size of the assembly from assembly_size
+        target_bases -- Total length of the database targets
+
+    Returns:
+        cost -- Estimated cost, in arbitrary units
+    """
+    return size * target_bases
+
+def possible_copies(fastas):
+    """
+    Finds the assemblies that may be identical copies of another assembly, so
+    only these need to be hashed before crawling. Copies stored the same way
+    have the same file size. A compressed and an uncompressed copy are not
+    found, and are crawled twice with the same results.
+
+    Arguments:
+        fastas -- List of assemblies
+
+    Returns:
+        copies -- Set of assemblies whose file size is shared with another assembly
+    """
+    sizes = {fasta: os.path.getsize(fasta) for fasta in fastas}
+    size_counts = Counter(sizes.values())
+    return {fasta for fasta, size in sizes.items() if size_counts[size] > 1}
+
+def target_ranges(target_lengths, count):
+    """
+    Splits the targets of a database into contiguous ranges with about the same
+    number of bases.
+
+    Arguments:
+        target_lengths -- Length of each target, in database order
+        count -- Number of ranges wanted
+
+    Returns:
+        ranges -- List of up to count (start, end) positions of targets
+    """
+    total = sum(target_lengths)
+    bounds = [0]
+    cumulative = 0
+    for position, length in enumerate(target_lengths, 1):
+        cumulative += length
+        if cumulative >= total * len(bounds) / count and position < len(target_lengths):
+            bounds.append(position)
+    bounds.append(len(target_lengths))
+    return list(zip(bounds, bounds[1:]))
+
+def plan_tasks(costs, target_lengths, workers):
+    """
+    Plans the tasks of a crawl, largest first. An assembly that costs more than
+    an equal share of the work of each worker is split into target ranges, so a
+    single large assembly does not keep one worker busy after the others finish.
+
+    Arguments:
+        costs -- Estimated cost of each assembly from assembly_cost
+        target_lengths -- Length of each target, in database order
+        workers -- Number of worker processes
+
+    Returns:
+        tasks -- List of (estimated cost, assembly position, target range) tuples, largest first
+    """
+    share = sum(costs) / workers
+    total_bases = sum(target_lengths)
+    tasks = []
+    for position, cost in enumerate(costs):
+        count = 1
+        if share > 0:
+            count = max(1, min(math.ceil(round(cost / share, 6)), len(target_lengths)))
+        for start, end in target_ranges(target_lengths, count):
+            range_cost = cost * sum(target_lengths[start:end]) / total_bases if total_bases > 0 else cost
+            tasks.append((range_cost, position, (start, end)))
+    # Sorting is stable, so tasks of the same cost keep the order of the list
+    tasks.sort(key=lambda task: -task[0])
+    return tasks
+
+def run_task(fasta, db_loc, crawl_args, crawl_options):
+    """
+    Crawls one task in a worker process.
+
+    Arguments:
+        fasta -- Location of the assembly
+        db_loc -- Location of the prepared database(s)
+        crawl_args -- Positional arguments of crawl after db_loc
+        crawl_options -- Keyword arguments of crawl
+
+    Returns:
+        results -- Results dataframe of the task
+        counters -- Telemetry counters added by the task
+    """
+    from helpers.crawler import crawl
+    from helpers import telemetry
+
+    before = dict(telemetry.COUNTERS)
+    results = crawl(fasta, db_loc, *crawl_args, **crawl_options)
+    counters = {counter: value - before[counter] for counter, value in telemetry.COUNTERS.items()}
+    return results, counters
+
+def merge_task_counters(future):
+    """
+    Adds the telemetry counters of a finished task, called when its future is done.
+
+    Arguments:
+        future -- Future of run_task
+    """
+    from helpers import telemetry
+
+    if future.cancelled() or future.exception() is not None:
+        return
+    telemetry.merge_counters(future.result()[1])
+
+def crawl_scheduled(fastas, db_loc, slide_limit, length_limit, identity_limit, primer_size, check_overlaps, check_start_stop, annotation, workers=1, assembly_digests=None, **options):
+    """
+    Runs SPIDER on several assemblies with a pool of worker processes. Tasks are
+    dispatched by estimated cost, largest first, and assemblies larger than the
+    share of one worker are split into target ranges. Results are still returned
+    in the order of the assemblies, and are the same as crawling each assembly
+    on its own.
+
+    Telemetry counters of the workers are added as soon as each task finishes.
+
+    Arguments:
+        fastas -- List of assemblies to query
+        workers -- Number of worker processes
+        assembly_digests -- Content hashes of the assemblies, used for the result
+                            cache. Assemblies without one (None) are hashed by the
+                            workers if needed.
+        Remaining arguments as in crawl
+
+    Yields:
+        results -- Results dataframe of each assembly, in the order of fastas
+    """
+    from helpers.crawler import load_targets, concat_results, find_overlaps
+    from helpers import telemetry
+
+    targets, _ = load_targets(db_loc)
+    target_lengths = [len(sequence) for _, sequence in targets]
+    costs = [assembly_cost(assembly_size(fasta), sum(target_lengths)) for fasta in fastas]
+    tasks = plan_tasks(costs, target_lengths, workers)
+    crawl_args = (slide_limit, length_limit, identity_limit, primer_size, check_overlaps, check_start_stop, annotation)
+
+    # Worker processes are started fresh, without the threads of this process
+    with ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn")) as executor:
+        # Futures of the target ranges of each assembly, in target order
+        futures = [[] for _ in fastas]
+        for _, position, target_range in tasks:
+            crawl_options = dict(options, target_range=target_range if target_range != (0, len(targets)) else None)
+            if assembly_digests is not None:
+                crawl_options["assembly_digest"] = assembly_digests[position]
+            future = executor.submit(run_task, fastas[position], db_loc, crawl_args, crawl_options)
+            future.add_done_callback(merge_task_counters)
+            futures[position].append((target_range, future))
+        try:
+            for assembly_futures in futures:
+                chunks = []
+                for _, future in sorted(assembly_futures, key=lambda item: item[0]):
+                    results, _ = future.result()
+                    chunks.append(results)
+                if len(chunks) == 1:
+                    yield chunks[0]
+                    continue
+                results = concat_results(chunks)
+                # Overlaps were only compared within each target range
+                if check_overlaps:
+                    results = find_overlaps(results)
+                yield results
+        finally:
+            for assembly_futures in futures:
+                for _, future in assembly_futures:
+                    future.cancel()
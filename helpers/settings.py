@@ -1,4 +1,6 @@
 SPIDER_DBS_FOLDER = "spider_databases"
+# Header indexes of databases searched with -s/--search, rebuilt when a database changes
+HEADER_INDEX_FOLDER = f"{SPIDER_DBS_FOLDER}/header_indexes"
 
 # List of available databases
 DATABASE_DESCRIPTIONS = {
@@ -11,6 +13,54 @@ DATABASE_FILENAMES = {
 	"vfdb": "VFDB_setA_nt.fas.gz"
 	}
 
+# Adaptive slide search: number of primer offsets in the first batch, each
+# following batch is ADAPTIVE_GROWTH times larger than the previous one
+ADAPTIVE_INITIAL_PRIMERS = 4
+ADAPTIVE_GROWTH = 2
+
+# Prefilter: largest k-mer size of the minimizer sketch, and the fraction of
+# primers with a minimizer in the assembly at or below which a target is skipped
+PREFILTER_MAX_K = 15
+PREFILTER_THRESHOLD = 0.0
+
+# Large assemblies: approximate number of bases per BLAST database chunk
+LARGE_CHUNK_BASES = 100_000_000
+
+# Caps on the matches of the best primer in each direction, and on the candidate
+# primer pairs of a target (0 for no cap). Targets that reach a cap are flagged
+# with CAPPED_MESSAGE, and only the pairs closest to the expected length are kept
+MAX_PRIMER_HITS = 1000
+MAX_PRIMER_PAIRS = 10000
+CAPPED_MESSAGE = "Primer matches were capped, some candidate amplicons were not considered."
+
+# Primer search engines that can be selected with --engine (see helpers/engines.py)
+SEARCH_ENGINES = ["blastn", "replay"]
+
+# Scheduler: assumed ratio of uncompressed to compressed size of gzip assemblies
+# whose uncompressed size is not in their gzip trailer (e.g. BGZF)
+SCHEDULER_GZIP_RATIO = 4
+
+# Seconds between progress heartbeats (JSON lines and Prometheus textfile)
+PROGRESS_INTERVAL = 15
+
+# Seconds between polls of a watched directory. New assemblies are crawled once
+# their size has not changed for this long
+WATCH_INTERVAL = 5
+
+# Number of result rows revalidated at a time
+REVALIDATE_CHUNK_ROWS = 100_000
+
+# Default blastn e-value cutoff and maximum number of subject sequences per query,
+# scaled for seed region queries and batches of assemblies
+BLAST_DEFAULT_EVALUE = 10
+BLAST_DEFAULT_MAX_TARGET_SEQS = 500
+
+# Output/input extensions that select the SQLite results store
+RESULTS_DB_EXTENSIONS = (".sqlite", ".sqlite3", ".db")
+
+# Accepted assembly file extensions (plain, gzip or BGZF compressed)
+FASTA_EXTENSIONS = (".fasta", ".fna", ".fasta.gz", ".fna.gz")
+
 
 # Table headers
 BLAST_COLUMNS_FMT_6 = (
@@ -46,6 +96,26 @@ SPIDER_RESULTS_COLUMNS = (
 	"Message"               # SPIDER message for failures/warnings
 	)
 
+# Column types of SPIDER results. Missing values are <NA> and written as NA
+SPIDER_RESULTS_DTYPES = {
+	"Query": "category",
+	"Name": "category",
+	"Database": "category",
+	"Valid": "bool",
+	"Contig": "category",
+	"Start": "Int64",
+	"F_Slide": "Int64",
+	"End": "Int64",
+	"R_Slide": "Int64",
+	"Strand": "category",
+	"Identity": "Float64",
+	"Target_Length": "Int64",
+	"Ref_Length": "Int64",
+	"Coverage_Perc_Len": "Float64",
+	"Coverage_Perc_Align": "Float64",
+	"Message": "category"
+}
+
 GFF3_COLUMNS = (
 	"seqid",
 	"source",
@@ -0,0 +1,270 @@
+import os
+import re
+import io
+import sys
+import heapq
+import sqlite3
+from helpers.results_db import is_results_db, open_results_db, write_results, BOOLEAN_COLUMNS
+
+def parse_shard(shard):
+    """
+    Parses a shard specification in the form i/N.
+
+    Arguments:
+        shard -- Shard specification, e.g. 3/10 for the third of ten shards
+
+    Returns:
+        index -- Shard number (1 to count)
+        count -- Total number of shards
+    """
+    match = re.fullmatch(r"\s*(\d+)\s*/\s*(\d+)\s*", shard)
+    if not match:
+        raise ValueError(f"{shard} is not in the form i/N")
+    index, count = int(match.group(1)), int(match.group(2))
+    if count < 1 or index < 1 or index > count:
+        raise ValueError(f"shard {index} of {count} does not exist, i must be between 1 and N")
+    return index, count
+
+def assign_shards(fasta_list, count):
+    """
+    Partitions assemblies into shards of similar total file size. The largest
+    assemblies are placed first, each into the shard with the smallest total
+    so far (ties go to the lower shard), so the partition only depends on the
+    assemblies and their sizes.
+
+    Arguments:
+        fasta_list -- List of assemblies
+        count -- Number of shards
+
+    Returns:
+        shards -- List of count lists of assemblies, each in the order of fasta_list
+    """
+    sizes = {assembly: os.path.getsize(assembly) for assembly in fasta_list}
+    loads = [(0, shard) for shard in range(count)]
+    assigned = {}
+    for assembly in sorted(sizes, key=lambda assembly: (-sizes[assembly], assembly)):
+        load, shard = heapq.heappop(loads)
+        assigned[assembly] = shard
+        heapq.heappush(loads, (load + sizes[assembly], shard))
+
+    shards = [[] for _ in range(count)]
+    for assembly in fasta_list:
+        shards[assigned[assembly]].append(assembly)
+    return shards
+
+def select_shard(fasta_list, index, count):
+    """
+    Returns the assemblies of one shard.
+
+    Arguments:
+        fasta_list -- List of assemblies
+        index -- Shard number (1 to count)
+        count -- Total number of shards
+
+    Returns:
+        shard_list -- Assemblies assigned to the shard, in the order of fasta_list
+    """
+    return assign_shards(fasta_list, count)[index - 1]
+
+def first_field(line):
+    """
+    Returns the first column (Query) of a TSV output line.
+    """
+    if line.startswith(b'"'):
+        # Quoted by pandas, "" is an escaped quote
+        end = 1
+        while True:
+            end = line.index(b'"', end)
+            if line[end + 1:end + 2] == b'"':
+                end += 2
+            else:
+                return line[1:end].replace(b'""', b'"').decode()
+    return line.split(b"\t", 1)[0].rstrip(b"\r\n").decode()
+
+def index_tsv(tsv_loc):
+    """
+    Finds the rows of every assembly in a TSV output without loading it.
+    Rows of an assembly must be next to each other, as written by SPIDER.
+
+    Arguments:
+        tsv_loc -- Location of the TSV output
+
+    Returns:
+        header -- Header line
+        groups -- Dictionary of assembly to (byte offset, byte length) of its rows
+    """
+    groups = {}
+    with open(tsv_loc, "rb") as tsv:
+        header = tsv.readline()
+        query = None
+        start = offset = tsv.tell()
+        for line in iter(tsv.readline, b""):
+            if not line.strip():
+                offset += len(line)
+                continue
+            line_query = first_field(line)
+            if line_query != query:
+                if query is not None:
+                    groups[query] = (start, offset - start)
+                if line_query in groups:
+                    raise ValueError(f"the rows of {line_query} in {tsv_loc} are not next to each other")
+                query = line_query
+                start = offset
+            offset += len(line)
+        if query is not None:
+            groups[query] = (start, offset - start)
+    return header, groups
+
+def index_results_db(db_loc):
+    """
+    Lists the assemblies stored in a SQLite results store.
+
+    Returns:
+        groups -- Dictionary of assembly to its id in the store
+    """
+    connection = sqlite3.connect(f"file:{db_loc}?mode=ro", uri=True)
+    try:
+        return dict(connection.execute("SELECT path, id FROM assemblies WHERE id IN (SELECT DISTINCT assembly_id FROM hits)"))
+    finally:
+        connection.close()
+
+def results_db_columns(db_loc):
+    """
+    Lists the columns of the results view of a SQLite results store.
+
+    Returns:
+        columns -- Column names
+    """
+    connection = sqlite3.connect(f"file:{db_loc}?mode=ro", uri=True)
+    try:
+        return [description[0] for description in connection.execute("SELECT * FROM results LIMIT 0").description]
+    finally:
+        connection.close()
+
+def read_db_group(connection, query):
+    """
+    Reads the results of one assembly from a results store.
+
+    Returns:
+        columns -- Column names
+        rows -- List of result rows
+    """
+    cursor = connection.execute("SELECT * FROM results WHERE Query = ?", (query,))
+    columns = [description[0] for description in cursor.description]
+    return columns, cursor.fetchall()
+
+def format_tsv_value(column, value):
+    """
+    Formats a value read from a results store the way SPIDER writes TSV output.
+    """
+    if value is None:
+        return "NA"
+    if column in BOOLEAN_COLUMNS and isinstance(value, int):
+        return str(bool(value))
+    return str(value)
+
+def merge_results(shard_outputs, output, expected=None):
+    """
+    Merges the outputs of sharded runs into one output. Assemblies are written
+    one at a time, so memory use does not grow with the size of the outputs.
+    Assemblies are ordered as in expected, or by name if no list is given.
+    Every assembly must be found in exactly one shard output, and if expected
+    is given, no assembly may be missing or extra.
+
+    Arguments:
+        shard_outputs -- List of shard outputs (TSV or SQLite results stores)
+        output -- Output location, a SQLite results store if it has a SQLite
+                  extension, otherwise TSV. None prints TSV to stdout.
+        expected -- Optional list of assemblies the shards were made from
+
+    Returns:
+        count -- Number of assemblies merged
+    """
+    import pandas as pd
+
+    # Index every shard output
+    sources = {}
+    headers = {}
+    source_columns = {}
+    owners = {}
+    duplicates = []
+    for shard_output in shard_outputs:
+        if is_results_db(shard_output):
+            groups = index_results_db(shard_output)
+            if groups:
+                source_columns[shard_output] = results_db_columns(shard_output)
+        else:
+            header, groups = index_tsv(shard_output)
+            if groups:
+                headers[shard_output] = header
+                source_columns[shard_output] = header.decode().rstrip("\r\n").split("\t")
+        sources[shard_output] = groups
+        for query in groups:
+            if query in owners:
+                duplicates.append(f"{query} ({owners[query]}, {shard_output})")
+            else:
+                owners[query] = shard_output
+
+    # Check coverage
+    errors = []
+    if duplicates:
+        errors.append(f"Assemblies found in more than one shard output: {', '.join(duplicates)}")
+    if expected is not None:
+        missing = [query for query in expected if query not in owners]
+        expected_set = set(expected)
+        extra = [query for query in owners if query not in expected_set]
+        if missing:
+            errors.append(f"Assemblies missing from the shard outputs: {', '.join(missing)}")
+        if extra:
+            errors.append(f"Assemblies in the shard outputs that are not in the input: {', '.join(extra)}")
+    # TSV rows are copied as they are, so TSV shard outputs need the same header.
+    # Rows of results stores are written in the order of the merged columns.
+    if len(set(headers.values())) > 1 or len({frozenset(columns) for columns in source_columns.values()}) > 1:
+        errors.append(f"Shard outputs have different columns: {', '.join(source_columns)}")
+    if errors:
+        raise ValueError("\n".join(errors))
+
+    order = list(dict.fromkeys(expected)) if expected is not None else sorted(owners)
+    to_db = is_results_db(output)
+    if to_db:
+        destination = open_results_db(output)
+    else:
+        destination = open(output, "w", newline="") if output else sys.stdout
+    connections = {source: sqlite3.connect(f"file:{source}?mode=ro", uri=True) for source in sources if is_results_db(source)}
+    # Columns of the merged TSV output, in the order of the TSV shard outputs if there are any
+    merged_columns = next((source_columns[source] for source in headers), next(iter(source_columns.values()), []))
+    try:
+        header_written = False
+        for query in order:
+            source = owners[query]
+            if to_db:
+                if source in connections:
+                    group = pd.read_sql_query("SELECT * FROM results WHERE Query = ?", connections[source], params=(query,))
+                else:
+                    start, length = sources[source][query]
+                    with open(source, "rb") as tsv:
+                        tsv.seek(start)
+                        group = pd.read_csv(io.BytesIO(headers[source] + tsv.read(length)), sep="\t", keep_default_na=False, na_values=["NA"])
+                write_results(destination, group)
+            else:
+                if source in connections:
+                    columns, rows = read_db_group(connections[source], query)
+                    header = "\t".join(merged_columns) + "\n"
+                    # Rows are written with the csv quoting pandas uses
+                    lines = pd.DataFrame([[format_tsv_value(column, value) for column, value in zip(columns, row)] for row in rows], columns=columns)[merged_columns].to_csv(sep="\t", index=None, header=False)
+                else:
+                    header = headers[source].decode()
+                    start, length = sources[source][query]
+                    with open(source, "rb") as tsv:
+                        tsv.seek(start)
+                        lines = tsv.read(length).decode()
+                if not header_written:
+                    destination.write(header)
+                    header_written = True
+                destination.write(lines)
+    finally:
+        for connection in connections.values():
+            connection.close()
+        if output:
+            destination.close()
+    return len(order)
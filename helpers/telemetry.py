@@ -0,0 +1,258 @@
+import errno
+import json
+import os
+import socket
+import stat
+import threading
+import time
+from helpers.settings import PROGRESS_INTERVAL
+
+# Counters updated while crawling, read by the progress reports
+COUNTERS = {
+    "assemblies": 0,         # Assemblies completed
+    "targets": 0,            # Database targets completed (over all assemblies)
+    "targets_searched": 0,   # Unique target sequences searched with BLAST
+    "blastn_calls": 0,
+    "makeblastdb_calls": 0,
+    "cache_lookups": 0,
+    "cache_hits": 0,
+    "primer_hits_capped": 0,   # Target searches that reached the cap on primer matches
+    "primer_pairs_capped": 0,  # Target searches that reached the cap on candidate pairs
+    "active_blast": 0        # BLAST processes running now
+}
+# State of the current run, set by start_progress
+STATE = {
+    "started": None,
+    "total_assemblies": 0,
+    "current_assembly": None,
+    "last_progress": None,
+    "worker": f"{socket.gethostname()}:{os.getpid()}",
+    "shard": "",
+    "progress_loc": None,
+    "progress_file": None,
+    "prometheus_loc": None,
+    "stop": None,
+    "thread": None
+}
+LOCK = threading.Lock()
+
+def count(counter, amount=1):
+    """
+    Adds to one of the run counters.
+
+    Arguments:
+        counter -- Name of the counter in COUNTERS
+        amount -- Amount to add (negative to subtract)
+    """
+    COUNTERS[counter] += amount
+
+def merge_counters(counters):
+    """
+    Adds the counters of a task that ran in another process.
+
+    Arguments:
+        counters -- Dictionary of amounts to add to COUNTERS
+    """
+    with LOCK:
+        for counter, amount in counters.items():
+            COUNTERS[counter] += amount
+        if counters.get("targets_searched"):
+            STATE["last_progress"] = time.time()
+
+def snapshot():
+    """
+    Summarizes the progress of the run.
+
+    Returns:
+        status -- Dictionary of counters, rates and estimated time remaining
+    """
+    now = time.time()
+    elapsed = now - STATE["started"] if STATE["started"] else 0
+    assemblies_rate = COUNTERS["assemblies"] / elapsed if elapsed > 0 else 0
+    remaining = STATE["total_assemblies"] - COUNTERS["assemblies"]
+    status = {
+        "time": round(now, 3),
+        "worker": STATE["worker"],
+        "shard": STATE["shard"],
+        "current_assembly": STATE["current_assembly"],
+        "completed": COUNTERS["assemblies"],
+        "total": STATE["total_assemblies"],
+        "elapsed_s": round(elapsed, 3),
+        "assemblies_per_s": round(assemblies_rate, 6),
+        "targets_per_s": round(COUNTERS["targets"] / elapsed, 6) if elapsed > 0 else 0,
+        "targets": COUNTERS["targets"],
+        "targets_searched": COUNTERS["targets_searched"],
+        "blastn_calls": COUNTERS["blastn_calls"],
+        "makeblastdb_calls": COUNTERS["makeblastdb_calls"],
+        "active_blast": COUNTERS["active_blast"],
+        "cache_lookups": COUNTERS["cache_lookups"],
+        "cache_hits": COUNTERS["cache_hits"],
+        "primer_hits_capped": COUNTERS["primer_hits_capped"],
+        "primer_pairs_capped": COUNTERS["primer_pairs_capped"],
+        "cache_hit_rate": round(COUNTERS["cache_hits"] / COUNTERS["cache_lookups"], 6) if COUNTERS["cache_lookups"] > 0 else None,
+        "eta_s": round(remaining / assemblies_rate, 1) if assemblies_rate > 0 else None,
+        "last_progress": round(STATE["last_progress"], 3) if STATE["last_progress"] else None
+    }
+    return status
+
+def open_progress(progress_loc):
+    """
+    Opens the JSON lines progress output. A FIFO is opened without blocking, so
+    a run never waits for a reader; events are dropped while nobody is reading.
+
+    Returns:
+        progress_file -- File object, or None if a FIFO has no reader yet
+    """
+    if os.path.exists(progress_loc) and stat.S_ISFIFO(os.stat(progress_loc).st_mode):
+        try:
+            descriptor = os.open(progress_loc, os.O_WRONLY | os.O_NONBLOCK)
+        except OSError as error:
+            if error.errno == errno.ENXIO:
+                return None
+            raise
+        return os.fdopen(descriptor, "w", buffering=1)
+    return open(progress_loc, "a", buffering=1)
+
+def emit(event, **fields):
+    """
+    Writes a progress event as one JSON line, and rewrites the Prometheus
+    textfile. Nothing is written if no progress outputs were requested.
+
+    Arguments:
+        event -- Event type (start, assembly, heartbeat, finish)
+        fields -- Extra fields for the event
+    """
+    with LOCK:
+        status = snapshot()
+        if STATE["progress_loc"]:
+            if STATE["progress_file"] is None:
+                STATE["progress_file"] = open_progress(STATE["progress_loc"])
+            if STATE["progress_file"] is not None:
+                try:
+                    STATE["progress_file"].write(json.dumps({"event": event, **status, **fields}) + "\n")
+                except (BlockingIOError, BrokenPipeError):
+                    # Reader is gone or not keeping up, reopen on the next event
+                    try:
+                        STATE["progress_file"].close()
+                    except OSError:
+                        pass
+                    STATE["progress_file"] = None
+        if STATE["prometheus_loc"]:
+            write_prometheus(STATE["prometheus_loc"], status)
+
+def write_prometheus(prometheus_loc, status):
+    """
+    Rewrites a Prometheus textfile (node_exporter textfile collector format)
+    with the current status. The file is replaced atomically.
+
+    Arguments:
+        prometheus_loc -- Location of the .prom file
+        status -- Status from snapshot
+    """
+    labels = f'worker="{status["worker"]}",shard="{status["shard"]}"'
+    metrics = (
+        ("spider_assemblies", "gauge", "Assemblies to crawl", status["total"]),
+        ("spider_assemblies_completed_total", "counter", "Assemblies completed", status["completed"]),
+        ("spider_targets_completed_total", "counter", "Database targets completed", status["targets"]),
+        ("spider_targets_searched_total", "counter", "Unique targets searched with BLAST", status["targets_searched"]),
+        ("spider_blastn_calls_total", "counter", "blastn processes run", status["blastn_calls"]),
+        ("spider_makeblastdb_calls_total", "counter", "makeblastdb processes run", status["makeblastdb_calls"]),
+        ("spider_active_blast_processes", "gauge", "blastn processes running", status["active_blast"]),
+        ("spider_cache_lookups_total", "counter", "Result cache lookups", status["cache_lookups"]),
+        ("spider_cache_hits_total", "counter", "Result cache hits", status["cache_hits"]),
+        ("spider_primer_hits_capped_total", "counter", "Target searches that reached the primer match cap", status["primer_hits_capped"]),
+        ("spider_primer_pairs_capped_total", "counter", "Target searches that reached the candidate pair cap", status["primer_pairs_capped"]),
+        ("spider_assemblies_per_second", "gauge", "Assemblies completed per second", status["assemblies_per_s"]),
+        ("spider_targets_per_second", "gauge", "Targets completed per second", status["targets_per_s"]),
+        ("spider_eta_seconds", "gauge", "Estimated seconds remaining", status["eta_s"]),
+        ("spider_last_progress_timestamp_seconds", "gauge", "Time of the last completed target search or assembly", status["last_progress"]),
+        ("spider_heartbeat_timestamp_seconds", "gauge", "Time this file was written", status["time"])
+    )
+    lines = []
+    for name, metric_type, description, value in metrics:
+        if value is None:
+            continue
+        lines.append(f"# HELP {name} {description}\n# TYPE {name} {metric_type}\n{name}{{{labels}}} {value}\n")
+    temp_loc = f"{prometheus_loc}.{os.getpid()}.tmp"
+    with open(temp_loc, "w") as prom:
+        prom.writelines(lines)
+    os.replace(temp_loc, prometheus_loc)
+
+def heartbeat(stop, interval):
+    """
+    Emits a heartbeat event every interval seconds until stop is set.
+    """
+    while not stop.wait(interval):
+        emit("heartbeat")
+
+def start_progress(total_assemblies, progress_loc=None, prometheus_loc=None, shard="", interval=PROGRESS_INTERVAL):
+    """
+    Starts progress reporting for a run. Events are written as JSON lines to
+    progress_loc (a file or FIFO), and the Prometheus textfile is rewritten at
+    every event and at least every interval seconds.
+
+    Arguments:
+        total_assemblies -- Number of assemblies to crawl
+        progress_loc -- JSON lines output, None to disable
+        prometheus_loc -- Prometheus textfile, None to disable
+        shard -- Shard being crawled (i/N), used as a label
+        interval -- Seconds between heartbeat events
+    """
+    STATE["started"] = time.time()
+    STATE["total_assemblies"] = total_assemblies
+    STATE["shard"] = shard or ""
+    STATE["progress_loc"] = progress_loc
+    STATE["prometheus_loc"] = prometheus_loc
+    emit("start")
+    if progress_loc or prometheus_loc:
+        STATE["stop"] = threading.Event()
+        STATE["thread"] = threading.Thread(target=heartbeat, args=(STATE["stop"], interval), daemon=True)
+        STATE["thread"].start()
+
+def add_assemblies(amount=1):
+    """
+    Adds assemblies to crawl, when they are found during the run (--watch).
+    """
+    STATE["total_assemblies"] += amount
+
+def start_assembly(assembly):
+    """
+    Records the assembly being crawled.
+    """
+    STATE["current_assembly"] = assembly
+
+def complete_assembly(assembly, targets):
+    """
+    Records a completed assembly and emits an assembly event.
+
+    Arguments:
+        assembly -- Assembly location
+        targets -- Number of database targets in the assembly results
+    """
+    count("assemblies")
+    count("targets", targets)
+    STATE["last_progress"] = time.time()
+    STATE["current_assembly"] = None
+    emit("assembly", assembly=assembly)
+
+def target_searched():
+    """
+    Records a target search that finished.
+    """
+    count("targets_searched")
+    STATE["last_progress"] = time.time()
+
+def finish_progress():
+    """
+    Stops the heartbeat and emits the final event.
+    """
+    if STATE["stop"] is not None:
+        STATE["stop"].set()
+        STATE["thread"].join()
+    emit("finish")
+    if STATE["progress_file"] is not None:
+        try:
+            STATE["progress_file"].close()
+        except OSError:
+            pass
+        STATE["progress_file"] = None
@@ -0,0 +1,96 @@
+import os
+import sys
+import time
+from helpers.settings import WATCH_INTERVAL
+from helpers.assembly_list_funcs import parse_directory
+from helpers.results_db import is_results_db
+from helpers.sharding import index_tsv, index_results_db
+
+def completed_assemblies(output):
+    """
+    Lists the assemblies already written to an output, so a watch can resume
+    where an earlier run stopped.
+
+    Arguments:
+        output -- TSV output or SQLite results store, None for stdout
+
+    Returns:
+        header -- Header line of a TSV output, None if there is none
+        completed -- Set of assemblies in the output
+    """
+    if not output or not os.path.exists(output) or os.path.getsize(output) == 0:
+        return None, set()
+    if is_results_db(output):
+        return None, set(index_results_db(output))
+    header, groups = index_tsv(output)
+    return header.decode(), set(groups)
+
+def watch_directory(directory, completed, interval=WATCH_INTERVAL):
+    """
+    Polls a directory and yields assemblies once they are completely written.
+    An assembly is complete when its size and modification time are the same
+    on two polls at least interval seconds apart, so files still being written
+    by an assembler or copied in are not crawled early. An old modification
+    time is not enough, as copies can keep their timestamps and writers can
+    pause. Runs until interrupted.
+
+    Arguments:
+        directory -- Path to the directory that receives assemblies
+        completed -- Set of assemblies that should not be crawled (updated with
+                     every assembly yielded)
+        interval -- Seconds between polls
+
+    Yields:
+        assembly -- Path of a new, complete assembly
+    """
+    # Size and modification time of files seen at earlier polls, with the time
+    # they were first seen unchanged
+    seen = {}
+    while True:
+        found = False
+        for assembly in parse_directory(directory):
+            if assembly in completed:
+                continue
+            try:
+                stats = os.stat(assembly)
+            except FileNotFoundError:
+                # Removed (or renamed) since the directory was listed
+                seen.pop(assembly, None)
+                continue
+            state = (stats.st_size, stats.st_mtime_ns)
+            now = time.monotonic()
+            if assembly not in seen or seen[assembly][0] != state:
+                seen[assembly] = (state, now)
+            if now - seen[assembly][1] >= interval and stats.st_size > 0:
+                completed.add(assembly)
+                del seen[assembly]
+                found = True
+                yield assembly
+        if not found:
+            time.sleep(interval)
+
+def append_results(output, results, header):
+    """
+    Appends the results of an assembly to a TSV output (or stdout), writing
+    the header first if the output has none yet. The output is flushed, so the
+    results can be read as soon as the assembly is done.
+
+    Arguments:
+        output -- TSV output, None for stdout
+        results -- Dataframe of SPIDER results of one assembly
+        header -- Header line already in the output, None if there is none
+
+    Returns:
+        header -- Header line of the output
+    """
+    columns = "\t".join(results.columns) + "\n"
+    if header is not None and header != columns:
+        raise ValueError(f"the columns of {output} do not match the columns of this search. Use the same search options, or a new output.")
+    lines = results.to_csv(sep="\t", index=None, header=header is None, na_rep="NA")
+    if output:
+        with open(output, "a", newline="") as destination:
+            destination.write(lines)
+    else:
+        sys.stdout.write(lines)
+        sys.stdout.flush()
+    return columns
@@ -1,15 +1,20 @@
 import argparse
 from helpers.db_functions import prepare_db, list_databases, get_database
-from helpers.crawler import crawl
 from helpers.assembly_list_funcs import parse_list, list_exists, parse_directory
-from helpers.fasta_extract import extract_sequences
-from helpers.settings import DATABASE_DESCRIPTIONS
+from helpers.settings import DATABASE_DESCRIPTIONS, FASTA_EXTENSIONS, MAX_PRIMER_HITS, MAX_PRIMER_PAIRS, SEARCH_ENGINES
+from helpers.results_db import is_results_db
+from helpers.sharding import parse_shard, select_shard, merge_results
+from helpers.matrix import MATRIX_VALUES
+from helpers.header_index import parse_query
 import sys
 import os
 import time
-import pandas as pd
 import re
 import shutil
+import sqlite3
+import signal
+# Heavy modules (pandas, numpy, pyfaidx, biopython) are imported inside main() by
+# the code paths that need them, so --list_dbs and argument errors return quickly.
 
 def parse_args():
     """
@@ -24,29 +29,55 @@ def parse_args():
     parser = argparse.ArgumentParser(description='Sliding Primer In-silico Detection of Encoded Regions (SPIDER) - Uses in-silico PCR with sequential primers to identify microbial target sequences.')
     
     # Query options
-    parser.add_argument("-f", "--fasta",  type=str, required=False, help='Path to FASTA file which will be scanned for targets.')
+    parser.add_argument("-f", "--fasta",  type=str, required=False, help='Path to FASTA file which will be scanned for targets. May be gzip or BGZF compressed.')
     parser.add_argument("-l", "--list",  type=str, required=False, help='Path to txt file containing a list of paths to FASTA files to identify targets. Each FASTA file should be on a new line.')
-    parser.add_argument("-d", "--directory",  type=str, required=False, help='Path to directory containing assemblies in FASTA format (.fasta/.fna)')
+    parser.add_argument("-d", "--directory",  type=str, required=False, help='Path to directory containing assemblies in FASTA format (.fasta/.fna, optionally compressed as .fasta.gz/.fna.gz)')
+    parser.add_argument("--watch", action='store_true', required=False, help='Keep watching the directory (-d) and crawl new assemblies as soon as they are completely written, appending their results to the output. Assemblies already in the output are skipped, so a watch can be restarted. Stop with Ctrl+C. Default: False')
+    parser.add_argument("--shard", type=str, required=False, help='Only crawl one shard of a list/directory of assemblies, in the form i/N (e.g. 3/10). Assemblies are split into N shards of similar total file size, the same way on every run. Default: None')
     parser.add_argument("-a", "--annotation", type=str, required=False, help='Annotation file associated with the de novo assembly. When included, SPIDER will check if sequences extracted correspond to annotations. Required to be in GFF3 format. Default: None')
     
     # Database options
-    parser.add_argument("-db", "--database", type=str, required=False, help='Specifies the reference database to use. Database is expected in fasta or fasta.gz format. Special databases can be called using their name. For a list of available special databases, use the command --list_dbs.')
+    parser.add_argument("-db", "--database", type=str, nargs="+", required=False, help='Specifies the reference database(s) to use. Database is expected in fasta or fasta.gz format. Special databases can be called using their name. For a list of available special databases, use the command --list_dbs. Several databases are searched in a single pass and a Database column is added to the output.')
     parser.add_argument( "--list_dbs", action='store_true', required=False, help='Lists available special databases.')
-    parser.add_argument("-s", "--search",  type=str, required=False, help='Extract a set of targets from database based on a search term. Terms with spaces must be in quotations "Staphylococcus aureus". This is HIGHLY RECOMMENDED if using any non-custom databases.')
+    parser.add_argument("-s", "--search",  type=str, nargs="+", required=False, help='Extract a set of targets from database based on a search term. Terms with spaces must be in quotations "Staphylococcus aureus". Terms can combine phrases and /regexes/ with AND, OR, NOT and parentheses, e.g. "Staphylococcus aureus AND (ExoU OR ExoS)". This is HIGHLY RECOMMENDED if using any non-custom databases. With several databases, give one term per database in the same order ("" to keep a whole database), or a single term used for all of them.')
     
     # Crawl options
-    parser.add_argument("-sl", "--slide_limit", type=float, required=False, default=5, help='Percent length of target that primers are allowed to slide. Default is 5%%.')
+    parser.add_argument("-sl", "--slide_limit", type=float, nargs="+", required=False, default=[5], help='Percent length of target that primers are allowed to slide. Several slide limits can be given for a parameter sweep. Default is 5%%.')
     parser.add_argument("-lt", "--length", type=float, required=False, default=20, help='Percent length tolerance. Default: 20%% (Range of 80-120%%)')
     parser.add_argument("-it", "--identity", type=float, required=False, default=0, help='Percent identity tolerance for calling true match. Anything about this threshold will be called positive hit. Default: 0%%')
-    parser.add_argument("-p", "--primer_size", type=int, required=False, default=20, help='Length of primer to use. Default: 20bp')
+    parser.add_argument("-p", "--primer_size", type=int, nargs="+", required=False, default=[20], help='Length of primer to use. Several primer sizes can be given for a parameter sweep. Default: 20bp')
+    parser.add_argument("--adaptive", action='store_true', required=False, help='Search primer slides in small, growing batches and stop at the first batch with a match. Gives the same results with far fewer BLAST queries for targets found near slide 0. Default: False')
+    parser.add_argument("--seed", action='store_true', required=False, help='Search the region covered by all primer slides as a single query per direction, and find the lowest matching slide from the alignments. Uses about 100 times fewer BLAST queries than searching every primer. Default: False')
+    parser.add_argument("--max_primer_hits", type=int, required=False, default=MAX_PRIMER_HITS, help=f'Maximum number of matches kept for the best forward/reverse primer of a target, e.g. for primers in repeated elements. The matches closest to forming an amplicon of the expected length are kept and capped targets are flagged in Message. 0 for no limit. Default: {MAX_PRIMER_HITS}')
+    parser.add_argument("--max_primer_pairs", type=int, required=False, default=MAX_PRIMER_PAIRS, help=f'Maximum number of candidate primer pairs considered for a target. Only the pairs closest to the expected length are kept and the target is flagged in Message. 0 for no limit. Default: {MAX_PRIMER_PAIRS}')
+    parser.add_argument("--prefilter", action='store_true', required=False, help='Skip targets whose primers cannot match the assembly, using a minimizer sketch of the assembly. Default: False')
+    parser.add_argument("--validate_prefilter", action='store_true', required=False, help='Search targets the prefilter would skip anyway and warn about any that had primer matches. Default: False')
+    parser.add_argument("--cache", type=str, required=False, help='Path to a result cache (SQLite). Results for targets already searched in the same assembly with the same settings are reused, so only new or changed targets and assemblies are searched. Default: None')
+    parser.add_argument("-j", "--blast_jobs", type=int, required=False, default=1, help='Number of BLAST primer searches to run at once within an assembly. Searches for later targets run while earlier targets are aligned. Default: 1')
+    parser.add_argument("--engine", type=str, choices=SEARCH_ENGINES, default="blastn", required=False, help='Primer search engine. "blastn" searches with makeblastdb/blastn, "replay" answers searches with the matches recorded in --hits by an earlier blastn run, for regression runs without BLAST. Default: blastn')
+    parser.add_argument("--hits", type=str, required=False, help='Directory of recorded primer searches. With --engine blastn every search is recorded in it, with --engine replay searches are read from it. Default: None')
+    parser.add_argument("--workers", type=int, required=False, default=1, help='Number of assemblies from a list/directory crawled at once in separate processes. The largest assemblies are started first, and assemblies much larger than the rest are split into groups of targets. Results keep the order of the list. Default: 1')
+    parser.add_argument("--batch", type=int, required=False, default=1, help='Number of assemblies from a list/directory packed into one BLAST database and searched together. Saves BLAST startup and database loading for many small (e.g. bacterial) assemblies. Results are the same as crawling each assembly on its own. Default: 1')
+    parser.add_argument("--large", action='store_true', required=False, help='Memory-bounded mode for very large assemblies (e.g. metagenome co-assemblies). Assemblies are searched in chunks of whole contigs and the peak memory use is reported. Default: False')
+    parser.add_argument("--progress", type=str, required=False, help='Write progress events as JSON lines to this file or named pipe (FIFO), e.g. for schedulers. Default: None')
+    parser.add_argument("--prometheus", type=str, required=False, help='Periodically rewrite this Prometheus textfile (node_exporter textfile collector) with throughput, ETA and heartbeat metrics. Default: None')
     parser.add_argument("--overlaps", action='store_true', required=False, help='Search results for overlapping in silico amplicons. Default: False')
     parser.add_argument("--scan_codons", action='store_true', required=False, help='Search for start and stop codons near ends of amplicons. Default: False')
     
     # Output options
-    parser.add_argument("-o", "--output", type=str, required=False, help='Output file/folder. For search this will be a tab-separated values table. For extract, this will be FASTA formatted. Default: stdout')
+    parser.add_argument("-o", "--output", type=str, required=False, help='Output file/folder. For search this will be a tab-separated values table, or a SQLite results store if the file ends in .sqlite/.db. For extract, this will be FASTA formatted. Default: stdout')
+    parser.add_argument("--matrix", type=str, required=False, help='Also write an assembly by gene matrix, one row per assembly, written as each assembly is crawled. Dense TSV (gzip compressed if the file ends in .gz), or sparse MatrixMarket if the file ends in .mtx/.mtx.gz. Default: None')
+    parser.add_argument("--matrix_values", type=str, choices=MATRIX_VALUES, default="valid", required=False, help='Values of the matrix: "valid" for 1 when a gene has a valid amplicon, "identity" for the highest identity of its valid amplicons. Genes without a valid amplicon are 0. Default: valid')
     
+    # Merge options
+    parser.add_argument("--merge", type=str, nargs="+", required=False, help='Merge the outputs (TSV or SQLite) of sharded runs into a single output. If the list/directory used for the shards is also given, the merge checks that every assembly is included exactly once and keeps its order.')
+
+    # Revalidate options
+    parser.add_argument("--revalidate", type=str, required=False, help='Recompute Valid and Message of an existing SPIDER output (TSV or SQLite) with the -lt/--length and -it/--identity limits, without searching again. TSV results are written to -o/--output (default: stdout), SQLite results stores are updated in place.')
+
     # Extract options
     parser.add_argument("-e", "--extract", type=str, required=False, help='Uses SPIDER output file as input to generate a FASTA file with sequences of the desired sequences.')
+    parser.add_argument("--filter", type=str, required=False, help='SQL filter selecting which valid hits to extract from a SQLite results store, e.g. "Name LIKE \'%%ExoU%%\' AND Identity >= 95". Default: None')
     parser.add_argument("--translate", action='store_true', required=False, help='Translate extract to amino acid sequence rather than nucleotides. Assumes that the sequence begins with the start codon. Default: False')
     parser.add_argument("--separate", action='store_true', required=False, help='Separate extracted sequences into separate files for each target. Default: False')
     parser.add_argument("--upstream", type=int, default=0, required=False, help='Number of nucleotides upstream of amplicon to include in extraction. Default: 0')
@@ -60,6 +91,96 @@ def parse_args():
     return parser.parse_args()
 
 
+def print_peak_memory():
+    """
+    Prints the peak memory (maximum resident set size) of SPIDER and of the
+    largest BLAST process it ran.
+    """
+    try:
+        import resource
+    except ImportError:
+        print("Peak memory is not available on this platform.", file=sys.stderr)
+        return
+    # Linux reports kilobytes, macOS reports bytes
+    scale = 1 if sys.platform == "darwin" else 1024
+    spider_peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 1024**2
+    blast_peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale / 1024**2
+    print(f"Peak memory: SPIDER {round(spider_peak, 1)} MB, BLAST {round(blast_peak, 1)} MB", file=sys.stderr)
+
+def revalidate(args):
+    """
+    Recomputes the validity of existing results with new limits.
+
+    Arguments:
+        args -- User provided arguments
+    """
+    from helpers.revalidate import revalidate_tsv, revalidate_results_db
+
+    errors = False
+    if not os.path.exists(args.revalidate):
+        print(f"ERROR: Could not find the results file {args.revalidate}", file=sys.stderr)
+        errors = True
+    if is_results_db(args.revalidate) and args.output:
+        print(f"ERROR: SQLite results stores are revalidated in place, do not specify -o/--output.", file=sys.stderr)
+        errors = True
+    elif args.output and os.path.exists(args.output):
+        if args.overwrite and os.path.isfile(args.output) and os.path.abspath(args.output) != os.path.abspath(args.revalidate):
+            os.remove(args.output)
+        else:
+            print("ERROR: The output location already exists. If you would like to overwrite it, please use the --overwrite argument.", file=sys.stderr)
+            errors = True
+    if errors:
+        sys.exit(1)
+
+    print(f"Revalidating {args.revalidate} with Length Limit: {args.length}% and Identity Limit: {args.identity}%", file=sys.stderr)
+    try:
+        if is_results_db(args.revalidate):
+            rows, valid_rows = revalidate_results_db(args.revalidate, args.length, args.identity)
+        else:
+            rows, valid_rows = revalidate_tsv(args.revalidate, args.output, args.length, args.identity)
+    except (KeyError, ValueError, sqlite3.Error) as error:
+        print(f"ERROR: Could not revalidate {args.revalidate}, check that it is a SPIDER output. ({error})", file=sys.stderr)
+        sys.exit(1)
+    print(f"{valid_rows} of {rows} results are valid.", file=sys.stderr)
+
+def merge_shards(args):
+    """
+    Merges the outputs of sharded runs.
+
+    Arguments:
+        args -- User provided arguments
+    """
+    errors = False
+    for shard_output in args.merge:
+        if not os.path.exists(shard_output):
+            print(f"ERROR: Could not find the shard output {shard_output}", file=sys.stderr)
+            errors = True
+    if args.list and args.directory:
+        print(f"ERROR: Please provide either the list (-l) or the directory (-d) the shards were made from, not both.", file=sys.stderr)
+        errors = True
+    if args.output and os.path.exists(args.output):
+        if args.overwrite and os.path.isfile(args.output):
+            os.remove(args.output)
+        else:
+            print("ERROR: The output location already exists. If you would like to overwrite it, please use the --overwrite argument.", file=sys.stderr)
+            errors = True
+    if errors:
+        sys.exit(1)
+
+    # Assemblies the shards were made from, used to check coverage and order
+    expected = None
+    if args.list:
+        expected = parse_list(args.list)
+    elif args.directory:
+        expected = parse_directory(args.directory)
+
+    try:
+        count = merge_results(args.merge, args.output, expected)
+    except (ValueError, sqlite3.Error) as error:
+        print(f"ERROR: Could not merge the shard outputs.\n{error}", file=sys.stderr)
+        sys.exit(1)
+    print(f"Merged {count} assemblies from {len(args.merge)} shard outputs.", file=sys.stderr)
+
 def main():
     """
     Run SPIDER program.
@@ -71,6 +192,12 @@ def main():
     ## Print available databases
     if args.list_dbs:
         print(list_databases())
+    ## Merge outputs of sharded runs
+    elif args.merge:
+        merge_shards(args)
+    ## Recompute validity of existing results
+    elif args.revalidate:
+        revalidate(args)
     ## Run SPIDER crawler
     elif args.fasta or args.list or args.directory:
         # Check that only one input format was provided
@@ -94,10 +221,27 @@ def main():
         if not args.database:
             print(f"ERROR: You must provide a reference database. This can be in FASTA (or gzipped FASTA) format. For a list of special databases you can choose from, use the --list_dbs command.",  file=sys.stderr)
             input_errors += 1
-        ## Check that the database exists
-        elif not args.database in DATABASE_DESCRIPTIONS.keys():
-            if not os.path.exists(args.database):
-                print(f"ERROR: The database {args.database} could not be found. Please check that this file exists.", file=sys.stderr)
+        else:
+            ## Check that the databases exist
+            for database in args.database:
+                if not database in DATABASE_DESCRIPTIONS.keys() and not os.path.exists(database):
+                    print(f"ERROR: The database {database} could not be found. Please check that this file exists.", file=sys.stderr)
+                    input_errors += 1
+            ## Check that the databases are not repeated
+            if len(set(args.database)) < len(args.database):
+                print(f"ERROR: The same database was provided more than once.", file=sys.stderr)
+                input_errors += 1
+            ## Search terms must be given once, or once per database
+            if args.search and len(args.search) not in (1, len(args.database)):
+                print(f"ERROR: {len(args.search)} search terms were provided for {len(args.database)} databases. Provide a single search term, or one per database.", file=sys.stderr)
+                input_errors += 1
+        ## Search terms must be valid queries
+        for search_term in args.search or []:
+            try:
+                parse_query(search_term)
+            except ValueError as error:
+                print(f"ERROR: Invalid search term: {error}.", file=sys.stderr)
+                input_errors += 1
 
         ## FASTA specified, but could not locate
         if args.fasta:
@@ -124,43 +268,233 @@ def main():
             if not os.path.exists(args.annotation):
                 print(f"ERROR: Could not find the annotation file {args.annotation}, check that this file exists.", file=sys.stderr)
                 input_errors += 1
+        ## Shards can only be made from multiple assemblies
+        if args.shard:
+            if not (args.list or args.directory):
+                print(f"ERROR: --shard can only be used with a list (-l) or directory (-d) of assemblies.", file=sys.stderr)
+                input_errors += 1
+            try:
+                shard_index, shard_count = parse_shard(args.shard)
+            except ValueError as error:
+                print(f"ERROR: Invalid shard {args.shard}: {error}.", file=sys.stderr)
+                input_errors += 1
+        ## Watch mode polls a directory
+        if args.watch:
+            if not args.directory:
+                print(f"ERROR: --watch can only be used with a directory (-d) of assemblies.", file=sys.stderr)
+                input_errors += 1
+            if args.shard:
+                print(f"ERROR: --watch cannot be used with --shard.", file=sys.stderr)
+                input_errors += 1
+        ## The prefilter sketch holds the whole assembly in memory
+        if args.large and (args.prefilter or args.validate_prefilter):
+            print(f"ERROR: --prefilter and --validate_prefilter cannot be used with --large.", file=sys.stderr)
+            input_errors += 1
+        ## Only one slide search can be used
+        if args.adaptive and args.seed:
+            print(f"ERROR: --adaptive and --seed cannot be used together.", file=sys.stderr)
+            input_errors += 1
+        ## Batches of assemblies are searched with the full primer sets of one database
+        if args.batch < 1:
+            print(f"ERROR: The batch size must be at least 1.", file=sys.stderr)
+            input_errors += 1
+        elif args.batch > 1:
+            if not (args.list or args.directory) or args.watch:
+                print(f"ERROR: --batch can only be used with a list (-l) or directory (-d) of assemblies, without --watch.", file=sys.stderr)
+                input_errors += 1
+            if args.adaptive or args.prefilter or args.validate_prefilter or args.large:
+                print(f"ERROR: --batch cannot be used with --adaptive, --prefilter, --validate_prefilter or --large.", file=sys.stderr)
+                input_errors += 1
+        ## A parameter sweep searches each primer size once for every slide limit
+        if len(set(args.slide_limit)) < len(args.slide_limit) or len(set(args.primer_size)) < len(args.primer_size):
+            print(f"ERROR: The same slide limit or primer size was provided more than once.", file=sys.stderr)
+            input_errors += 1
+        if len(args.slide_limit) > 1 or len(args.primer_size) > 1:
+            if args.prefilter or args.validate_prefilter or args.batch > 1:
+                print(f"ERROR: Several slide limits or primer sizes cannot be used with --prefilter, --validate_prefilter or --batch.", file=sys.stderr)
+                input_errors += 1
+        ## Matrix rows are written once, when an assembly is crawled
+        if args.matrix:
+            if args.watch:
+                print(f"ERROR: --matrix cannot be used with --watch.", file=sys.stderr)
+                input_errors += 1
+            if len(args.slide_limit) > 1 or len(args.primer_size) > 1:
+                print(f"ERROR: --matrix cannot be used with several slide limits or primer sizes.", file=sys.stderr)
+                input_errors += 1
+        ## Replayed searches must have been recorded
+        if args.engine == "replay":
+            if not args.hits:
+                print(f"ERROR: --engine replay needs the directory of recorded searches given with --hits.", file=sys.stderr)
+                input_errors += 1
+            elif not os.path.isdir(args.hits):
+                print(f"ERROR: Could not find the directory of recorded searches {args.hits}.", file=sys.stderr)
+                input_errors += 1
+        ## Workers crawl assemblies of a list or directory
+        if args.workers < 1:
+            print(f"ERROR: The number of workers must be at least 1.", file=sys.stderr)
+            input_errors += 1
+        elif args.workers > 1:
+            if not (args.list or args.directory) or args.watch:
+                print(f"ERROR: --workers can only be used with a list (-l) or directory (-d) of assemblies, without --watch.", file=sys.stderr)
+                input_errors += 1
+            if args.batch > 1:
+                print(f"ERROR: --workers cannot be used with --batch.", file=sys.stderr)
+                input_errors += 1
+        ## Caps cannot be negative
+        if args.max_primer_hits < 0 or args.max_primer_pairs < 0:
+            print(f"ERROR: --max_primer_hits and --max_primer_pairs must be at least 0 (0 for no limit).", file=sys.stderr)
+            input_errors += 1
+        ## Number of BLAST jobs must be positive
+        if args.blast_jobs < 1:
+            print(f"ERROR: The number of BLAST jobs must be at least 1.", file=sys.stderr)
+            input_errors += 1
         # If input errors exist, end the program.
         if input_errors > 0:
             sys.exit(1)
 
-        # Set the database for the run, and download if needed
-        if args.database in DATABASE_DESCRIPTIONS.keys():
-            database_loc = get_database(args.database)
-        else:
-            database_loc = args.database
+        # Load the crawler only once the inputs are known to be valid
+        from helpers.crawler import crawl, crawl_batch, concat_results
+        from helpers import telemetry
+        from helpers.result_cache import assembly_hash
+        from helpers.engines import make_engine
+        import pandas as pd
 
-        # Prepare the reference database
-        search_term = None
-        if args.search:
-            search_term = args.search
-        count, temp_crawl_db = prepare_db(database_loc, search_term)
+        # Prepare each reference database
+        temp_crawl_dbs = []
+        count = 0
+        for i, database in enumerate(args.database):
+            # Set the database for the run, and download if needed
+            if database in DATABASE_DESCRIPTIONS.keys():
+                database_loc = get_database(database)
+            else:
+                database_loc = database
 
-        # Check that the database is not empty
-        if count == 0:
+            # A single search term is used for every database
+            search_term = None
             if args.search:
-                print(f"ERROR: No sequences for {args.search} were found in {args.database}.", file=sys.stderr)
-            else:
-                print(f"ERROR: The database {args.database} was empty.", file=sys.stderr)
-            os.remove(temp_crawl_db)
-            sys.exit(1)
+                search_term = args.search[0] if len(args.search) == 1 else args.search[i]
+            database_count, temp_crawl_db = prepare_db(database_loc, search_term)
+            temp_crawl_dbs.append(temp_crawl_db)
+            count += database_count
+
+            # Check that the database is not empty
+            if database_count == 0:
+                if search_term:
+                    print(f"ERROR: No sequences for {search_term} were found in {database}.", file=sys.stderr)
+                else:
+                    print(f"ERROR: The database {database} was empty.", file=sys.stderr)
+                for temp_crawl_db in temp_crawl_dbs:
+                    os.remove(temp_crawl_db)
+                sys.exit(1)
+        # Several databases are crawled together, sharing the setup of each assembly
+        if len(temp_crawl_dbs) == 1:
+            temp_crawl_db = temp_crawl_dbs[0]
+            database_names = None
+        else:
+            temp_crawl_db = temp_crawl_dbs
+            database_names = [database if database in DATABASE_DESCRIPTIONS.keys() else os.path.basename(database) for database in args.database]
+            # Keep the paths if file names are not unique
+            if len(set(database_names)) < len(database_names):
+                database_names = list(args.database)
+
+        # Several settings are crawled together as a parameter sweep, sharing the search of each primer size
+        if len(args.slide_limit) == 1 and len(args.primer_size) == 1:
+            slide_limit = args.slide_limit[0]
+            primer_size = args.primer_size[0]
+        else:
+            slide_limit = args.slide_limit
+            primer_size = args.primer_size
 
         # Track run time
         start_time = time.time()
         
         # Run the crawler
         print(f"Beginning to crawl using the following settings:", file=sys.stderr)
-        print(f"Primer Size: {args.primer_size}bp", file=sys.stderr)
-        print(f"Slide Limit: {args.slide_limit}%", file=sys.stderr)
+        print(f"Primer Size: {', '.join(f'{size}bp' for size in args.primer_size)}", file=sys.stderr)
+        print(f"Slide Limit: {', '.join(f'{limit}%' for limit in args.slide_limit)}", file=sys.stderr)
         print(f"Length Limit: {args.length}%", file=sys.stderr)
         print(f"Identity Limit: {args.identity}%", file=sys.stderr)
+        if args.adaptive:
+            print(f"Slide Search: adaptive", file=sys.stderr)
+        elif args.seed:
+            print(f"Slide Search: seed region", file=sys.stderr)
+        if args.blast_jobs > 1:
+            print(f"BLAST Jobs: {args.blast_jobs}", file=sys.stderr)
+        if args.batch > 1:
+            print(f"Assemblies per BLAST database: {args.batch}", file=sys.stderr)
+        if args.workers > 1:
+            print(f"Workers: {args.workers}", file=sys.stderr)
+        if args.engine != "blastn":
+            print(f"Search Engine: {args.engine} ({args.hits})", file=sys.stderr)
+        if database_names:
+            print(f"Databases: {', '.join(database_names)}", file=sys.stderr)
+        # Optional crawl features
+        crawl_options = {
+            "adaptive": args.adaptive,
+            "seed": args.seed,
+            "prefilter": args.prefilter,
+            "validate_prefilter": args.validate_prefilter,
+            "cache_loc": args.cache,
+            "blast_jobs": args.blast_jobs,
+            "large": args.large,
+            "database_names": database_names,
+            "max_primer_hits": args.max_primer_hits,
+            "max_primer_pairs": args.max_primer_pairs,
+            "engine": make_engine(args.engine, args.hits)
+        }
+        # Results stores are written per assembly as the crawl progresses
+        results_db = None
+        if is_results_db(args.output):
+            from helpers.results_db import open_results_db, write_results
+            results_db = open_results_db(args.output)
+        # Matrix rows are written per assembly as well, with a column for every target
+        matrix = None
+        if args.matrix:
+            from helpers.crawler import load_targets
+            from helpers.matrix import matrix_columns, open_matrix, add_matrix_row, close_matrix
+            matrix = open_matrix(args.matrix, *matrix_columns(*load_targets(temp_crawl_db), database_names), args.matrix_values)
+
         ## Individual assembly
         if args.fasta:
-            results = crawl(args.fasta, temp_crawl_db, args.slide_limit, args.length, args.identity, args.primer_size, args.overlaps, args.scan_codons, args.annotation)
+            telemetry.start_progress(1, args.progress, args.prometheus)
+            telemetry.start_assembly(args.fasta)
+            results = crawl(args.fasta, temp_crawl_db, slide_limit, args.length, args.identity, primer_size, args.overlaps, args.scan_codons, args.annotation, **crawl_options)
+            if results_db:
+                write_results(results_db, results)
+            if matrix:
+                add_matrix_row(matrix, results)
+            telemetry.complete_assembly(args.fasta, count)
+        ## Watch a directory for new assemblies
+        elif args.watch:
+            from helpers.watch import completed_assemblies, watch_directory, append_results
+            header, completed = completed_assemblies(args.output)
+            if completed:
+                print(f"Skipping {len(completed)} assemblies already in {args.output}.", file=sys.stderr)
+            print(f"Watching {args.directory} for new assemblies. Stop with Ctrl+C.", file=sys.stderr)
+            telemetry.start_progress(0, args.progress, args.prometheus)
+            # Schedulers stop jobs with SIGTERM, which ends the watch like Ctrl+C
+            signal.signal(signal.SIGTERM, signal.default_int_handler)
+            crawled = 0
+            try:
+                for assembly in watch_directory(args.directory, completed):
+                    telemetry.add_assemblies()
+                    telemetry.start_assembly(assembly)
+                    assembly_results = crawl(assembly, temp_crawl_db, slide_limit, args.length, args.identity, primer_size, args.overlaps, args.scan_codons, args.annotation, **crawl_options)
+                    if results_db:
+                        write_results(results_db, assembly_results)
+                    else:
+                        try:
+                            header = append_results(args.output, assembly_results, header)
+                        except ValueError as error:
+                            print(f"ERROR: {error}", file=sys.stderr)
+                            for temp_crawl_db in temp_crawl_dbs:
+                                os.remove(temp_crawl_db)
+                            sys.exit(1)
+                    crawled += 1
+                    telemetry.complete_assembly(assembly, count)
+                    print(f"Completed {assembly} ({crawled} crawled while watching)", file=sys.stderr)
+            except KeyboardInterrupt:
+                print(f"Stopped watching {args.directory} after crawling {crawled} assemblies.", file=sys.stderr)
         ## List of assemblies
         elif args.list or args.directory:
             # Parse list of assemblies
@@ -174,30 +508,101 @@ def main():
             elif args.directory:
                 fasta_list = parse_directory(args.directory)
                 if len(fasta_list) == 0:
-                    print(f"ERROR: The directory {args.directory} did not contain any fasta files. Check that files exist that end in .fasta or .fna.", file=sys.stderr)
+                    print(f"ERROR: The directory {args.directory} did not contain any fasta files. Check that files exist that end in {', '.join(FASTA_EXTENSIONS)}.", file=sys.stderr)
                     sys.exit(1)
 
+            # Keep only the assemblies of this shard
+            if args.shard:
+                total_assemblies = len(fasta_list)
+                fasta_list = select_shard(fasta_list, shard_index, shard_count)
+                print(f"Shard {shard_index} of {shard_count}: {len(fasta_list)} of {total_assemblies} assemblies.", file=sys.stderr)
+
             # Print number of samples identified
             print(f"Identified {len(fasta_list)} assemblies to crawl.", file=sys.stderr)
+            telemetry.start_progress(len(fasta_list), args.progress, args.prometheus, args.shard)
             # Run crawler
             all_results = []
-            count = 0
-            for assembly in fasta_list:
-                all_results.append(crawl(assembly, temp_crawl_db, args.slide_limit, args.length, args.identity, args.primer_size, args.overlaps, args.scan_codons, args.annotation))
-                count +=1 
-                print(f"Completed {count} of {len(fasta_list)} ({round(count/len(fasta_list)*100, 2)}%)", file=sys.stderr)
-            results = pd.concat(all_results, ignore_index=True)
+            # Results of each assembly by content hash, so duplicate assemblies are crawled once
+            crawled_assemblies = {}
+            # Number of assemblies completed
+            completed = 0
+            # Workers crawl the first copy of every assembly in the background
+            if args.workers > 1:
+                from helpers.scheduler import crawl_scheduled, possible_copies
+                # Only assemblies that may be copies of another one are hashed here, so the
+                # workers start right away. The others are hashed by the workers if needed.
+                copies = possible_copies(fasta_list)
+                content_hashes = [assembly_hash(assembly) if assembly in copies else None for assembly in fasta_list]
+                # Assemblies that were not hashed are told apart by their path
+                assembly_digests = [content_hash or os.path.abspath(assembly) for assembly, content_hash in zip(fasta_list, content_hashes)]
+                first_copies = {}
+                for assembly, assembly_digest, content_hash in zip(fasta_list, assembly_digests, content_hashes):
+                    first_copies.setdefault(assembly_digest, (assembly, content_hash))
+                scheduled_results = crawl_scheduled([assembly for assembly, _ in first_copies.values()], temp_crawl_db, slide_limit, args.length, args.identity, primer_size, args.overlaps, args.scan_codons, args.annotation, workers=args.workers, assembly_digests=[content_hash for _, content_hash in first_copies.values()], **crawl_options)
+            for batch_start in range(0, len(fasta_list), args.batch):
+                batch = fasta_list[batch_start:batch_start + args.batch]
+                telemetry.start_assembly(batch[0])
+                if args.workers > 1:
+                    batch_digests = assembly_digests[batch_start:batch_start + args.batch]
+                else:
+                    batch_digests = [assembly_hash(assembly) for assembly in batch]
+                # Position in the batch of the first copy of each assembly not crawled yet, by content hash
+                new_assemblies = {}
+                for i, assembly_digest in enumerate(batch_digests):
+                    if assembly_digest not in crawled_assemblies and assembly_digest not in new_assemblies:
+                        new_assemblies[assembly_digest] = i
+                if len(new_assemblies) > 1:
+                    batch_results = crawl_batch([batch[i] for i in new_assemblies.values()], temp_crawl_db, slide_limit, args.length, args.identity, primer_size, args.overlaps, args.scan_codons, args.annotation, assembly_digests=list(new_assemblies), **crawl_options)
+                elif args.workers > 1:
+                    # Scheduled results come in the order of the list
+                    batch_results = [next(scheduled_results) for _ in new_assemblies]
+                else:
+                    batch_results = [crawl(batch[i], temp_crawl_db, slide_limit, args.length, args.identity, primer_size, args.overlaps, args.scan_codons, args.annotation, assembly_digest=assembly_digest, **crawl_options) for assembly_digest, i in new_assemblies.items()]
+                crawled_assemblies.update(zip(new_assemblies, batch_results))
+                for i, (assembly, assembly_digest) in enumerate(zip(batch, batch_digests)):
+                    telemetry.start_assembly(assembly)
+                    if new_assemblies.get(assembly_digest) == i:
+                        assembly_results = crawled_assemblies[assembly_digest]
+                    else:
+                        print(f"{assembly} is identical to {crawled_assemblies[assembly_digest]['Query'].iloc[0]}, reusing its results.", file=sys.stderr)
+                        assembly_results = crawled_assemblies[assembly_digest].copy()
+                        assembly_results["Query"] = pd.Categorical([assembly] * len(assembly_results), categories=[assembly])
+                    if results_db:
+                        write_results(results_db, assembly_results)
+                    else:
+                        all_results.append(assembly_results)
+                    if matrix:
+                        add_matrix_row(matrix, assembly_results)
+                    completed +=1 
+                    telemetry.complete_assembly(assembly, count)
+                    print(f"Completed {completed} of {len(fasta_list)} ({round(completed/len(fasta_list)*100, 2)}%)", file=sys.stderr)
+            if not results_db:
+                # A shard can be empty when there are more shards than assemblies
+                results = concat_results(all_results)
+
+        telemetry.finish_progress()
+        if matrix:
+            close_matrix(matrix)
+        if telemetry.COUNTERS["primer_hits_capped"] or telemetry.COUNTERS["primer_pairs_capped"]:
+            print(f"WARNING: Primer matches were capped in {telemetry.COUNTERS['primer_hits_capped']} target searches and candidate pairs in {telemetry.COUNTERS['primer_pairs_capped']}. These targets are flagged in Message.", file=sys.stderr)
 
         # Output results
+        ## Results store was written during the crawl
+        if results_db:
+            results_db.close()
+        ## Watched assemblies were written as they were crawled
+        elif args.watch:
+            pass
         ## If no file selected, print to stdout
-        if not args.output:
-            print(results.to_csv(sep="\t", index=None))
+        elif not args.output:
+            print(results.to_csv(sep="\t", index=None, na_rep="NA"))
         ## Print to output file
         else:
-            results.to_csv(args.output, sep="\t", index=None)
+            results.to_csv(args.output, sep="\t", index=None, na_rep="NA")
         
         # Remove DB coby
-        os.remove(temp_crawl_db)
+        for temp_crawl_db in temp_crawl_dbs:
+            os.remove(temp_crawl_db)
         
         # Print complete message
         end_time = time.time()
@@ -205,6 +610,8 @@ def main():
             print(f"SPIDER has finished running in {round(end_time - start_time, 2)} seconds.", file=sys.stderr)
         else:
             print(f"SPIDER has finished running in {round((end_time - start_time)/60, 2)} minutes.", file=sys.stderr)
+        if args.large:
+            print_peak_memory()
 
     # Run SPIDER extract
     if args.extract:
@@ -227,6 +634,10 @@ def main():
                 else:
                     print("ERROR: The output location already exists. If you would like to overwrite it, please use the --overwrite argument.", file=sys.stderr)
                     error = True
+        # Filters are applied by the SQLite results store
+        if args.filter and not is_results_db(args.extract):
+            print("ERROR: --filter can only be used when extracting from a SQLite results store (.sqlite/.db).", file=sys.stderr)
+            error = True
         # Check if upstream and downstream are valid
         if args.upstream < 0:
             print("ERROR: The number of upstream bases to extract must be an integer >= 0", file=sys.stderr)
@@ -239,7 +650,8 @@ def main():
         if error: sys.exit(1)
 
         # Extract sequences
-        obtained_seqs = extract_sequences(args.extract, args.translate, args.output, args.separate, args.upstream, args.downstream)
+        from helpers.fasta_extract import extract_sequences
+        obtained_seqs = extract_sequences(args.extract, args.translate, args.output, args.separate, args.upstream, args.downstream, args.filter)
 
         # Print success message
         if obtained_seqs:
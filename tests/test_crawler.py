@@ -0,0 +1,75 @@
+"""
+Tests of the capped primer pairing in the crawler against brute force over
+every forward x reverse pair.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+from helpers.crawler import nearest_matches, nearest_primer_pairs
+
+def random_matches(rng, count):
+    """
+    Returns random primer matches on a few contigs and both strands, with
+    repeated positions so that distances tie.
+    """
+    starts = rng.integers(1, 400, size=count)
+    strands = rng.choice(["+", "-"], size=count)
+    return pd.DataFrame({
+        "sseqid": rng.choice(["contig_0", "contig_1", "contig_2"], size=count),
+        "sstart": starts,
+        "send": np.where(strands == "+", starts + 19, starts - 19),
+        "strand": strands,
+    })
+
+def all_pairs(forward_matches, reverse_matches, expected_target_length):
+    """
+    Returns every correctly ordered pair with its distance from the expected
+    length, as sort_primer_pairs builds them without a cap.
+    """
+    pairs = pd.merge(forward_matches.assign(index=forward_matches.index), reverse_matches.assign(index=reverse_matches.index),
+                     on=["sseqid", "strand"], suffixes=("_f", "_r"))
+    pairs = pairs[((pairs["strand"] == "+") & (pairs["sstart_f"] < pairs["send_r"])) |
+                  ((pairs["strand"] == "-") & (pairs["send_r"] < pairs["sstart_f"]))]
+    return pairs.assign(distance=abs(abs(pairs["sstart_f"] - pairs["send_r"]) - expected_target_length))
+
+@pytest.mark.parametrize("case", range(200))
+def test_nearest_primer_pairs_match_brute_force(case):
+    rng = np.random.default_rng(case)
+    forward_matches = random_matches(rng, int(rng.integers(1, 30)))
+    reverse_matches = random_matches(rng, int(rng.integers(1, 30)))
+    expected_target_length = int(rng.integers(10, 200))
+    pairs = all_pairs(forward_matches, reverse_matches, expected_target_length)
+    max_pairs = int(rng.integers(1, len(pairs) + 2))
+    nearest = nearest_primer_pairs(forward_matches.assign(index=forward_matches.index), reverse_matches.assign(index=reverse_matches.index),
+                                   expected_target_length, max_pairs)
+    # The closest pairs, each once; pairs at the same distance may come in any order
+    assert nearest["distance"].tolist() == sorted(pairs["distance"])[:max_pairs]
+    found = set(zip(nearest["index_f"], nearest["index_r"], nearest["distance"]))
+    assert len(found) == len(nearest)
+    assert found <= set(zip(pairs["index_f"], pairs["index_r"], pairs["distance"]))
+
+@pytest.mark.parametrize("case", range(200))
+@pytest.mark.parametrize("direction", ["forward", "reverse"])
+def test_nearest_matches_match_brute_force(case, direction):
+    rng = np.random.default_rng(case)
+    matches = random_matches(rng, int(rng.integers(2, 40)))
+    partners = random_matches(rng, int(rng.integers(1, 30)))
+    expected_target_length = int(rng.integers(10, 200))
+    max_hits = int(rng.integers(1, len(matches)))
+    if direction == "forward":
+        pairs = all_pairs(matches, partners, expected_target_length)
+        distances = pairs.groupby("index_f")["distance"].min()
+    else:
+        pairs = all_pairs(partners, matches, expected_target_length)
+        distances = pairs.groupby("index_r")["distance"].min()
+    # Matches without a correctly placed partner are ranked last, ties keep BLAST order
+    ranks = distances.reindex(range(len(matches)), fill_value=np.inf).to_numpy(dtype=float)
+    kept = np.sort(np.argsort(ranks, kind="stable")[:max_hits])
+    nearest = nearest_matches(matches, partners, direction, expected_target_length, max_hits)
+    pd.testing.assert_frame_equal(nearest, matches.iloc[kept].reset_index(drop=True))
+
+def test_nearest_matches_not_capped():
+    rng = np.random.default_rng(0)
+    matches = random_matches(rng, 5)
+    assert nearest_matches(matches, random_matches(rng, 5), "forward", 100, 5) is matches
+    assert nearest_matches(None, matches, "reverse", 100, 5) is None
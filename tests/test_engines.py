@@ -0,0 +1,177 @@
+"""
+Tests of the primer search engines. The replay tests crawl the corpus in
+tests/data/engines and compare the results with the crawl output recorded
+with its searches. Regenerate the corpus with
+`python benchmarks/engine_conformance.py --record tests/data/engines`.
+"""
+import os
+import shutil
+import pytest
+from helpers import telemetry
+from helpers.crawler import concat_results, crawl, crawl_batch
+from helpers.engines import BlastnEngine, PrimerSearch, SearchEngine, make_engine
+from helpers.settings import BLAST_COLUMNS_FMT_6, BLAST_DEFAULT_EVALUE, CAPPED_MESSAGE
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "engines")
+HITS_DIR = os.path.join(DATA_DIR, "hits")
+# Crawls recorded in the corpus, as (assemblies, database, slide limit, crawl keyword arguments)
+MODES = {
+    "default": (("assembly_0.fasta",), "targets.fasta", 5, {}),
+    "adaptive": (("assembly_0.fasta",), "targets.fasta", 5, {"adaptive": True}),
+    "seed": (("assembly_0.fasta",), "targets.fasta", 5, {"seed": True}),
+    # Slides longer than the short targets, so seed regions are cut to the reference
+    "clamped": (("assembly_1.fasta",), "short_targets.fasta", 50, {}),
+    "seed_clamped": (("assembly_1.fasta",), "short_targets.fasta", 50, {"seed": True}),
+    # Primers matching more subjects than BLAST reports, searched one assembly at a time and as a batch
+    "repeats": (("assembly_2.fasta", "assembly_1.fasta"), "short_targets.fasta", 5, {}),
+    "seed_repeats": (("assembly_2.fasta", "assembly_1.fasta"), "short_targets.fasta", 5, {"seed": True}),
+    # More primer matches and candidate pairs than the caps allow
+    "capped": (("assembly_3.fasta",), "short_targets.fasta", 5, {"max_primer_hits": 50, "max_primer_pairs": 20}),
+}
+# Modes whose assemblies were also searched as a single batch
+BATCH_MODES = ("repeats", "seed_repeats")
+
+def expected_output(mode):
+    """
+    Returns the recorded crawl output of a mode.
+    """
+    with open(os.path.join(DATA_DIR, f"expected_{mode}.tsv")) as handle:
+        return handle.read()
+
+def recordings():
+    """
+    Returns the locations of the recorded searches of the corpus.
+    """
+    return sorted(os.path.join(folder, name) for folder, _, names in os.walk(HITS_DIR) for name in names)
+
+def primer_search(directory, **settings):
+    """
+    Returns a PrimerSearch of a small query and database written to a directory.
+    """
+    query = os.path.join(directory, "primers.fasta")
+    database = os.path.join(directory, "reference.fasta")
+    with open(query, "w") as handle:
+        handle.write(">forward_0\nACGTACGTACGTACGTACGT\n>reverse_0\nTTGCATTGCATTGCATTGCA\n")
+    with open(database, "w") as handle:
+        handle.write(">contig_0\nACGTACGTACGTACGTACGTGGGGGGGGTGCAATGCAATGCAATGCAA\n")
+    fields = {"word_size": 20, "extra_columns": (), "evalue": BLAST_DEFAULT_EVALUE, "max_target_seqs": None, "dbsize": None}
+    fields.update(settings)
+    return PrimerSearch(query, database, os.path.join(directory, "forward.blast.txt"), **fields)
+
+@pytest.fixture
+def corpus(tmp_path, monkeypatch):
+    """
+    Copies the assembly and database of the corpus to a temporary directory,
+    where crawl writes its folders.
+    """
+    for name in os.listdir(DATA_DIR):
+        if name.endswith(".fasta"):
+            shutil.copy(os.path.join(DATA_DIR, name), tmp_path)
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+@pytest.mark.parametrize("mode", sorted(MODES))
+def test_replay_crawl_matches_expected_output(corpus, mode):
+    fastas, database, slide_limit, options = MODES[mode]
+    results = concat_results([crawl(fasta, database, slide_limit, 20, 0, 20, True, True, None,
+                                    engine=make_engine("replay", HITS_DIR), **options) for fasta in fastas])
+    assert results.to_csv(sep="\t", index=None, na_rep="NA") == expected_output(mode)
+
+@pytest.mark.parametrize("mode", BATCH_MODES)
+def test_batch_matches_single_assemblies(corpus, mode):
+    # The first assembly fills the subjects of the batch search of short0, and
+    # reports more subjects than a search of it alone for short1
+    fastas, database, slide_limit, options = MODES[mode]
+    results = concat_results(crawl_batch(list(fastas), database, slide_limit, 20, 0, 20, True, True, None,
+                                         engine=make_engine("replay", HITS_DIR), **options))
+    assert results.to_csv(sep="\t", index=None, na_rep="NA") == expected_output(mode)
+
+def test_capped_crawl_keeps_complete_copy(corpus, monkeypatch):
+    monkeypatch.setattr(telemetry, "COUNTERS", dict.fromkeys(telemetry.COUNTERS, 0))
+    fastas, database, slide_limit, options = MODES["capped"]
+    results = crawl(fastas[0], database, slide_limit, 20, 0, 20, True, True, None,
+                    engine=make_engine("replay", HITS_DIR), **options)
+    # 121 forward matches of short2, of which only the last forms an amplicon
+    short2 = results[results["Name"].str.startswith("short2")]
+    assert short2[["Valid", "Start", "End", "Message"]].values.tolist() == [[True, 3801, 3836, CAPPED_MESSAGE]]
+    assert not results[~results["Name"].str.startswith("short2")]["Message"].str.contains(CAPPED_MESSAGE).any()
+    assert telemetry.COUNTERS["primer_hits_capped"] == 1
+    assert telemetry.COUNTERS["primer_pairs_capped"] == 1
+    assert telemetry.COUNTERS["targets_searched"] == 3
+
+@pytest.mark.parametrize("seed_mode, mode", [("seed", "default"), ("seed_clamped", "clamped")])
+def test_seed_matches_primer_search(seed_mode, mode):
+    assert expected_output(seed_mode) == expected_output(mode)
+
+def test_recordings_are_blast_tabular():
+    for recording in recordings():
+        with open(recording) as handle:
+            rows = [line.rstrip("\n").split("\t") for line in handle]
+        # Every row has the outfmt 6 columns, plus the same extra columns
+        assert {len(row) for row in rows} <= {len(BLAST_COLUMNS_FMT_6), len(BLAST_COLUMNS_FMT_6) + 2}
+        assert len({len(row) for row in rows}) <= 1
+        # BLAST order: the rows of each query are together
+        queries = [row[0] for i, row in enumerate(rows) if i == 0 or rows[i - 1][0] != row[0]]
+        assert len(queries) == len(set(queries))
+
+def test_replay_keeps_row_order(tmp_path):
+    search = primer_search(tmp_path)
+    engine = make_engine("replay", str(tmp_path / "hits"))
+    engine.prepare_assembly(search.database)
+    recording = engine.recording_loc(search)
+    os.makedirs(os.path.dirname(recording))
+    # Rows of a query in score order, not in subject or position order
+    lines = ("forward_0\tcontig_1\t100.000\t20\t0\t0\t1\t20\t900\t881\t1e-05\t40.1\n"
+             "forward_0\tcontig_0\t95.000\t20\t1\t0\t1\t20\t1\t20\t0.002\t32.2\n"
+             "reverse_0\tcontig_0\t100.000\t20\t0\t0\t1\t20\t49\t30\t1e-05\t40.1\n")
+    with open(recording, "w") as handle:
+        handle.write(lines)
+    engine.search(search)
+    with open(search.output) as handle:
+        assert handle.read() == lines
+
+def test_replay_without_recording_exits(tmp_path):
+    search = primer_search(tmp_path)
+    engine = make_engine("replay", str(tmp_path / "hits"))
+    engine.prepare_assembly(search.database)
+    with pytest.raises(SystemExit):
+        engine.search(search)
+
+def test_engine_without_search_fails_on_construction():
+    class IncompleteEngine(SearchEngine):
+        name = "incomplete"
+
+    with pytest.raises(TypeError):
+        IncompleteEngine()
+
+def test_blastn_command_extra_columns(tmp_path):
+    engine = BlastnEngine()
+    command = engine.command(primer_search(tmp_path))
+    assert command[command.index("-outfmt") + 1] == "6"
+    command = engine.command(primer_search(tmp_path, extra_columns=("qseq", "sseq")))
+    assert command[command.index("-outfmt") + 1] == "6 " + " ".join(BLAST_COLUMNS_FMT_6 + ("qseq", "sseq"))
+
+def test_blastn_command_passes_settings(tmp_path):
+    engine = BlastnEngine()
+    command = engine.command(primer_search(tmp_path))
+    for option in ("-evalue", "-dbsize", "-max_target_seqs"):
+        assert option not in command
+    command = engine.command(primer_search(tmp_path, evalue=0.001, dbsize=5000000, max_target_seqs=500))
+    assert command[command.index("-evalue") + 1] == "0.001"
+    assert command[command.index("-dbsize") + 1] == "5000000"
+    assert command[command.index("-max_target_seqs") + 1] == "500"
+    assert command[command.index("-word_size") + 1] == "20"
+
+@pytest.mark.parametrize("setting", [
+    {"evalue": 0.001},
+    {"dbsize": 5000000},
+    {"max_target_seqs": 500},
+    {"extra_columns": ("qseq", "sseq")},
+    {"word_size": 19},
+])
+def test_recordings_depend_on_settings(tmp_path, setting):
+    engine = make_engine("replay", str(tmp_path / "hits"))
+    search = primer_search(tmp_path)
+    engine.prepare_assembly(search.database)
+    assert engine.recording_loc(search) == engine.recording_loc(primer_search(tmp_path))
+    assert engine.recording_loc(search) != engine.recording_loc(primer_search(tmp_path, **setting))
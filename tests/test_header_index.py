@@ -0,0 +1,130 @@
+"""
+Tests of the header index searched with -s/--search: the query language, and
+that plain terms select the same records as the substring scan it replaced.
+"""
+import random
+import sqlite3
+import pytest
+from helpers import header_index
+from helpers.header_index import build_header_index, is_query, open_header_index, parse_query, search_header_index
+
+# Headers in the style of the bundled databases
+RECORDS = [
+    ("VFG000676(gb|AAD32411) (exoS) exoenzyme S [ExoS (VF0411) - Effector delivery system (VFC0086)] [Pseudomonas aeruginosa PAO1]", "ACGT"),
+    ("VFG000677(gb|AAC44826) (exoT) exoenzyme T [ExoT (VF0411) - Effector delivery system (VFC0086)] [Pseudomonas aeruginosa PAO1]", "CGTA"),
+    ("VFG001455(gb|AAG04233) (exoU) exoenzyme U [ExoU (VF0411) - Effector delivery system (VFC0086)] [Pseudomonas aeruginosa PA14]", "GTAC"),
+    ("VFG002241(gb|BAB41455) (hlgA) gamma-hemolysin component A [Hemolysins (VF0005) - Exotoxin (VFC0235)] [Staphylococcus aureus N315]", "TACG"),
+    ("VFG002242(gb|BAB41456) (hlgB) gamma-hemolysin component B [Hemolysins (VF0005) - Exotoxin (VFC0235)] [Staphylococcus aureus N315]", "AACC"),
+    ("VFG013276(gb|WP_000733283) (lukS-PV) Panton-Valentine leukocidin [PVL (VF0018) - Exotoxin (VFC0235)] [Staphylococcus aureus]", "CCGG"),
+    ("hypothetical protein SAV0812 [Staphylococcus aureus subsp. aureus Mu50]", "GGTT"),
+    ("blaKPC-2_1 carbapenem-hydrolyzing class A beta-lactamase KPC-2 [Klebsiella pneumoniae]", "TTAA"),
+    ("tet(M)_10 tetracycline resistance protein; ribosomal protection", "ATAT"),
+]
+
+@pytest.fixture
+def connection(tmp_path):
+    """
+    Builds the header index of RECORDS.
+    """
+    index_loc = str(tmp_path / "index.sqlite")
+    build_header_index(RECORDS, index_loc, "test")
+    connection = sqlite3.connect(index_loc)
+    yield connection
+    connection.close()
+
+def search(connection, search_term):
+    """
+    Returns the headers found by a search term, in database order.
+    """
+    return [description for description, _ in search_header_index(connection, search_term)]
+
+def scan(search_term):
+    """
+    Returns the headers containing a search term, as the substring scan did.
+    """
+    return [description for description, _ in RECORDS if search_term.lower() in description.lower()]
+
+def test_plain_term_is_one_phrase():
+    assert parse_query("Staphylococcus aureus") == ("phrase", "Staphylococcus aureus")
+    # Operators are only recognised in capitals
+    assert parse_query("toxin and antitoxin") == ("phrase", "toxin and antitoxin")
+    assert parse_query("a/b") == ("phrase", "a/b")
+
+def test_consecutive_words_form_a_phrase():
+    assert parse_query("Staphylococcus aureus AND exotoxin") == ("and", [("phrase", "Staphylococcus aureus"), ("phrase", "exotoxin")])
+
+def test_not_binds_tighter_than_and_than_or():
+    assert parse_query("a OR b AND NOT c") == ("or", [("phrase", "a"), ("and", [("phrase", "b"), ("not", ("phrase", "c"))])])
+    assert parse_query("NOT a AND b OR c") == ("or", [("and", [("not", ("phrase", "a")), ("phrase", "b")]), ("phrase", "c")])
+    assert parse_query("NOT NOT a OR b") == ("or", [("not", ("not", ("phrase", "a"))), ("phrase", "b")])
+
+def test_parentheses_group():
+    assert parse_query("(a OR b) AND c") == ("and", [("or", [("phrase", "a"), ("phrase", "b")]), ("phrase", "c")])
+    assert parse_query("NOT (a AND b)") == ("not", ("and", [("phrase", "a"), ("phrase", "b")]))
+
+def test_quotes_keep_operators_and_parentheses():
+    assert parse_query("\"toxin AND antitoxin\" OR exoU") == ("or", [("phrase", "toxin AND antitoxin"), ("phrase", "exoU")])
+    assert parse_query("\"tet(M)\" OR NOT x") == ("or", [("phrase", "tet(M)"), ("not", ("phrase", "x"))])
+
+def test_regexes():
+    assert parse_query("/exo[st]/") == ("regex", "exo[st]")
+    assert parse_query("/gb\\/AA/ AND x") == ("and", [("regex", "gb\\/AA"), ("phrase", "x")])
+
+@pytest.mark.parametrize("search_term", [
+    "\"toxin OR x",
+    "/exo[st OR x",
+    "/exo[/",
+    "/(exo/ AND x",
+    "(a OR b",
+    "a OR b)",
+    "a AND",
+    "a OR OR b",
+    "NOT",
+])
+def test_invalid_queries(search_term):
+    with pytest.raises(ValueError):
+        parse_query(search_term)
+
+def test_queries_select_records(connection):
+    assert search(connection, "Staphylococcus aureus AND NOT hypothetical") == [description for description, _ in RECORDS[3:6]]
+    assert search(connection, "/EXO[st]\\)/ OR lukS") == [RECORDS[0][0], RECORDS[1][0], RECORDS[5][0]]
+    assert search(connection, "(exoU OR hlgB) AND \"[Pseudomonas\"") == [RECORDS[2][0]]
+    assert search(connection, "NOT VFG") == [description for description, _ in RECORDS[6:]]
+
+@pytest.mark.parametrize("search_term", [
+    "exoS", "EXOENZYME", "oenzym", "s aureus", "aureus N", "Staphylococcus aureus subsp. aureus",
+    "(VF0411) - Effector", "gb|AAD", "[Pseudomonas", "PAO1]", "lukS-PV", "-", " ", ")_", "tet(M)_1",
+    "class a beta", "ta-lac", "protein;", "; ribosomal", "a", "Klebsiella pneumoniae]", "nothing like it",
+])
+def test_plain_terms_match_substring_scan(connection, search_term):
+    assert search(connection, search_term) == scan(search_term)
+
+def test_random_terms_match_substring_scan(connection):
+    rng = random.Random(1)
+    for _ in range(500):
+        description = rng.choice(RECORDS)[0]
+        start = rng.randrange(len(description))
+        search_term = description[start:start + rng.randint(1, 30)]
+        if rng.random() < 0.3:
+            search_term = search_term.swapcase()
+        if not is_query(search_term):
+            assert search(connection, search_term) == scan(search_term), search_term
+
+def test_index_rebuilt_when_database_changes(tmp_path, monkeypatch):
+    monkeypatch.setattr(header_index, "HEADER_INDEX_FOLDER", str(tmp_path / "indexes"))
+    database_loc = tmp_path / "database.fasta"
+    database_loc.write_text(">a\nACGT\n")
+    reads = []
+
+    def read_records(records):
+        reads.append(records)
+        return records
+
+    open_header_index(str(database_loc), lambda: read_records([("a", "ACGT")])).close()
+    connection = open_header_index(str(database_loc), lambda: read_records([("stale", "ACGT")]))
+    assert search(connection, "a") == ["a"] and len(reads) == 1
+    connection.close()
+    database_loc.write_text(">a\nACGT\n>b\nACGT\n")
+    connection = open_header_index(str(database_loc), lambda: read_records([("a", "ACGT"), ("b", "ACGT")]))
+    assert search(connection, "NOT a") == ["b"] and len(reads) == 2
+    connection.close()
@@ -0,0 +1,88 @@
+"""
+Tests of --revalidate on TSV results: new limits, the capped flag, rows
+without an amplicon, and overlaps of assemblies split across chunks.
+"""
+import pytest
+from helpers import revalidate
+from helpers.revalidate import IDENTITY_MESSAGE, LENGTH_MESSAGE, revalidate_tsv
+from helpers.settings import CAPPED_MESSAGE
+
+COLUMNS = ["Query", "Name", "Valid", "Contig", "Start", "F_Slide", "End", "R_Slide", "Strand", "Identity",
+           "Target_Length", "Ref_Length", "Coverage_Perc_Len", "Coverage_Perc_Align", "Message", "Overlap"]
+# Results searched with a length limit of 20 and an identity limit of 0
+ROWS = [
+    ["a.fasta", "geneA", "True", "contig_1", "100", "0", "600", "0", "+", "99.5", "501", "501", "100.0", "100.0", "", "geneB"],
+    ["a.fasta", "geneB", "True", "contig_1", "500", "0", "900", "0", "+", "97.0", "401", "401", "100.0", "100.0", "", "geneA"],
+    ["a.fasta", "geneC", "False", "contig_1", "550", "0", "700", "0", "+", "98.0", "151", "189", "79.89", "100.0", LENGTH_MESSAGE, ""],
+    ["a.fasta", "geneD", "True", "contig_2", "550", "0", "700", "0", "+", "100.0", "151", "151", "100.0", "100.0", "", ""],
+    ["b.fasta", "geneA", "False", "NA", "NA", "NA", "NA", "NA", "NA", "NA", "NA", "501", "NA", "NA", "", ""],
+    ["b.fasta", "geneB", "True", "contig_1", "1", "0", "401", "0", "-", "100.0", "401", "401", "100.0", "100.0", CAPPED_MESSAGE, ""],
+    ["b.fasta", "geneC", "True", "contig_1", "1000", "0", "1150", "0", "-", "90.0", "151", "151", "100.0", "100.0", CAPPED_MESSAGE, ""],
+]
+
+@pytest.fixture
+def results_tsv(tmp_path):
+    """
+    Writes ROWS as a SPIDER results table.
+    """
+    location = tmp_path / "results.tsv"
+    location.write_text("".join("\t".join(row) + "\n" for row in [COLUMNS] + ROWS))
+    return location
+
+def revalidated(results_tsv, tmp_path, length_limit, identity_limit):
+    """
+    Revalidates a results table and returns its counts and rows as dictionaries.
+    """
+    output = tmp_path / "revalidated.tsv"
+    counts = revalidate_tsv(str(results_tsv), str(output), length_limit, identity_limit)
+    lines = output.read_text().splitlines()
+    header = lines[0].split("\t")
+    return counts, [dict(zip(header, line.split("\t"))) for line in lines[1:]]
+
+@pytest.mark.parametrize("chunk_rows", [1, 2, 3, 100])
+def test_overlaps_of_assemblies_across_chunks(results_tsv, tmp_path, monkeypatch, chunk_rows):
+    monkeypatch.setattr(revalidate, "REVALIDATE_CHUNK_ROWS", chunk_rows)
+    counts, rows = revalidated(results_tsv, tmp_path, 30, 0)
+    assert counts == (7, 6)
+    assert [row["Query"] + row["Name"] for row in rows] == [row[0] + row[1] for row in ROWS]
+    # geneC is now valid, and overlaps both amplicons on its contig
+    assert [row["Overlap"] for row in rows[:4]] == ["geneB; geneC", "geneA; geneC", "geneA; geneB", ""]
+    # Amplicons of different assemblies never overlap
+    assert all(row["Overlap"] == "" for row in rows[4:])
+
+@pytest.mark.parametrize("chunk_rows", [1, 3, 100])
+def test_output_does_not_depend_on_chunks(results_tsv, tmp_path, monkeypatch, chunk_rows):
+    expected = revalidated(results_tsv, tmp_path, 5, 98)
+    monkeypatch.setattr(revalidate, "REVALIDATE_CHUNK_ROWS", chunk_rows)
+    assert revalidated(results_tsv, tmp_path, 5, 98) == expected
+
+def test_overlaps_removed_with_invalid_rows(results_tsv, tmp_path, monkeypatch):
+    monkeypatch.setattr(revalidate, "REVALIDATE_CHUNK_ROWS", 2)
+    counts, rows = revalidated(results_tsv, tmp_path, 20, 98)
+    assert counts == (7, 3)
+    assert [(row["Valid"], row["Message"], row["Overlap"]) for row in rows[:4]] == [
+        ("True", "", ""),
+        ("False", IDENTITY_MESSAGE, ""),
+        ("False", LENGTH_MESSAGE, ""),
+        ("True", "", ""),
+    ]
+
+def test_capped_flag_kept(results_tsv, tmp_path):
+    _, rows = revalidated(results_tsv, tmp_path, 20, 95)
+    assert (rows[5]["Valid"], rows[5]["Message"]) == ("True", CAPPED_MESSAGE)
+    assert (rows[6]["Valid"], rows[6]["Message"]) == ("False", f"{IDENTITY_MESSAGE} {CAPPED_MESSAGE}")
+    _, rows = revalidated(results_tsv, tmp_path, 20, 80)
+    assert (rows[6]["Valid"], rows[6]["Message"]) == ("True", CAPPED_MESSAGE)
+
+def test_rows_without_amplicon_unchanged(results_tsv, tmp_path):
+    for length_limit, identity_limit in ((0, 100), (100, 0)):
+        _, rows = revalidated(results_tsv, tmp_path, length_limit, identity_limit)
+        assert [rows[4][column] for column in COLUMNS] == ROWS[4]
+
+def test_results_without_overlaps(results_tsv, tmp_path, monkeypatch):
+    results_tsv.write_text("".join("\t".join(row[:-1]) + "\n" for row in [COLUMNS] + ROWS))
+    monkeypatch.setattr(revalidate, "REVALIDATE_CHUNK_ROWS", 2)
+    counts, rows = revalidated(results_tsv, tmp_path, 30, 0)
+    assert counts == (7, 6)
+    assert "Overlap" not in rows[0]
+    assert [row["Valid"] for row in rows] == ["True", "True", "True", "True", "False", "True", "True"]